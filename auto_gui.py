@@ -1,19 +1,28 @@
 # Example: auto_gui.py
 import pygetwindow as gw
 import pyautogui
+import argparse
 import time
 import os
+from lifecycle import LifecycleSubscriber, WEIGHTS_LOADED
 
 READY_FILE = "controller_ready.txt"
+BIZHAWK_WINDOW_TITLE = "SNES (interim)"
 
-def wait_for_bizhawk():
-    # Wait for BizHawk window to appear (adjust as needed)
-    time.sleep(10)
+def wait_for_bizhawk(timeout=60):
+    # Wait for the BizHawk window to actually appear instead of a fixed delay
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if any(BIZHAWK_WINDOW_TITLE in w for w in gw.getAllTitles()):
+            return True
+        time.sleep(0.1)
+    print("BizHawk window did not appear in time.")
+    return False
 
 def focus_bizhawk_window():
     # Replace with the actual window title if needed
     for w in gw.getAllTitles():
-        if "SNES (interim)" in w:
+        if BIZHAWK_WINDOW_TITLE in w:
             window = gw.getWindowsWithTitle(w)[0]
             window.activate()
             window.restore()
@@ -33,19 +42,36 @@ def click_run_button():
     pyautogui.click()
     time.sleep(1)
 
-def wait_for_controller_ready():
-    while not os.path.exists(READY_FILE):
+def wait_for_controller_ready(ready_file=READY_FILE, events_port=None, timeout=120):
+    if events_port is not None:
+        # Block on the controller's "weights loaded" event (see lifecycle.py)
+        subscriber = LifecycleSubscriber(events_port)
+        try:
+            subscriber.wait_for(WEIGHTS_LOADED, timeout)
+        finally:
+            subscriber.close()
+        return
+    # Stand-alone fallback: watch for the ready file
+    while not os.path.exists(ready_file):
         time.sleep(0.5)
 
-def cleanup_and_exit():
-    if os.path.exists(READY_FILE):
-        os.remove(READY_FILE)
+def cleanup_and_exit(ready_file=READY_FILE):
+    if os.path.exists(ready_file):
+        os.remove(ready_file)
     print("Cleaned up ready file. Exiting.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drives the BizHawk GUI to start a match")
+    parser.add_argument("workdir", nargs="?", default=".",
+                        help="The run's working directory holding the ready file")
+    parser.add_argument("--events-port", type=int, default=None,
+                        help="Lifecycle hub to wait on instead of polling the ready file")
+    args = parser.parse_args()
+    ready_file = os.path.join(args.workdir, READY_FILE)
+
     wait_for_bizhawk()
     # focus_bizhawk_window()
     click_gyroscope_bot()
     #click_run_button()
-    wait_for_controller_ready()
-    cleanup_and_exit()
\ No newline at end of file
+    wait_for_controller_ready(ready_file, args.events_port)
+    cleanup_and_exit(ready_file)
@@ -1,6 +1,9 @@
 -- auto_tool_start.lua
 
-local READY_FILE = "controller_ready.txt"
+-- The launcher points each emulator at its own ready file when running in parallel
+local READY_FILE = os.getenv("SF_READY_FILE") or "controller_ready.txt"
+-- Only look at the ready file every this many frames instead of on every frame
+local READY_CHECK_FRAMES = 30
 
 -- Start emulator paused and open toolbox
 for i = 1, 10 do
@@ -11,18 +14,23 @@ client.opentoolbox()
 client.pause()
 
 
+local frames_until_check = 0
 while true do
   emu.frameadvance()
-  local f = io.open(READY_FILE, "r")
+  if frames_until_check <= 0 then
+    frames_until_check = READY_CHECK_FRAMES
+    local f = io.open(READY_FILE, "r")
 
-  if f then
-    -- File exists → game runs
-    f:close()
-    client.unpause()
-  else
-    -- File missing → break out
-    break
+    if f then
+      -- File exists → game runs
+      f:close()
+      client.unpause()
+    else
+      -- File missing → break out
+      break
+    end
   end
+  frames_until_check = frames_until_check - 1
 end
 
 -- Ensure unpaused on exit
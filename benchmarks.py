@@ -0,0 +1,344 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import numpy as np
+import protocol
+import stand_in_game
+from command import Command
+from evaluation_pool import allocate_ports
+from game_state import GameState
+from numpy_ann import NumpyANN, initial_weights, write_weights_file
+
+BASELINE_FILE = "benchmark_baseline.json"
+REGRESSION_THRESHOLD = 0.10 # Flag results more than 10% worse than the baseline
+POPULATION_SIZES = [20, 100, 1000, 5000]
+END_TO_END_FIGHT_FRAMES = 2000 # Per round of the scripted stand-in match
+END_TO_END_BASE_PORT = 12345 # First game port tried by the end-to-end runs; taken ports are skipped
+
+
+class LoopSocket:
+    """
+    Serves one message over and over, like a game that always sends the
+    same frame, and swallows whatever is sent. Keeps the network out of
+    the per-stage microbenchmarks.
+    """
+    def __init__(self, message=b""):
+        self.message = message
+        self.position = 0
+
+    def recv(self, size):
+        end = min(self.position + size, len(self.message))
+        chunk = self.message[self.position:end]
+        self.position = end % len(self.message)
+        return chunk
+
+    def recv_into(self, view):
+        chunk = self.recv(len(view))
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    def sendall(self, data):
+        pass
+
+
+class BenchmarkResult:
+    def __init__(self, name, value, unit, higher_is_better=False, spread=None):
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+        self.spread = spread
+
+    def to_dict(self):
+        return {"value": self.value, "unit": self.unit, "higher_is_better": self.higher_is_better,
+                "spread": self.spread}
+
+
+def time_call(name, fn, number, repeat):
+    """
+    Per-call time of fn in microseconds: the best of repeat runs of number
+    calls, which is the least disturbed by other load on the machine.
+    """
+    runs = [elapsed / number * 1e6 for elapsed in timeit.Timer(fn).repeat(repeat=repeat, number=number)]
+    return BenchmarkResult(name, float(min(runs)), "us", spread=float(np.median(runs) - min(runs)))
+
+
+def sample_state():
+    state = stand_in_game.game_state_dict(120, 90, 0x75, True, False, "NOT_OVER")
+    state["p2"]["in_move"] = True
+    state["p2"]["move"] = 33686533
+    state["p1"]["buttons"]["B"] = True
+    return state
+
+
+# --- Per-frame stages ---
+
+def bench_receive(number, repeat):
+    state = sample_state()
+    legacy_message = json.dumps(state).encode()
+    binary_payload = protocol.encode_state(state)
+    binary_message = protocol.FRAME_HEADER.pack(len(binary_payload)) + binary_payload
+
+    legacy = protocol.LegacyJsonConnection(LoopSocket(legacy_message))
+    binary = protocol.FramedConnection(LoopSocket(binary_message), protocol.FORMAT_BINARY)
+    game_state = GameState()
+    return [
+        time_call("receive_parse_legacy_json", lambda: GameState(legacy.receive_state()), number, repeat),
+        time_call("receive_into_legacy_json", lambda: legacy.receive_state_into(game_state), number, repeat),
+        time_call("receive_into_binary", lambda: binary.receive_state_into(game_state), number, repeat),
+    ]
+
+def bench_features(number, repeat):
+    from bot import get_input_vector, fill_input_vector, NUM_FEATURES
+    game_state = GameState(sample_state())
+    buffer = np.zeros(NUM_FEATURES, dtype=np.float32)
+    return [
+        time_call("get_input_vector", lambda: get_input_vector(game_state, "1"), number, repeat),
+        time_call("fill_input_vector", lambda: fill_input_vector(game_state, "1", buffer), number, repeat),
+    ]
+
+def bench_predict(number, repeat, keras):
+    rng = np.random.RandomState(0)
+    weights = initial_weights(rng)
+    inputs = rng.rand(15).astype(np.float32)
+    numpy_ann = NumpyANN(weights)
+    results = [time_call("ann_predict_numpy", lambda: numpy_ann.predict(inputs), number, repeat)]
+    if keras:
+        import tensorflow as tf
+        from ann import ANN
+        keras_ann = ANN()
+        keras_ann.set_weights(weights)
+        batch = inputs.reshape(1, 1, 15)
+        results.append(time_call("ann_predict_keras", lambda: keras_ann.predict(tf.constant(batch)),
+                                 max(1, number // 20), repeat))
+    return results
+
+def bench_decide(number, repeat, decision_interval):
+    """Bot.decide per frame, the network's cost spread over the frames of each decision interval."""
+    from bot import Bot
+    game_state = GameState(sample_state())
+    bot = Bot("numpy")
+    bot.ann.set_weights(initial_weights(np.random.RandomState(0)))
+    results = [time_call("bot_decide_numpy", lambda: bot.decide(game_state, "1"), number, repeat)]
+    if decision_interval > 1:
+        for frame_summary in ("last", "mean"):
+            bot.set_decision_interval(decision_interval, frame_summary)
+            results.append(time_call(f"bot_decide_numpy_k{decision_interval}_{frame_summary}",
+                                     lambda: bot.decide(game_state, "1"), number, repeat))
+    return results
+
+def bench_precision(population_sizes, repeat):
+    """PopulationANN.predict and the weight memory per genome in every storage precision."""
+    from population_ann import PopulationANN, PRECISIONS
+    rng = np.random.RandomState(0)
+    results = []
+    for size in population_sizes:
+        weights = [initial_weights(rng) for _ in range(min(size, 20))]
+        weights = [weights[i % len(weights)] for i in range(size)]
+        inputs = rng.rand(size, 15).astype(np.float32)
+        for precision in PRECISIONS:
+            network = PopulationANN(weights, precision)
+            results.append(time_call(f"population_predict_P{size}_{precision}", lambda: network.predict(inputs),
+                                     max(1, 20000 // size), repeat))
+            if size == population_sizes[0]:
+                results.append(BenchmarkResult(f"genome_bytes_{precision}", network.bytes_per_member, "bytes"))
+    return results
+
+def bench_actions(number, repeat):
+    from bot import action_mask
+    prediction = np.random.RandomState(1).rand(10).astype(np.float32)
+    # What Bot.fight did before action masks: ten separate comparisons
+    indexed = lambda: [bool(prediction[i] > 0.5) for i in range(10)]
+    return [
+        time_call("action_threshold_indexed", indexed, number, repeat),
+        time_call("action_threshold_mask", lambda: action_mask(prediction), number, repeat),
+    ]
+
+def bench_send(number, repeat):
+    command = Command()
+    command.player_buttons.A = True
+    sink = LoopSocket()
+    legacy = protocol.LegacyJsonConnection(sink)
+    binary = protocol.FramedConnection(sink, protocol.FORMAT_BINARY)
+    protocol.action_payloads(protocol.FORMAT_LEGACY, "1") # build the table outside the timing
+    return [
+        time_call("send_command_dict_json", lambda: sink.sendall(json.dumps(command.object_to_dict()).encode()),
+                  number, repeat),
+        time_call("send_command_binary", lambda: binary.send_command(command), number, repeat),
+        time_call("send_action_table", lambda: legacy.send_action("1", 0b1000101), number, repeat),
+    ]
+
+
+# --- End to end ---
+
+def bench_end_to_end(backend, fight_frames, decision_interval=1):
+    """
+    Frames per second of a full controller.py process against the scripted
+    stand-in game, timed from the controller's first reply (after TensorFlow
+    and the weights are loaded) until it hangs up. The bot runs its network
+    every decision_interval frames. The controller gets a free port, so
+    concurrent runs do not collide.
+    """
+    port = allocate_ports(1, END_TO_END_BASE_PORT)[0]
+    workdir = tempfile.mkdtemp(prefix="sf_bench_")
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    process = None
+    try:
+        write_weights_file(os.path.join(workdir, "current_weights.weights.h5"),
+                           initial_weights(np.random.RandomState(0)))
+        process = subprocess.Popen([sys.executable, os.path.join(script_dir, "controller.py"), "1",
+                                    f"--port={port}", f"--workdir={workdir}", f"--backend={backend}",
+                                    f"--decision-interval={decision_interval}"],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        client_socket = stand_in_game.connect_to_controller(port, timeout=120)
+        connection = protocol.open_connection(client_socket, protocol.FORMAT_LEGACY)
+        frames = stand_in_game.scripted_match(fight_frames=fight_frames)
+        connection.send_state(next(frames))
+        connection.receive_command()
+        played = 0
+        start = time.perf_counter()
+        try:
+            for state in frames:
+                connection.send_state(state)
+                connection.receive_command()
+                played += 1
+        except OSError:
+            pass
+        elapsed = time.perf_counter() - start
+        client_socket.close()
+        process.wait(timeout=60)
+        name = f"end_to_end_fps_{backend}" + (f"_k{decision_interval}" if decision_interval > 1 else "")
+        return BenchmarkResult(name, played / elapsed, "frames/s", higher_is_better=True)
+    finally:
+        if process is not None and process.poll() is None:
+            process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- Generation level ---
+
+def bench_generation(population_sizes, repeat):
+    import evolution
+    from genome import ANN_LAYOUT
+    results = []
+    original_size = evolution.POPULATION_SIZE
+    # The operators draw from the global RNG; seed it so every run does the same work
+    np.random.seed(0)
+    try:
+        for size in population_sizes:
+            evolution.POPULATION_SIZE = size
+            population = np.random.RandomState(size).normal(0, 0.1, (size, ANN_LAYOUT.n_params)).astype(np.float32)
+            parents = population[:max(2, size // 5)]
+            number = max(1, 2000 // size)
+            with contextlib.redirect_stdout(io.StringIO()):
+                crossover = time_call(f"crossover_P{size}", lambda: evolution.crossover(parents), number, repeat)
+                mutation = time_call(f"mutation_P{size}", lambda: evolution.mutation(population), number, repeat)
+            for result in (crossover, mutation):
+                # Milliseconds read better at this scale
+                result.value /= 1000
+                result.spread /= 1000
+                result.unit = "ms"
+                results.append(result)
+    finally:
+        evolution.POPULATION_SIZE = original_size
+    return results
+
+
+def run_benchmarks(quick=False, keras=True, end_to_end=True, only=None, decision_interval=1):
+    number, repeat = (2000, 3) if quick else (20000, 5)
+    fight_frames = END_TO_END_FIGHT_FRAMES // 4 if quick else END_TO_END_FIGHT_FRAMES
+    population_sizes = POPULATION_SIZES[:2] if quick else POPULATION_SIZES
+    stages = [
+        ("receive", lambda: bench_receive(number, repeat)),
+        ("features", lambda: bench_features(number, repeat)),
+        ("predict", lambda: bench_predict(number // 4, repeat, keras)),
+        ("decide", lambda: bench_decide(number // 4, repeat, decision_interval)),
+        ("precision", lambda: bench_precision(population_sizes, repeat)),
+        ("actions", lambda: bench_actions(number, repeat)),
+        ("send", lambda: bench_send(number, repeat)),
+        ("generation", lambda: bench_generation(population_sizes, repeat)),
+    ]
+    if end_to_end:
+        stages.append(("end_to_end", lambda: [bench_end_to_end("numpy", fight_frames)]
+                       + ([bench_end_to_end("keras", fight_frames)] if keras else [])
+                       + ([bench_end_to_end("numpy", fight_frames, decision_interval)]
+                          if decision_interval > 1 else [])))
+
+    results = []
+    for stage, bench in stages:
+        if only and only not in stage:
+            continue
+        for result in bench():
+            print(f"  {result.name:32s} {result.value:12.3f} {result.unit}")
+            results.append(result)
+    return results
+
+
+def save_results(results, path):
+    document = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": {result.name: result.to_dict() for result in results},
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+
+def compare_results(results, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """
+    Prints every result next to its baseline value and returns the names of
+    those that got worse by more than threshold (a fraction).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            print(f"  {result.name:32s} new")
+            continue
+        old = baseline[result.name]["value"]
+        change = (result.value - old) / old if old else 0.0
+        worse = -change if result.higher_is_better else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(result.name)
+        print(f"  {result.name:32s} {old:12.3f} -> {result.value:12.3f} {result.unit} ({change:+.1%}){flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for every stage of the controller hot path")
+    parser.add_argument("--quick", action="store_true", help="Fewer iterations and smaller populations")
+    parser.add_argument("--only", default=None, help="Only run stages whose name contains this")
+    parser.add_argument("--no-keras", action="store_true", help="Skip everything that needs TensorFlow")
+    parser.add_argument("--no-end-to-end", action="store_true", help="Skip the controller.py process runs")
+    parser.add_argument("--decision-interval", type=int, default=1,
+                        help="Also measure the bot deciding every this many frames (see Bot.set_decision_interval)")
+    parser.add_argument("--output", default=None, help=f"Write the results here (e.g. {BASELINE_FILE})")
+    parser.add_argument("--compare", default=None, help="Baseline file to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    print("Running benchmarks...")
+    results = run_benchmarks(args.quick, not args.no_keras, not args.no_end_to_end, args.only, args.decision_interval)
+    if args.output:
+        save_results(results, args.output)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        print(f"Comparison with {args.compare}:")
+        regressions = compare_results(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) past {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions.")
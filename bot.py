@@ -1,8 +1,9 @@
-import tensorflow as tf
 from command import Command
 from buttons import Buttons
-from ann import ANN
+from numpy_ann import NumpyANN
+from protocol import ACTION_BUTTONS
 import numpy as np
+import time
 
 # Normalization constants from observed game data
 MAX_HEALTH = 176.0
@@ -11,10 +12,12 @@ MAX_Y_COORD = 192.0
 MAX_TIMER = 153.0
 MAX_MOVE_ID = 33686533.0
 
-def get_input_vector(game_state, player_number):
+NUM_FEATURES = 15
+
+def fill_input_vector(game_state, player_number, out):
     """
-    Flattens the complex game_state object into a simple, normalized
-    15-feature vector for the ANN.
+    Writes the normalized 15-feature vector for the ANN into out, a
+    preallocated array, so the per-frame path allocates no new arrays.
     """
     if player_number == "1":
         me = game_state.player1
@@ -23,87 +26,216 @@ def get_input_vector(game_state, player_number):
         me = game_state.player2
         opponent = game_state.player1
 
+    my_health = me.health
+    my_x = me.x_coord
+    opp_health = opponent.health
+    opp_x = opponent.x_coord
+
     # Self features
-    my_health = me.health / MAX_HEALTH
-    my_x = me.x_coord / MAX_X_COORD
-    my_y = me.y_coord / MAX_Y_COORD
-    my_is_jumping = 1.0 if me.is_jumping else 0.0
-    my_is_crouching = 1.0 if me.is_crouching else 0.0
+    out[0] = my_health / MAX_HEALTH
+    out[1] = my_x / MAX_X_COORD
+    out[2] = me.y_coord / MAX_Y_COORD
+    out[3] = 1.0 if me.is_jumping else 0.0
+    out[4] = 1.0 if me.is_crouching else 0.0
 
     # Opponent features
-    opp_health = opponent.health / MAX_HEALTH
-    opp_x = opponent.x_coord / MAX_X_COORD
-    opp_y = opponent.y_coord / MAX_Y_COORD
-    opp_is_jumping = 1.0 if opponent.is_jumping else 0.0
-    opp_is_crouching = 1.0 if opponent.is_crouching else 0.0
-    opp_is_in_move = 1.0 if opponent.is_player_in_move else 0.0
-    opp_move_id = opponent.move_id / MAX_MOVE_ID
+    out[5] = opp_health / MAX_HEALTH
+    out[6] = opp_x / MAX_X_COORD
+    out[7] = opponent.y_coord / MAX_Y_COORD
+    out[8] = 1.0 if opponent.is_jumping else 0.0
+    out[9] = 1.0 if opponent.is_crouching else 0.0
+    out[10] = 1.0 if opponent.is_player_in_move else 0.0
+    out[11] = opponent.move_id / MAX_MOVE_ID
 
     # Relational features
-    relative_x = (me.x_coord - opponent.x_coord) / MAX_X_COORD
-    relative_health = (me.health - opponent.health) / MAX_HEALTH
-    timer = game_state.timer / MAX_TIMER
+    out[12] = (my_x - opp_x) / MAX_X_COORD
+    out[13] = (my_health - opp_health) / MAX_HEALTH
+    out[14] = game_state.timer / MAX_TIMER
+    return out
 
-    return np.array([
-        my_health, my_x, my_y, my_is_jumping, my_is_crouching,
-        opp_health, opp_x, opp_y, opp_is_jumping, opp_is_crouching,
-        opp_is_in_move, opp_move_id,
-        relative_x, relative_health, timer
-    ])
+def get_input_vector(game_state, player_number):
+    """
+    Flattens the complex game_state object into a simple, normalized
+    15-feature vector for the ANN.
+    """
+    return fill_input_vector(game_state, player_number, np.empty(NUM_FEATURES))
+
+# Bit weights turning the 10 thresholded outputs into one action mask
+ACTION_BITS = 1 << np.arange(len(ACTION_BUTTONS))
+
+def action_mask(prediction):
+    """Thresholds the 10 button probabilities at 0.5 into a 10-bit mask in one vectorized step."""
+    return int(np.dot(prediction > 0.5, ACTION_BITS))
+
+# What the network sees when it only runs every few frames (see
+# Bot.set_decision_interval): the frame it runs on, or the mean features
+# of every frame since it last ran
+FRAME_SUMMARIES = ("last", "mean")
+
+def apply_action_mask(buttons, mask):
+    """Sets the 10 combat buttons of a Buttons object from an action mask."""
+    for bit, attribute in enumerate(ACTION_BUTTONS):
+        setattr(buttons, attribute, bool(mask >> bit & 1))
 
 class Bot:
     """
     The Bot class now acts as a wrapper for the ANN.
     It translates game state for the ANN and ANN output into commands.
     """
-    def __init__(self):
-        self.ann = ANN()
-        self.my_command = Command()
+    def __init__(self, backend="keras", ann=None, decision_interval=1, frame_summary="last"):
+        # "keras" runs the compiled TensorFlow graph, "numpy" runs the same
+        # network through NumpyANN without any framework dispatch per frame.
+        # TensorFlow is only imported for the Keras backend, so processes
+        # running NumPy inference never pay for its runtime.
+        self.backend = backend
+        if backend == "numpy":
+            self.ann = NumpyANN()
+        elif backend == "keras":
+            import tensorflow as tf
+            from ann import ANN
+            self.ann = ANN()
+            self.to_tensor = tf.constant
+        elif backend == "external":
+            # Decisions are made elsewhere and handed in with use_action (see
+            # multi_controller.py); ann only has to reset_hidden_state()
+            self.ann = ann
+        else:
+            raise ValueError(f"Unknown inference backend: {backend}")
+        self._my_command = Command()
         self.buttn = Buttons()
+        # Last decision not yet copied into my_command (see decide)
+        self.pending_action = None
+        self.pending_player = None
+        # Time spent in the last decide() call, in ns (see latency.py)
+        self.feature_ns = 0
+        self.inference_ns = 0
+        # Feature buffer refilled every frame; float32 is what both backends consume
+        self.input_vector = np.zeros(NUM_FEATURES, dtype=np.float32)
+        self.input_batch = self.input_vector.reshape(1, 1, NUM_FEATURES)
+        # Features of the current frame and their running sum, for the "mean" summary
+        self.frame_vector = np.zeros(NUM_FEATURES, dtype=np.float32)
+        self.feature_sum = np.zeros(NUM_FEATURES, dtype=np.float32)
+        self.last_action = 0
+        self.set_decision_interval(decision_interval, frame_summary)
+
+    def set_decision_interval(self, decision_interval, frame_summary="last"):
+        """
+        Runs the network on one frame in every decision_interval and repeats
+        its action on the frames in between. frame_summary is what the
+        network is fed when it runs (see FRAME_SUMMARIES). The GRU takes one
+        step per decision, not per frame, so each of its steps spans
+        decision_interval frames; reset() makes the first frame of every
+        round a decision, as it is with a decision_interval of 1.
+        """
+        if decision_interval < 1:
+            raise ValueError(f"Decision interval must be at least 1, got {decision_interval}")
+        if frame_summary not in FRAME_SUMMARIES:
+            raise ValueError(f"Unknown frame summary: {frame_summary}")
+        self.decision_interval = decision_interval
+        self.frame_summary = frame_summary
+        self.frames_to_decision = 0
+        self.summarized_frames = 0
 
     def reset(self):
         """
         Resets the bot's state for a new round. Critically, this also
         resets the hidden state of the recurrent neural network.
         """
-        self.ann.reset_hidden_state()
+        if self.ann is not None:
+            self.ann.reset_hidden_state()
         self.buttn = Buttons()
-        self.my_command = Command()
+        self.pending_action = None
+        self._my_command = Command()
+        self.last_action = 0
+        self.frames_to_decision = 0
+        self.summarized_frames = 0
 
-    def fight(self, current_game_state, player):
+    @property
+    def my_command(self):
         """
-        The main decision-making function, now driven entirely by the ANN.
+        The command holding the bot's current buttons. Decisions made with
+        decide() are only written into it when it is read.
+        """
+        if self.pending_action is not None:
+            self._apply_action(self.pending_action, self.pending_player)
+        return self._my_command
+
+    @my_command.setter
+    def my_command(self, command):
+        self.pending_action = None
+        self._my_command = command
+
+    def prepare(self, current_game_state, player):
+        """
+        Takes in the current frame's features. Returns True when the network
+        has to run on this frame, with its input in input_vector, or False
+        when the last action is to be repeated (see set_decision_interval).
+        """
+        if self.decision_interval == 1:
+            fill_input_vector(current_game_state, player, self.input_vector)
+            return True
+        if self.frame_summary == "mean":
+            fill_input_vector(current_game_state, player, self.frame_vector)
+            if self.summarized_frames:
+                self.feature_sum += self.frame_vector
+            else:
+                self.feature_sum[:] = self.frame_vector
+            self.summarized_frames += 1
+        if self.frames_to_decision:
+            self.frames_to_decision -= 1
+            return False
+        self.frames_to_decision = self.decision_interval - 1
+        if self.frame_summary == "mean":
+            np.divide(self.feature_sum, self.summarized_frames, out=self.input_vector)
+            self.summarized_frames = 0
+        else:
+            fill_input_vector(current_game_state, player, self.input_vector)
+        return True
+
+    def decide(self, current_game_state, player):
+        """
+        Runs the ANN on the current frame and returns the decision as an
+        action mask (bit i is ACTION_BUTTONS[i]), ready for
+        connection.send_action. Buttons objects are left untouched until
+        my_command is read. Between decisions the last action is returned
+        without running the ANN (see set_decision_interval).
         """
-        # 1. Convert game state to a feature vector and then to a Tensor
-        input_vector = get_input_vector(current_game_state, player)
-        input_tensor = tf.constant(input_vector.reshape(1, 1, -1), dtype=tf.float32)
-
-        # 2. Get the ANN's prediction using the compiled graph
-        prediction = self.ann.predict(input_tensor)
-
-        # 3. Translate the prediction into button presses
-        # The ANN outputs 10 values, we map them to the 10 combat buttons.
-        # We must explicitly cast the numpy.bool_ to a standard Python bool
-        # for the value to be JSON serializable.
-        self.buttn.up = bool(prediction[0] > 0.5)
-        self.buttn.down = bool(prediction[1] > 0.5)
-        self.buttn.left = bool(prediction[2] > 0.5)
-        self.buttn.right = bool(prediction[3] > 0.5)
-        self.buttn.Y = bool(prediction[4] > 0.5)
-        self.buttn.B = bool(prediction[5] > 0.5)
-        self.buttn.A = bool(prediction[6] > 0.5)
-        self.buttn.X = bool(prediction[7] > 0.5)
-        self.buttn.L = bool(prediction[8] > 0.5)
-        self.buttn.R = bool(prediction[9] > 0.5)
-        
+        start = time.perf_counter_ns()
+        run_network = self.prepare(current_game_state, player)
+        features_done = time.perf_counter_ns()
+        self.feature_ns = features_done - start
+        if not run_network:
+            self.inference_ns = 0
+            self.use_action(self.last_action, player)
+            return self.last_action
+        if self.backend == "numpy":
+            prediction = self.ann.predict(self.input_vector)
+        else:
+            prediction = self.ann.predict(self.to_tensor(self.input_batch)).numpy()
+        self.use_action(action_mask(prediction), player)
+        self.inference_ns = time.perf_counter_ns() - features_done
+        return self.last_action
+
+    def use_action(self, mask, player):
+        """Takes a decision made outside decide(), as an action mask, like decide() would."""
+        self.pending_action = mask
+        self.pending_player = player
+        self.last_action = mask
+
+    def _apply_action(self, mask, player):
+        self.pending_action = None
+        apply_action_mask(self.buttn, mask)
         # Select and Start are always False
         self.buttn.select = False
         self.buttn.start = False
-
-        # 4. Assign the buttons to the correct player and return the command
         if player == "1":
-            self.my_command.player_buttons = self.buttn
+            self._my_command.player_buttons = self.buttn
         elif player == "2":
-            self.my_command.player2_buttons = self.buttn
-            
-        return self.my_command
\ No newline at end of file
+            self._my_command.player2_buttons = self.buttn
+
+    def fight(self, current_game_state, player):
+        """
+        The main decision-making function, now driven entirely by the ANN.
+        """
+        self.decide(current_game_state, player)
+        return self.my_command
@@ -1,5 +1,6 @@
 
 class Buttons:
+    __slots__ = ("up", "down", "right", "left", "select", "start", "Y", "B", "X", "A", "L", "R")
 
     def __init__(self, buttons_dict=None):
 
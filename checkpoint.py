@@ -0,0 +1,92 @@
+import os
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+
+class RunState:
+    """
+    Everything evolution.run_generations needs to carry on where it
+    stopped: the population about to be evaluated and the indices of each
+    individual's parents in the previous one, the generation it belongs
+    to, the global NumPy RNG state, the overall best genome, the best and
+    average fitness of every finished generation, the last generation's
+    fitness scores and the fitness cache. Steady-state runs also keep
+    population_fitness, the score of every member of the population (NaN
+    for members still to be played).
+    """
+    def __init__(self, population, generation=0, overall_best_fitness=-np.inf, overall_best_individual=None,
+                 history=None, last_fitness_scores=None, cache_arrays=None, rng_state=None, lineage=None,
+                 population_fitness=None):
+        self.population = population
+        self.population_fitness = population_fitness
+        self.lineage = lineage
+        self.generation = generation
+        self.overall_best_fitness = overall_best_fitness
+        self.overall_best_individual = overall_best_individual
+        self.history = history if history is not None else []
+        self.last_fitness_scores = last_fitness_scores
+        self.cache_arrays = cache_arrays
+        self.rng_state = rng_state
+
+
+def save_checkpoint(path, state):
+    """
+    Writes a RunState to path as one uncompressed .npz. The file is written
+    next to the target, flushed to disk and renamed over it, so a crash
+    mid-write leaves the previous checkpoint intact.
+    """
+    algorithm, keys, position, has_gauss, cached_gaussian = state.rng_state or np.random.get_state()
+    arrays = {
+        "version": np.array(CHECKPOINT_VERSION),
+        "population": state.population,
+        "population_fitness": np.array(state.population_fitness if state.population_fitness is not None else [],
+                                       dtype=np.float64),
+        "lineage": state.lineage if state.lineage is not None else np.empty((0, 2), dtype=np.int64),
+        "generation": np.array(state.generation),
+        "overall_best_fitness": np.array(state.overall_best_fitness, dtype=np.float64),
+        "overall_best_individual": (state.overall_best_individual if state.overall_best_individual is not None
+                                    else np.empty(0, dtype=np.float32)),
+        "history": np.array(state.history, dtype=np.float64).reshape(-1, 2),
+        "last_fitness_scores": np.array(state.last_fitness_scores if state.last_fitness_scores is not None else [],
+                                        dtype=np.float64),
+        "rng_algorithm": np.array(algorithm),
+        "rng_keys": keys,
+        "rng_position": np.array(position),
+        "rng_has_gauss": np.array(has_gauss),
+        "rng_cached_gaussian": np.array(cached_gaussian),
+    }
+    for name, array in (state.cache_arrays or {}).items():
+        arrays[f"cache_{name}"] = array
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    """Reads a checkpoint written by save_checkpoint back into a RunState."""
+    with np.load(path) as data:
+        if int(data["version"]) != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {int(data['version'])}")
+        overall_best_individual = data["overall_best_individual"]
+        # Checkpoints from before lineage and population_fitness were kept have neither
+        lineage = data["lineage"] if "lineage" in data.files else np.empty(0)
+        population_fitness = data["population_fitness"] if "population_fitness" in data.files else np.empty(0)
+        cache_arrays = {name[len("cache_"):]: data[name] for name in data.files if name.startswith("cache_")}
+        return RunState(
+            population=data["population"],
+            lineage=lineage if lineage.size else None,
+            population_fitness=population_fitness if population_fitness.size else None,
+            generation=int(data["generation"]),
+            overall_best_fitness=float(data["overall_best_fitness"]),
+            overall_best_individual=overall_best_individual if overall_best_individual.size else None,
+            history=[tuple(row) for row in data["history"].tolist()],
+            last_fitness_scores=data["last_fitness_scores"].tolist() or None,
+            cache_arrays=cache_arrays or None,
+            rng_state=(str(data["rng_algorithm"]), data["rng_keys"], int(data["rng_position"]),
+                       int(data["rng_has_gauss"]), float(data["rng_cached_gaussian"])),
+        )
@@ -0,0 +1,358 @@
+import argparse
+import base64
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+from evaluation_pool import evaluate_population
+
+# The coordinator and its workers talk newline-delimited JSON over TCP, like
+# the controller daemon's control channel. Workers send "hello" (with their
+# number of slots), "heartbeat" and "result"; the coordinator sends "job"
+# and, when the run is over, "shutdown". There is no authentication: only
+# run a coordinator on a network whose hosts are trusted.
+DEFAULT_COORDINATOR_PORT = 9500
+HEARTBEAT_INTERVAL = 5 # Seconds between a worker's heartbeats
+HEARTBEAT_TIMEOUT = 30 # A worker silent for this long is dropped and its jobs handed to others
+RECONNECT_DELAY = 5 # Seconds a worker waits before reconnecting to a lost coordinator
+
+# Match settings a job may carry; the worker passes them on to its
+# evaluation function (see evolution.evaluate_fitness)
+JOB_SETTINGS = ["stop_below", "decision_interval", "frame_summary"]
+
+
+def encode_genome(genome):
+    return base64.b64encode(np.asarray(genome, dtype=np.float32).tobytes()).decode("ascii")
+
+def decode_genome(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+class Channel:
+    """One end of a JSON-lines connection; sends may come from several threads."""
+    def __init__(self, sock):
+        self.socket = sock
+        self.stream = sock.makefile("rw")
+        self.send_lock = threading.Lock()
+
+    def send(self, message):
+        with self.send_lock:
+            self.stream.write(json.dumps(message) + "\n")
+            self.stream.flush()
+
+    def receive(self):
+        """The next message, or None once the peer has hung up."""
+        line = self.stream.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        # Shut the socket down first: it wakes a thread blocked in receive(),
+        # which holds the stream's lock that close() would wait for
+        for closer in (lambda: self.socket.shutdown(socket.SHUT_RDWR), self.stream.close, self.socket.close):
+            try:
+                closer()
+            except OSError:
+                pass
+
+
+class Job:
+    __slots__ = ("job_id", "individual_id", "genome", "settings", "avoid", "future")
+
+    def __init__(self, job_id, individual_id, genome, settings, avoid):
+        self.job_id = job_id
+        self.individual_id = individual_id
+        self.genome = genome
+        self.settings = settings
+        self.avoid = avoid
+        self.future = Future()
+        # Where the job was played, like evaluation_pool.EvaluationPool futures: (worker name, slot id)
+        self.future.placement = {}
+
+
+class RemoteWorker:
+    """The coordinator's view of one connected worker agent."""
+    def __init__(self, channel, address):
+        self.channel = channel
+        self.address = address
+        self.name = f"{address[0]}:{address[1]}"
+        self.slots = 0
+        self.running = {} # job_id -> Job
+        self.last_seen = time.monotonic()
+        self.alive = True
+
+
+class Coordinator:
+    """
+    Hands genome jobs to worker agents on other hosts (run_worker) and
+    collects their results, with the same submit / evaluate_population /
+    num_workers / close interface as EvaluationPool, so evolution.py can
+    use either.
+
+    Every worker gets as many jobs at once as it has slots. A worker whose
+    connection drops, or whose heartbeat stops for heartbeat_timeout
+    seconds, is dropped and its running jobs go back to the front of the
+    queue for the others. score(results, individual_id) turns a worker's
+    results dict (None for a failed match) into the fitness the Future
+    resolves to.
+    """
+    def __init__(self, score, port=DEFAULT_COORDINATOR_PORT, host="0.0.0.0", heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.score = score
+        self.heartbeat_timeout = heartbeat_timeout
+        self.lock = threading.RLock()
+        self.workers_changed = threading.Condition(self.lock)
+        self.queue = deque()
+        self.jobs = {}
+        self.workers = []
+        self.next_job_id = 0
+        self.closed = False
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        print(f"Coordinator waiting for workers on port {self.port}")
+        threading.Thread(target=self._accept_loop, name="coordinator-accept", daemon=True).start()
+        threading.Thread(target=self._monitor_loop, name="coordinator-monitor", daemon=True).start()
+
+    @property
+    def num_workers(self):
+        """Slots of all connected workers (at least 1, so callers always have work queued)."""
+        with self.lock:
+            return max(1, sum(worker.slots for worker in self.workers))
+
+    def wait_for_workers(self, count=1, timeout=None):
+        """Blocks until count workers are connected; returns whether they are."""
+        with self.lock:
+            return self.workers_changed.wait_for(lambda: len(self.workers) >= count, timeout)
+
+    def submit(self, individual, individual_id, avoid=None, **settings):
+        """
+        Queues one evaluation and returns a Future of its fitness. settings
+        (JOB_SETTINGS) travel with the job to the worker's evaluation function.
+        avoid, a (worker name, slot id) placement, keeps the job off that slot.
+        """
+        unknown = set(settings) - set(JOB_SETTINGS)
+        if unknown:
+            raise ValueError(f"Settings workers do not know: {sorted(unknown)}")
+        with self.lock:
+            self.next_job_id += 1
+            job = Job(self.next_job_id, individual_id, encode_genome(individual), settings, avoid)
+            self.jobs[job.job_id] = job
+            self.queue.append(job)
+            self._dispatch()
+        return job.future
+
+    def evaluate_population(self, population, individual_ids=None, **settings):
+        """Evaluates every individual on the connected workers (see evaluation_pool.evaluate_population)."""
+        return evaluate_population(self.submit, population, individual_ids, **settings)
+
+    def _dispatch(self):
+        with self.lock:
+            for worker in list(self.workers):
+                while self.queue and worker.alive and len(worker.running) < worker.slots:
+                    job = self.queue.popleft()
+                    worker.running[job.job_id] = job
+                    message = dict(job.settings, type="job", job_id=job.job_id,
+                                   individual_id=job.individual_id, genome=job.genome)
+                    if job.avoid is not None and job.avoid[0] == worker.name:
+                        message["avoid_slot"] = job.avoid[1]
+                    try:
+                        worker.channel.send(message)
+                    except OSError as e:
+                        self._drop(worker, f"send failed: {e}")
+
+    def _drop(self, worker, reason):
+        with self.lock:
+            if not worker.alive:
+                return
+            worker.alive = False
+            if worker in self.workers: # it may not have said hello yet
+                self.workers.remove(worker)
+            lost = [job for job in worker.running.values() if not job.future.done()]
+            worker.running.clear()
+            self.queue.extendleft(reversed(lost))
+            self.workers_changed.notify_all()
+        worker.channel.close()
+        print(f"Worker {worker.name} lost ({reason}); {len(lost)} job(s) requeued")
+        self._dispatch()
+
+    def _accept_loop(self):
+        while not self.closed:
+            try:
+                sock, address = self.server.accept()
+            except OSError:
+                return
+            worker = RemoteWorker(Channel(sock), address)
+            threading.Thread(target=self._serve_worker, args=(worker,), name=f"coordinator-{worker.name}",
+                             daemon=True).start()
+
+    def _serve_worker(self, worker):
+        try:
+            while True:
+                message = worker.channel.receive()
+                if message is None:
+                    break
+                worker.last_seen = time.monotonic()
+                if message["type"] == "hello":
+                    with self.lock:
+                        worker.name = message.get("name") or worker.name
+                        worker.slots = int(message["slots"])
+                        self.workers.append(worker)
+                        self.workers_changed.notify_all()
+                    print(f"Worker {worker.name} joined with {worker.slots} slot(s)")
+                    self._dispatch()
+                elif message["type"] == "result":
+                    self._finish(worker, message)
+        except (OSError, ValueError, KeyError) as e:
+            self._drop(worker, str(e))
+            return
+        self._drop(worker, "disconnected")
+
+    def _finish(self, worker, message):
+        with self.lock:
+            worker.running.pop(message["job_id"], None)
+            # A requeued job may finish twice; the first result wins
+            job = self.jobs.pop(message["job_id"], None)
+        if job is not None and not job.future.done():
+            job.future.placement["slot"] = (worker.name, message.get("slot"))
+            job.future.set_result(self.score(message.get("results"), job.individual_id))
+        self._dispatch()
+
+    def _monitor_loop(self):
+        while not self.closed:
+            time.sleep(1.0)
+            now = time.monotonic()
+            with self.lock:
+                silent = [worker for worker in self.workers if now - worker.last_seen > self.heartbeat_timeout]
+            for worker in silent:
+                self._drop(worker, "heartbeat timeout")
+
+    def close(self, cancel=False):
+        """
+        Tells every worker the run is over and stops listening. Jobs still
+        out are never waited for, so cancel changes nothing here.
+        """
+        self.closed = True
+        with self.lock:
+            workers = list(self.workers)
+        for worker in workers:
+            try:
+                worker.channel.send({"type": "shutdown"})
+            except OSError:
+                pass
+            worker.channel.close()
+        self.server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def run_worker(host, port, pool, name=None):
+    """
+    Serves one coordinator: plays every job it sends on the local pool (an
+    EvaluationPool whose evaluation function returns the match's results
+    dict, like evolution.run_match_with_retries) and sends the results back. Reconnects
+    whenever the coordinator goes away, until it says the run is over.
+    """
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    state = {"channel": None, "shutdown": False}
+    state_lock = threading.Lock()
+
+    def send(message):
+        with state_lock:
+            channel = state["channel"]
+        if channel is None:
+            return # Lost with the connection; the coordinator has already requeued the job
+        try:
+            channel.send(message)
+        except OSError:
+            pass
+
+    def report(job_id, future):
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Job {job_id} crashed: {e}")
+            results = None
+        send({"type": "result", "job_id": job_id, "results": results, "slot": future.placement.get("slot")})
+
+    def heartbeat():
+        while not state["shutdown"]:
+            time.sleep(HEARTBEAT_INTERVAL)
+            send({"type": "heartbeat"})
+
+    threading.Thread(target=heartbeat, name="worker-heartbeat", daemon=True).start()
+    while not state["shutdown"]:
+        try:
+            sock = socket.create_connection((host, port))
+        except OSError as e:
+            print(f"Could not reach coordinator {host}:{port} ({e}); retrying in {RECONNECT_DELAY}s")
+            time.sleep(RECONNECT_DELAY)
+            continue
+        channel = Channel(sock)
+        with state_lock:
+            state["channel"] = channel
+        channel.send({"type": "hello", "slots": pool.num_workers, "name": name})
+        print(f"Connected to coordinator {host}:{port} as {name}")
+        try:
+            while True:
+                message = channel.receive()
+                if message is None:
+                    break
+                if message["type"] == "job":
+                    settings = {name: message[name] for name in JOB_SETTINGS if name in message}
+                    future = pool.submit(decode_genome(message["genome"]), message["individual_id"],
+                                         avoid=message.get("avoid_slot"), **settings)
+                    future.add_done_callback(lambda done, job_id=message["job_id"]: report(job_id, done))
+                elif message["type"] == "shutdown":
+                    state["shutdown"] = True
+                    break
+        except (OSError, ValueError) as e:
+            print(f"Connection to coordinator lost: {e}")
+        with state_lock:
+            state["channel"] = None
+        channel.close()
+        if not state["shutdown"]:
+            time.sleep(RECONNECT_DELAY)
+    print("Coordinator finished the run; worker exiting.")
+
+
+if __name__ == '__main__':
+    import evolution
+    parser = argparse.ArgumentParser(description="Distributed evaluation: a coordinator holds the population, "
+                                                 "workers on any host play its matches")
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinator = commands.add_parser("coordinator", help="Run evolution.py, serving matches to remote workers")
+    coordinator.add_argument("--port", type=int, default=evolution.COORDINATOR_PORT)
+    worker = commands.add_parser("worker", help="Play matches for a coordinator")
+    worker.add_argument("coordinator", help="host:port of the coordinator")
+    worker.add_argument("--slots", type=int, default=evolution.NUM_PARALLEL_EVALUATIONS,
+                        help="Matches this host runs at once")
+    worker.add_argument("--base-port", type=int, default=evolution.CONTROLLER_PORT,
+                        help="First controller port to try; give workers sharing a host disjoint ranges")
+    worker.add_argument("--name", default=None)
+    worker.add_argument("--game-backend", choices=["bizhawk", "simulator", "stand_in"], default=None,
+                        help="Overrides GAME_BACKEND in evolution.py")
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        evolution.DISTRIBUTED = True
+        evolution.COORDINATOR_PORT = args.port
+        evolution.main()
+    else:
+        if args.game_backend:
+            evolution.GAME_BACKEND = args.game_backend
+        host, _, port = args.coordinator.rpartition(":")
+        pool = evolution.create_pool(evolution.run_match_with_retries, args.slots, args.base_port)
+        try:
+            run_worker(host, int(port), pool, args.name)
+        finally:
+            pool.close()
@@ -1,6 +1,7 @@
 from buttons import Buttons
 
 class Command:
+    __slots__ = ("player_buttons", "player2_buttons", "type", "__player_count", "save_game_path")
 
     def __init__(self):
 
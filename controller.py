@@ -1,283 +1,595 @@
 import socket
 import json
+import argparse
+import base64
+import numpy as np
 from game_state import GameState
 import sys
-from bot import Bot
+from bot import Bot, FRAME_SUMMARIES
+from genome import ANN_LAYOUT
+import lifecycle
+import protocol
+from lifecycle import LifecyclePublisher
+from match_trace import TraceRecorder, CONTROLLER_STATES, NO_ROUND_RESULT, ROUND_LOST, ROUND_WON, MATCH_FORFEITED
+from latency import FrameLatency, DEFAULT_FRAME_BUDGET_MS
+from early_stop import make_policies, check_policies
+from fitness import forfeit
+from numpy_ann import read_decision_settings
 import random
 import os
 import time
 
 READY_FILE = "controller_ready.txt"
+WEIGHTS_FILE = "current_weights.weights.h5"
+RESULTS_FILE = "fitness_results.json"
+DEFAULT_PORTS = {"1": 9999, "2": 10000}
+# "keras" or "numpy" (see numpy_ann.py); both load the same .weights.h5 files
+INFERENCE_BACKEND = "keras"
+PROGRESS_EVERY_FRAMES = 60 # Frames between the heartbeats the evaluation supervisor watches for stalls
 
-def connect(port):
+def listen(port):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind(("127.0.0.1", port))
     server_socket.listen(5)
+    return server_socket
+
+def connect(port):
+    server_socket = listen(port)
     (client_socket, _) = server_socket.accept()
     print ("Connected to game!")
     
     return client_socket
 
-def send(client_socket, command):
-    command_dict = command.object_to_dict()
-    pay_load = json.dumps(command_dict).encode()
-    client_socket.sendall(pay_load)
+def send(connection, command):
+    # The connection encodes the command in the negotiated format (see protocol.py)
+    connection.send_command(command)
 
-def receive(client_socket):
-    pay_load = client_socket.recv(4096)
-    input_dict = json.loads(pay_load.decode())
-    game_state = GameState(input_dict)
+def receive(connection, game_state=None):
+    # Decodes into game_state in place when one is given, so a match
+    # reuses the same objects every frame
+    game_state = game_state or GameState()
+    connection.receive_state_into(game_state)
     return game_state
 
-def main():
-    start_time = time.time()
-    print(f"[{time.time() - start_time:.2f}s] Controller starting...")
-    print(f"[{time.time() - start_time:.2f}s] Using Python interpreter: {sys.executable}")
+# Match state machine states (names in match_trace.CONTROLLER_STATES)
+CHARACTER_SELECT = -1
+IDLE = 0
+FIGHTING = 1
+MATCH_OVER = 2
 
-    if (sys.argv[1]=='1'):
-        client_socket = connect(9999)
-    elif (sys.argv[1]=='2'):
-        client_socket = connect(10000)
-    
-    print(f"[{time.time() - start_time:.2f}s] Socket connected.")
 
-    bot = Bot()
-    print(f"[{time.time() - start_time:.2f}s] Bot object created.")
+class MatchSession:
+    """
+    The match state machine of one game connection: character selection,
+    round edges, win detection and the running fitness tallies. It does no
+    I/O of its own; observe() is fed every decoded frame and says what to
+    send back, so the same session drives both the blocking play_match loop
+    and multi_controller.py's asyncio connections.
+    """
+    def __init__(self, bot, player, events=None, stop_policies=None):
+        self.bot = bot
+        self.player = player
+        self.events = events or LifecyclePublisher()
+        self.stop_policies = stop_policies or []
+        for policy in self.stop_policies:
+            policy.reset()
+        self.truncated = None
+        # What the last observed frame decided (match_trace's round_result column)
+        self.round_result = NO_ROUND_RESULT
 
-    bot.ann.load_weights("current_weights.weights.h5")
-    print(f"[{time.time() - start_time:.2f}s] ANN weights loaded.")
+        # Match-specific data
+        self.fight_history = []
+        self.damage_dealt = 0
+        self.damage_taken = 0
+        self.health_bonus = 0
+        self.time_bonus = 0
+        self.distance_values = []
+        self.last_opponent_health = 176
+        self.last_bot_health = 176
+        self.state = CHARACTER_SELECT
 
-    # Signal to Lua script that controller is ready after loading weights
-    with open(READY_FILE, "w") as f:
-        f.write("ready")
-    print(f"[{time.time() - start_time:.2f}s] Controller ready signal sent after ANN loaded.")
+        # Character selection variables
+        self.char_select_frames = random.randint(5, 15)
+        self.frames_waited = 0
+
+        # Edge detection variables
+        self.prev_round_started = False
+        self.prev_round_over = False
+        self.prev_timer = None
+        self.timer_stuck_count = 0
+        self.idle_frames = 0  # Counter to ensure we stay in idle long enough
+
+    @property
+    def over(self):
+        return self.state == MATCH_OVER
+
+    def observe(self, game_state):
+        """
+        Advances the state machine by one frame. Returns the Command to send,
+        or None when the bot is fighting and must decide this frame's action.
+        """
+        bot = self.bot
+        player = self.player
+        bot_command = None
+        self.round_result = NO_ROUND_RESULT
 
-    # Match-specific data
-    fight_history = []
-    damage_dealt = 0
-    damage_taken = 0
-    health_bonus = 0
-    time_bonus = 0
-    distance_values = []
-    last_opponent_health = 176
-    last_bot_health = 176
-
-    # State machine states
-    CHARACTER_SELECT = -1
-    IDLE = 0
-    FIGHTING = 1
-    MATCH_OVER = 2
-    current_state = CHARACTER_SELECT
-    
-    # Character selection variables
-    char_select_frames = random.randint(5, 15)
-    frames_waited = 0
-    
-    # Edge detection variables
-    prev_round_started = False
-    prev_round_over = False
-    prev_timer = None
-    timer_stuck_count = 0
-    idle_frames = 0  # Counter to ensure we stay in idle long enough
-
-    while current_state != MATCH_OVER:
-        game_state = receive(client_socket)
-        
         # Current frame flags
         curr_round_started = game_state.has_round_started
         curr_round_over = game_state.is_round_over
 
         # Timer stagnation detection
-        if prev_timer is not None and current_state == FIGHTING:
-            if game_state.timer == prev_timer:
-                timer_stuck_count += 1
+        if self.prev_timer is not None and self.state == FIGHTING:
+            if game_state.timer == self.prev_timer:
+                self.timer_stuck_count += 1
             else:
-                timer_stuck_count = 0
+                self.timer_stuck_count = 0
 
-        if current_state == CHARACTER_SELECT:
-            if frames_waited < char_select_frames:
+        if self.state == CHARACTER_SELECT:
+            if self.frames_waited < self.char_select_frames:
                 # Move cursor randomly
                 bot.my_command.player_buttons.up = random.choice([True, False])
                 bot.my_command.player_buttons.down = random.choice([True, False])
                 bot.my_command.player_buttons.left = random.choice([True, False])
                 bot.my_command.player_buttons.right = random.choice([True, False])
                 bot_command = bot.my_command
-                frames_waited += 1
-            elif frames_waited == char_select_frames:
+                self.frames_waited += 1
+            elif self.frames_waited == self.char_select_frames:
                 # Press Start to select character
                 bot.my_command.player_buttons.start = True
                 bot_command = bot.my_command
-                frames_waited += 1
+                self.frames_waited += 1
             else:
                 # Release start and wait for match to begin
                 bot.my_command.player_buttons.start = False
                 bot_command = bot.my_command
                 # Only transition when round actually starts (rising edge)
-                if not prev_round_started and curr_round_started and not curr_round_over:
-                    current_state = FIGHTING
+                if not self.prev_round_started and curr_round_started and not curr_round_over:
+                    self.state = FIGHTING
                     bot.reset()
-                    last_opponent_health = 176
-                    last_bot_health = 176
+                    self.last_opponent_health = 176
+                    self.last_bot_health = 176
                     print("Character selected. First round starting!")
+                    self.events.publish(lifecycle.MATCH_STARTED)
 
-        elif current_state == IDLE:
-            idle_frames += 1
+        elif self.state == IDLE:
+            self.idle_frames += 1
             # Only transition to FIGHTING when:
             # 1. Round has started (rising edge from previous frame)
             # 2. Round is not over
             # 3. We've been in idle for at least a few frames to avoid immediate transitions
-            if (not prev_round_started and curr_round_started and 
-                not curr_round_over and idle_frames > 60):
-                current_state = FIGHTING
+            if (not self.prev_round_started and curr_round_started and
+                not curr_round_over and self.idle_frames > 60):
+                self.state = FIGHTING
                 bot.reset()
-                last_opponent_health = 176
-                last_bot_health = 176
-                idle_frames = 0
+                self.last_opponent_health = 176
+                self.last_bot_health = 176
+                self.idle_frames = 0
                 print("New round has started!")
             bot_command = bot.my_command
 
-        elif current_state == FIGHTING:
-            # Detect round end in multiple ways:
-            # 1. Standard round over flag with rising edge
-            # 2. Timer reaches 0 (timeout scenario)
-            # 3. Either player's health reaches 0
-            
-            round_ended = False
-            timeout_win = False
-            
-            # Standard round end detection
-            if (not prev_round_over and curr_round_over and 
-                game_state.fight_result != "NOT_OVER" and game_state.fight_result != "NONE"):
-                round_ended = True
-            
-            # Timer-based round end detection
-            elif timer_stuck_count > 60:
-                round_ended = True
-                timeout_win = True
-                print("Round ended due to timer expiring!")
-            
-            # Health-based round end detection (backup)
-            elif (game_state.player1.health == 255 or game_state.player2.health == 255):
-                round_ended = True
-                print("Round ended due to health reaching zero!")
-            
-            if round_ended:
-                current_state = IDLE
-                idle_frames = 0
-                timer_stuck_count = 0
-                print("Round is over.")
-                
-                # Determine win condition more robustly
-                bot_won = False
-                bot_health = game_state.player1.health if sys.argv[1] == '1' else game_state.player2.health
-                opponent_health = game_state.player2.health if sys.argv[1] == '1' else game_state.player1.health
-                
-                if timeout_win:
-                    # Timer ran out - winner is determined by health
+        elif self.state == FIGHTING:
+            bot_command = self._fight(game_state, curr_round_over)
+
+        # Update previous frame flags for edge detection
+        self.prev_round_started = curr_round_started
+        self.prev_round_over = curr_round_over
+        self.prev_timer = game_state.timer
+        return bot_command
+
+    def _fight(self, game_state, curr_round_over):
+        bot = self.bot
+        player = self.player
+        # Detect round end in multiple ways:
+        # 1. Standard round over flag with rising edge
+        # 2. Timer reaches 0 (timeout scenario)
+        # 3. Either player's health reaches 0
+
+        round_ended = False
+        timeout_win = False
+
+        # Standard round end detection
+        if (not self.prev_round_over and curr_round_over and
+            game_state.fight_result != "NOT_OVER" and game_state.fight_result != "NONE"):
+            round_ended = True
+
+        # Timer-based round end detection
+        elif self.timer_stuck_count > 60:
+            round_ended = True
+            timeout_win = True
+            print("Round ended due to timer expiring!")
+
+        # Health-based round end detection (backup)
+        elif (game_state.player1.health == 255 or game_state.player2.health == 255):
+            round_ended = True
+            print("Round ended due to health reaching zero!")
+
+        if round_ended:
+            self.state = IDLE
+            self.idle_frames = 0
+            self.timer_stuck_count = 0
+            print("Round is over.")
+
+            # Determine win condition more robustly
+            bot_won = False
+            bot_health = game_state.player1.health if player == '1' else game_state.player2.health
+            opponent_health = game_state.player2.health if player == '1' else game_state.player1.health
+
+            if timeout_win:
+                # Timer ran out - winner is determined by health
+                if bot_health > opponent_health:
+                    bot_won = True
+                    print(f"Won by timeout! Bot health: {bot_health}, Opponent: {opponent_health}")
+                elif bot_health == opponent_health:
+                    bot_won = False  # Draw goes to opponent
+                    print(f"Draw by timeout. Bot health: {bot_health}, Opponent: {opponent_health}")
+                else:
+                    bot_won = False
+                    print(f"Lost by timeout. Bot health: {bot_health}, Opponent: {opponent_health}")
+            else:
+                # Check explicit fight result first
+                if (player == '1' and game_state.fight_result == "P1") or \
+                   (player == '2' and game_state.fight_result == "P2"):
+                    bot_won = True
+
+                # If fight result is inconclusive, check health
+                elif game_state.fight_result in ["TIME_OVER", "DRAW", ""]:
                     if bot_health > opponent_health:
                         bot_won = True
-                        print(f"Won by timeout! Bot health: {bot_health}, Opponent: {opponent_health}")
                     elif bot_health == opponent_health:
-                        bot_won = False  # Draw goes to opponent
-                        print(f"Draw by timeout. Bot health: {bot_health}, Opponent: {opponent_health}")
-                    else:
-                        bot_won = False
-                        print(f"Lost by timeout. Bot health: {bot_health}, Opponent: {opponent_health}")
-                else:
-                    # Check explicit fight result first
-                    if (sys.argv[1] == '1' and game_state.fight_result == "P1") or \
-                       (sys.argv[1] == '2' and game_state.fight_result == "P2"):
-                        bot_won = True
-                    
-                    # If fight result is inconclusive, check health
-                    elif game_state.fight_result in ["TIME_OVER", "DRAW", ""]:
-                        if bot_health > opponent_health:
-                            bot_won = True
-                        elif bot_health == opponent_health:
-                            bot_won = False  # or True, depending on your preference
-                    
-                    # Health-based win detection (when someone's health hits 255 means -1)
-                    elif opponent_health == 255 and bot_health != 255:
-                        bot_won = True
-                    elif bot_health == 255 and opponent_health != 255:
-                        bot_won = False
-                
-                if bot_won:
-                    fight_history.append(1)
-                    health_bonus += bot_health
-                    time_bonus += max(0, game_state.timer - 48)  # Don't add negative time
-                    print("Round won!")
-                else:
-                    fight_history.append(0)
-                    print("Round lost!")
-                
-                print(f"Fight History: {fight_history}")
-                print(f"Final health - Bot: {bot_health}, Opponent: {opponent_health}, Timer: {game_state.timer}")
-                
-                # Check for match-ending conditions
-                if (fight_history.count(0) >= 2) or (fight_history.count(1) >= 2):
-                    current_state = MATCH_OVER
+                        bot_won = False  # or True, depending on your preference
 
-                bot_command = bot.my_command
+                # Health-based win detection (when someone's health hits 255 means -1)
+                elif opponent_health == 255 and bot_health != 255:
+                    bot_won = True
+                elif bot_health == 255 and opponent_health != 255:
+                    bot_won = False
+
+            self.round_result = ROUND_WON if bot_won else ROUND_LOST
+            if bot_won:
+                self.fight_history.append(1)
+                self.health_bonus += bot_health
+                self.time_bonus += max(0, game_state.timer - 48)  # Don't add negative time
+                print("Round won!")
             else:
-                # Track damage during active fighting
-                bot_health = game_state.player1.health if sys.argv[1] == '1' else game_state.player2.health
-                opponent_health = game_state.player2.health if sys.argv[1] == '1' else game_state.player1.health
-                
-                # Only track damage if neither player is knocked out (255)
-                if opponent_health != 255 and last_opponent_health != 255:
-                    if opponent_health < last_opponent_health:
-                        damage_dealt += last_opponent_health - opponent_health
-                        
-                if bot_health != 255 and last_bot_health != 255:
-                    if bot_health < last_bot_health:
-                        damage_taken += last_bot_health - bot_health
-
-                last_bot_health = bot_health
-                last_opponent_health = opponent_health
-
-                # Track distance for aggressiveness score
-                distance_values.append(abs(game_state.player1.x_coord - game_state.player2.x_coord))
-
-                bot_command = bot.fight(game_state, sys.argv[1])
-
-        send(client_socket, bot_command)
-        
-        # Update previous frame flags for edge detection
-        prev_round_started = curr_round_started
-        prev_round_over = curr_round_over
-        prev_timer = game_state.timer
+                self.fight_history.append(0)
+                print("Round lost!")
+
+            print(f"Fight History: {self.fight_history}")
+            print(f"Final health - Bot: {bot_health}, Opponent: {opponent_health}, Timer: {game_state.timer}")
+
+            # Check for match-ending conditions
+            if (self.fight_history.count(0) >= 2) or (self.fight_history.count(1) >= 2):
+                self.state = MATCH_OVER
+
+            return bot.my_command
+
+        # Track damage during active fighting
+        bot_health = game_state.player1.health if player == '1' else game_state.player2.health
+        opponent_health = game_state.player2.health if player == '1' else game_state.player1.health
+
+        # Only track damage if neither player is knocked out (255)
+        if opponent_health != 255 and self.last_opponent_health != 255:
+            if opponent_health < self.last_opponent_health:
+                self.damage_dealt += self.last_opponent_health - opponent_health
+
+        if bot_health != 255 and self.last_bot_health != 255:
+            if bot_health < self.last_bot_health:
+                self.damage_taken += self.last_bot_health - bot_health
+
+        self.last_bot_health = bot_health
+        self.last_opponent_health = opponent_health
+
+        # Track distance for aggressiveness score
+        self.distance_values.append(abs(game_state.player1.x_coord - game_state.player2.x_coord))
+
+        if self.stop_policies:
+            self.truncated = check_policies(self.stop_policies, game_state, player, self.fight_history,
+                                            self.damage_dealt, self.damage_taken, self.health_bonus, self.time_bonus)
+        if self.truncated is not None:
+            # The rounds still to be decided count as lost by knockout
+            print(f"Stopping the match early: {self.truncated}")
+            self.fight_history, forfeited_health = forfeit(self.fight_history, bot_health)
+            self.damage_taken += forfeited_health
+            self.round_result = MATCH_FORFEITED
+            self.state = MATCH_OVER
+            return bot.my_command
+        # The bot decides (see Bot.decide, or multi_controller.py's batches)
+        return None
 
-    # --- MATCH IS OVER ---
-    print("Match complete. Calculating and saving fitness results...")
+    def results(self):
+        """The results dict of a finished match (without the latency summary)."""
+        # --- MATCH IS OVER ---
+        self.events.publish(lifecycle.MATCH_FINISHED)
+        print("Match complete. Calculating fitness results...")
+
+        # Determine if the bot won the match
+        won_match = self.fight_history.count(1) >= 2
+
+        # Calculate average distance, avoiding division by zero
+        distance_values = self.distance_values
+        avg_distance = sum(distance_values) / len(distance_values) if distance_values else 0
+
+        # Package results into a dictionary
+        return {
+            "won_match": won_match,
+            "fight_history": self.fight_history,
+            "damage_dealt": self.damage_dealt,
+            "damage_taken": self.damage_taken,
+            "health_bonus": self.health_bonus,
+            "time_bonus": self.time_bonus,
+            "average_distance": avg_distance,
+            "truncated": self.truncated,
+        }
+
+
+def play_match(connection, bot, player, events=None, recorder=None, frame_budget_ms=DEFAULT_FRAME_BUDGET_MS,
+               stop_policies=None):
+    """
+    Runs a MatchSession on a game connection until the match is over and
+    returns the results dict evolution.py scores.
+    All match state lives in the session, so every call starts from a clean slate.
+    events is an optional LifecyclePublisher told when the match starts and ends.
+    recorder is an optional TraceRecorder (match_trace.py) that gets every frame.
+    Every frame is timed stage by stage (see latency.py); the summary is
+    returned as results["latency"], counting frames over frame_budget_ms.
+    stop_policies are early_stop.py policies that may end a hopeless match
+    before MATCH_OVER; results["truncated"] then says why (None otherwise).
+    """
+    events = events or LifecyclePublisher()
+    session = MatchSession(bot, player, events, stop_policies)
+    game_state = GameState()
+    latency = FrameLatency(frame_budget_ms)
+    clock = time.perf_counter_ns
+    frames = 0
+
+    while not session.over:
+        frame_start = clock()
+        receive(connection, game_state)
+        decoded = clock()
+        received = max(connection.received_at, frame_start)
+        frame_state = CONTROLLER_STATES[session.state]
+
+        bot_command = session.observe(game_state)
+        if bot_command is None:
+            # Fast path: threshold, table lookup, sendall (see protocol.action_payloads)
+            action = bot.decide(game_state, player)
+
+        send_start = clock()
+        if bot_command is None:
+            connection.send_action(player, action)
+        else:
+            send(connection, bot_command)
+        sent = clock()
+        encoded = max(connection.encoded_at, send_start)
+        if bot_command is None:
+            latency.record_frame(frame_state, received - frame_start, decoded - received, bot.feature_ns,
+                                 bot.inference_ns, encoded - send_start, sent - encoded, sent - received)
+        else:
+            latency.record_frame(frame_state, received - frame_start, decoded - received, None, None,
+                                 encoded - send_start, sent - encoded, sent - received)
+
+        frames += 1
+        if frames % PROGRESS_EVERY_FRAMES == 0:
+            events.publish(lifecycle.PROGRESS, frames=frames)
+
+        if recorder is not None:
+            if bot_command is None:
+                recorder.record(game_state, session.state, action, protocol.action_wire_masks(player)[action],
+                                bot.input_vector, session.round_result)
+            else:
+                recorder.record(game_state, session.state, -1, (protocol.buttons_to_mask(bot_command.player_buttons),
+                                                                protocol.buttons_to_mask(bot_command.player2_buttons)),
+                                round_result=session.round_result)
+
+    results = session.results()
+    results["latency"] = latency.summary()
+    return results
+
+def write_results(results, workdir):
+    with open(os.path.join(workdir, RESULTS_FILE), "w") as f:
+        json.dump(results, f)
+
+def send_message(stream, message):
+    """Writes one newline-delimited JSON message to the control channel."""
+    stream.write(json.dumps(message) + "\n")
+    stream.flush()
+
+def load_job_weights(bot, job, workdir):
+    """
+    Loads the genome of an evaluate job into the bot. A job carries either a
+    'genome' (base64 of the flat float32 vector, see genome.py) or a
+    'weights_file' path; without either, the workdir's weights file is used.
+    """
+    if "genome" in job:
+        genome = np.frombuffer(base64.b64decode(job["genome"]), dtype=np.float32)
+        bot.ann.set_weights(ANN_LAYOUT.unflatten(genome))
+    else:
+        bot.ann.load_weights(job.get("weights_file") or os.path.join(workdir, WEIGHTS_FILE))
+
+def job_decision_settings(job, workdir):
+    """
+    The (decision_interval, frame_summary) an evaluate job is played with:
+    its own fields if it has them, else those its weights file was saved with.
+    """
+    if job.get("decision_interval"):
+        return job["decision_interval"], job.get("frame_summary") or "last"
+    if "genome" in job:
+        return 1, "last"
+    return read_decision_settings(job.get("weights_file") or os.path.join(workdir, WEIGHTS_FILE))
+
+def open_recorder(trace_file, player, **meta):
+    """A TraceRecorder writing to trace_file, or None when no trace was asked for."""
+    if not trace_file:
+        return None
+    return TraceRecorder(trace_file, player, meta)
+
+def serve(player, port, control_port, workdir, backend=INFERENCE_BACKEND):
+    """
+    Long-lived controller mode. TensorFlow is imported and the Bot is built
+    once; then "evaluate" jobs are read from a local control channel (one
+    JSON object per line) opened by connecting back to control_port. For
+    every job the genome is swapped into the bot, the bot state is reset,
+    one match is played on the game port and the same results dict the
+    one-shot controller writes is sent back.
+    """
+    bot = Bot(backend)
+    game_server = listen(port)
+    # The client is already waiting on the control port; dial back to it
+    control_socket = socket.create_connection(("127.0.0.1", control_port))
+    print(f"Controller daemon listening: game port {port}, control port {control_port}")
+    control = control_socket.makefile("rw")
+    send_message(control, {"type": "listening"})
+
+    for line in control:
+        job = json.loads(line)
+        if job["type"] == "shutdown":
+            break
+        if job["type"] != "evaluate":
+            send_message(control, {"type": "error", "message": f"Unknown job type: {job['type']}"})
+            continue
+
+        job_dir = job.get("workdir", workdir)
+        ready_file = os.path.join(job_dir, READY_FILE)
+        client_socket = None
+        recorder = None
+        events = LifecyclePublisher()
+        try:
+            events = LifecyclePublisher(job.get("events_port"))
+            # The game port has been bound since startup
+            events.publish(lifecycle.LISTENING, port=port)
+
+            load_job_weights(bot, job, job_dir)
+            bot.set_decision_interval(*job_decision_settings(job, job_dir))
+            bot.reset()
+
+            with open(ready_file, "w") as f:
+                f.write("ready")
+            events.publish(lifecycle.WEIGHTS_LOADED)
+
+            (client_socket, _) = game_server.accept()
+            print(f"Connected to game for job {job.get('job_id')}!")
+            recorder = open_recorder(job.get("trace_file"), player, job_id=job.get("job_id"),
+                                     weights_file=job.get("weights_file"), decision_interval=bot.decision_interval,
+                                     frame_summary=bot.frame_summary)
+            results = play_match(protocol.accept_connection(client_socket), bot, player, events, recorder,
+                                 job.get("frame_budget_ms") or DEFAULT_FRAME_BUDGET_MS,
+                                 make_policies(job.get("stop_inactive_frames"), job.get("stop_below")))
+            write_results(results, job_dir)
+            events.publish(lifecycle.RESULTS_AVAILABLE, results=results)
+            reply = {"type": "results", "job_id": job.get("job_id"), "results": results}
+        except Exception as e:
+            print(f"Job {job.get('job_id')} failed: {e}")
+            reply = {"type": "error", "job_id": job.get("job_id"), "message": str(e)}
+        finally:
+            if client_socket is not None:
+                client_socket.close()
+            if recorder is not None:
+                # Partial traces of failed matches are the ones worth keeping
+                recorder.close()
+            if os.path.exists(ready_file):
+                os.remove(ready_file)
+            events.close()
+        # Reply only once the workspace is clean for the next job
+        send_message(control, reply)
+
+    print("Controller daemon shutting down.")
+    control_socket.close()
+    game_server.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Street Fighter bot controller")
+    parser.add_argument("player", choices=["1", "2"], help="Player slot the bot controls")
+    parser.add_argument("--port", type=int, default=None,
+                        help="Port to listen on (default: 9999 for player 1, 10000 for player 2)")
+    parser.add_argument("--workdir", default=".",
+                        help="Directory holding the weights, results and ready files of this run")
+    parser.add_argument("--events-port", type=int, default=None,
+                        help="Port of the evaluator's lifecycle hub to report progress to (see lifecycle.py)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Stay alive and play one match per job received on the control port")
+    parser.add_argument("--control-port", type=int, default=None,
+                        help="Port the daemon connects back to for its control channel")
+    parser.add_argument("--backend", choices=["keras", "numpy"], default=INFERENCE_BACKEND,
+                        help="Inference backend of the bot (see numpy_ann.py)")
+    parser.add_argument("--frame-budget-ms", type=float, default=DEFAULT_FRAME_BUDGET_MS,
+                        help="Frames where the controller takes longer than this are counted as over budget")
+    parser.add_argument("--trace", default=None,
+                        help="Record every frame of the match to this trace file (see match_trace.py)")
+    parser.add_argument("--stop-inactive-frames", type=int, default=None,
+                        help="End the match once the bot has neither moved nor dealt damage for this many frames")
+    parser.add_argument("--stop-below", type=float, default=None,
+                        help="End the match once even its best case would score below this fitness")
+    parser.add_argument("--decision-interval", type=int, default=None,
+                        help="Run the network every this many frames and repeat its action in between "
+                             "(default: what the weights file was saved with, else every frame)")
+    parser.add_argument("--frame-summary", choices=FRAME_SUMMARIES, default=None,
+                        help="Input of a decision: the current frame, or the mean of the frames since the last one")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    player = args.player
+    port = args.port if args.port is not None else DEFAULT_PORTS[player]
+    ready_file = os.path.join(args.workdir, READY_FILE)
+
+    if args.daemon:
+        if args.control_port is None:
+            raise SystemExit("--daemon requires --control-port")
+        serve(player, port, args.control_port, args.workdir, args.backend)
+        return
+
+    start_time = time.time()
+    print(f"[{time.time() - start_time:.2f}s] Controller starting...")
+    print(f"[{time.time() - start_time:.2f}s] Using Python interpreter: {sys.executable}")
+
+    events = LifecyclePublisher(args.events_port)
+    server_socket = listen(port)
+    events.publish(lifecycle.LISTENING, port=port)
+    (client_socket, _) = server_socket.accept()
+    print ("Connected to game!")
     
-    # Determine if the bot won the match
-    won_match = fight_history.count(1) >= 2
-
-    # Calculate average distance, avoiding division by zero
-    avg_distance = sum(distance_values) / len(distance_values) if distance_values else 0
-
-    # Package results into a dictionary
-    results = {
-        "won_match": won_match,
-        "fight_history": fight_history,
-        "damage_dealt": damage_dealt,
-        "damage_taken": damage_taken,
-        "health_bonus": health_bonus,
-        "time_bonus": time_bonus,
-        "average_distance": avg_distance
-    }
+    print(f"[{time.time() - start_time:.2f}s] Socket connected on port {port}.")
+
+    bot = Bot(args.backend)
+    print(f"[{time.time() - start_time:.2f}s] Bot object created.")
+
+    weights_file = os.path.join(args.workdir, WEIGHTS_FILE)
+    bot.ann.load_weights(weights_file)
+    # Play the genome the way it was trained unless told otherwise
+    decision_interval, frame_summary = read_decision_settings(weights_file)
+    bot.set_decision_interval(args.decision_interval or decision_interval, args.frame_summary or frame_summary)
+    print(f"[{time.time() - start_time:.2f}s] ANN weights loaded (deciding every {bot.decision_interval} frames).")
+
+    # Signal to Lua script that controller is ready after loading weights
+    with open(ready_file, "w") as f:
+        f.write("ready")
+    events.publish(lifecycle.WEIGHTS_LOADED)
+    print(f"[{time.time() - start_time:.2f}s] Controller ready signal sent after ANN loaded.")
+
+    connection = protocol.accept_connection(client_socket)
+    print(f"Game protocol: {protocol.FORMAT_NAMES[connection.format]}")
+
+    recorder = open_recorder(args.trace, player, weights_file=weights_file, decision_interval=bot.decision_interval,
+                             frame_summary=bot.frame_summary)
+    try:
+        results = play_match(connection, bot, player, events, recorder, args.frame_budget_ms,
+                             make_policies(args.stop_inactive_frames, args.stop_below))
+    finally:
+        if recorder is not None:
+            print(f"Match trace written to {recorder.close()}")
 
     # Write results to a JSON file for the evolution script to read
-    with open("fitness_results.json", "w") as f:
-        json.dump(results, f)
+    write_results(results, args.workdir)
+    events.publish(lifecycle.RESULTS_AVAILABLE, results=results)
 
     # Clean up the ready file for the next run
-    if os.path.exists(READY_FILE):
-        os.remove(READY_FILE)
+    if os.path.exists(ready_file):
+        os.remove(ready_file)
         print("Ready file cleaned up.")
 
     print("Results saved. Exiting controller.")
+    events.close()
     client_socket.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,340 @@
+import base64
+import json
+import queue
+import socket
+import subprocess
+import threading
+import time
+import numpy as np
+from supervisor import launch, stop_processes
+
+# TensorFlow import and Keras model build on a cold interpreter
+STARTUP_TIMEOUT = 180
+KILL_GRACE = 1 # Seconds a controller being torn down gets to exit before it is killed
+
+
+class JobFailed(RuntimeError):
+    """The daemon reported a failed job; it is idle and ready for the next one."""
+
+
+def evaluate_job(job_id, workdir, weights_file=None, genome=None, events_port=None, trace_file=None,
+                 frame_budget_ms=None, stop_inactive_frames=None, stop_below=None, decision_interval=None,
+                 frame_summary=None):
+    """The "evaluate" message of one job (see ControllerDaemon.submit)."""
+    job = {"type": "evaluate", "job_id": job_id, "workdir": workdir,
+           "events_port": events_port, "trace_file": trace_file, "frame_budget_ms": frame_budget_ms,
+           "stop_inactive_frames": stop_inactive_frames, "stop_below": stop_below,
+           "decision_interval": decision_interval, "frame_summary": frame_summary}
+    if genome is not None:
+        job["genome"] = base64.b64encode(np.asarray(genome, dtype=np.float32).tobytes()).decode("ascii")
+    elif weights_file is not None:
+        job["weights_file"] = weights_file
+    return job
+
+
+def accept_control(control_server, process, deadline, kill):
+    """
+    Accepts a freshly launched controller's control connection. Blocks on
+    the connection itself, waking up once a second only to notice a
+    process that died during startup.
+    """
+    control_server.settimeout(1.0)
+    try:
+        while True:
+            try:
+                (control_socket, _) = control_server.accept()
+                return control_socket
+            except socket.timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Controller daemon exited during startup with code {process.returncode}")
+                if time.monotonic() > deadline:
+                    kill()
+                    raise TimeoutError("Controller daemon did not connect in time")
+    finally:
+        control_server.close()
+
+
+class ControllerDaemon:
+    """
+    Owns one long-lived `controller.py --daemon` process and its control
+    channel. The interpreter, TensorFlow runtime and Keras model are created
+    once; every evaluation afterwards is a single "evaluate" job that swaps
+    the genome in and returns the match results dict.
+    """
+    def __init__(self, command, player, port, workdir):
+        """
+        command is the interpreter plus script, e.g. [python, "controller.py"].
+        """
+        self.command = list(command)
+        self.player = player
+        self.port = port
+        self.workdir = workdir
+        self.process = None
+        self.control_socket = None
+        self.control = None
+        self.next_job_id = 0
+
+    def start(self):
+        """
+        Launches the daemon and blocks until it connects back to our control
+        port and reports that it is listening.
+        """
+        control_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        control_server.bind(("127.0.0.1", 0))
+        control_server.listen(1)
+        control_port = control_server.getsockname()[1]
+
+        daemon_command = self.command + [
+            self.player, f"--port={self.port}", f"--workdir={self.workdir}",
+            "--daemon", f"--control-port={control_port}",
+        ]
+        print(f"Starting persistent controller on port {self.port}...")
+        self.process = launch(daemon_command)
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        self.control_socket = accept_control(control_server, self.process, deadline, self.kill)
+        self.control = self.control_socket.makefile("rw")
+        message = self._read_message(max(1.0, deadline - time.monotonic()))
+        if message.get("type") != "listening":
+            raise RuntimeError(f"Unexpected first message from controller daemon: {message}")
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def ensure_started(self):
+        """Starts (or restarts) the daemon if it is not running."""
+        if not self.is_alive():
+            self.kill()
+            self.start()
+
+    def submit(self, weights_file=None, genome=None, workdir=None, events_port=None, trace_file=None,
+               frame_budget_ms=None, stop_inactive_frames=None, stop_below=None, decision_interval=None,
+               frame_summary=None):
+        """
+        Sends one evaluate job without waiting for it. Pass either the path of
+        a .weights.h5 file or a flat genome vector. events_port is the
+        lifecycle hub the daemon reports this job's progress to; trace_file,
+        if given, is where the match is recorded (see match_trace.py).
+        frame_budget_ms overrides the controller's per-frame budget (see latency.py).
+        stop_inactive_frames and stop_below end a hopeless match early (see early_stop.py).
+        decision_interval and frame_summary set how often the bot decides
+        (see Bot.set_decision_interval); by default the weights file says.
+        """
+        self.ensure_started()
+        self.next_job_id += 1
+        self._send_message(evaluate_job(self.next_job_id, workdir or self.workdir, weights_file, genome, events_port,
+                                        trace_file, frame_budget_ms, stop_inactive_frames, stop_below,
+                                        decision_interval, frame_summary))
+        return self.next_job_id
+
+    def wait_results(self, timeout):
+        """
+        Blocks until the running job reports back and returns its results dict.
+        Raises JobFailed if the daemon reported an error (it is idle again).
+        Raises TimeoutError or RuntimeError if the daemon did not reply
+        properly; it is then in an unknown state and should be killed.
+        """
+        message = self._read_message(timeout)
+        if message.get("type") == "error":
+            raise JobFailed(f"Controller daemon job failed: {message.get('message')}")
+        if message.get("type") != "results":
+            raise RuntimeError(f"Unexpected message from controller daemon: {message}")
+        return message["results"]
+
+    def evaluate(self, timeout, weights_file=None, genome=None, workdir=None, events_port=None, trace_file=None):
+        """Submits one job and waits for its results."""
+        self.submit(weights_file=weights_file, genome=genome, workdir=workdir, events_port=events_port,
+                    trace_file=trace_file)
+        return self.wait_results(timeout)
+
+    def close(self):
+        """Asks the daemon to exit, killing it if it does not."""
+        if self.is_alive() and self.control is not None:
+            try:
+                self._send_message({"type": "shutdown"})
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self.kill()
+
+    def kill(self):
+        """Tears down the daemon process and its control channel immediately."""
+        if self.control_socket is not None:
+            try:
+                self.control_socket.close()
+            except OSError:
+                pass
+        self.control_socket = None
+        self.control = None
+        stop_processes([self.process], grace=KILL_GRACE)
+
+    def _send_message(self, message):
+        self.control.write(json.dumps(message) + "\n")
+        self.control.flush()
+
+    def _read_message(self, timeout):
+        self.control_socket.settimeout(timeout)
+        try:
+            line = self.control.readline()
+        except socket.timeout:
+            raise TimeoutError("Timed out waiting for the controller daemon")
+        if not line:
+            raise RuntimeError("Controller daemon closed its control channel")
+        return json.loads(line)
+
+
+class SharedController:
+    """
+    Owns one `multi_controller.py` process that plays the matches of every
+    slot (game port) handed out by slot(), with batched NumPy inference and
+    no TensorFlow. The process is started by the first job and restarted
+    if it dies; it exits once every slot is closed.
+    """
+    def __init__(self, command, player):
+        """command is the interpreter plus script, e.g. [python, "multi_controller.py"]."""
+        self.command = list(command)
+        self.player = player
+        self.slots = []
+        self.open_slots = 0
+        self.process = None
+        self.control_socket = None
+        self.control = None
+        self.lock = threading.Lock()
+
+    def slot(self, port, workdir):
+        """A ControllerDaemon-like handle for one more game port; call before the first job."""
+        slot = SharedControllerSlot(self, len(self.slots), port, workdir)
+        self.slots.append(slot)
+        self.open_slots += 1
+        return slot
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def ensure_started(self):
+        with self.lock:
+            if self.is_alive():
+                return
+            self._stop()
+            control_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            control_server.bind(("127.0.0.1", 0))
+            control_server.listen(1)
+            control_port = control_server.getsockname()[1]
+            ports = ",".join(str(slot.port) for slot in self.slots)
+            print(f"Starting shared controller on ports {ports}...")
+            self.process = launch(self.command + [self.player, f"--ports={ports}", f"--control-port={control_port}"])
+            deadline = time.monotonic() + STARTUP_TIMEOUT
+            self.control_socket = accept_control(control_server, self.process, deadline, self._stop)
+            self.control = self.control_socket.makefile("rw")
+            self.control_socket.settimeout(max(1.0, deadline - time.monotonic()))
+            line = self.control.readline()
+            if json.loads(line or "{}").get("type") != "listening":
+                self._stop()
+                raise RuntimeError(f"Unexpected first message from shared controller: {line!r}")
+            self.control_socket.settimeout(None)
+            for slot in self.slots:
+                slot.replies = queue.Queue()
+            replies = [slot.replies for slot in self.slots]
+            threading.Thread(target=self._read_loop, args=(self.control, replies), name="shared-controller",
+                             daemon=True).start()
+
+    def _read_loop(self, control, replies):
+        # Routes every reply to the slot it is about; None tells all slots this process is gone
+        try:
+            for line in control:
+                message = json.loads(line)
+                slot = message.get("slot")
+                if slot is not None:
+                    replies[slot].put(message)
+        except (OSError, ValueError):
+            pass
+        for slot_replies in replies:
+            slot_replies.put(None)
+
+    def send(self, message):
+        with self.lock:
+            self.control.write(json.dumps(message) + "\n")
+            self.control.flush()
+
+    def _stop(self):
+        if self.control_socket is not None:
+            try:
+                self.control_socket.close()
+            except OSError:
+                pass
+        self.control_socket = None
+        self.control = None
+        stop_processes([self.process], grace=KILL_GRACE)
+
+    def release(self):
+        """Called by every slot's close(); the last one shuts the process down."""
+        self.open_slots -= 1
+        if self.open_slots > 0:
+            return
+        if self.is_alive() and self.control is not None:
+            try:
+                self.send({"type": "shutdown"})
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        with self.lock:
+            self._stop()
+
+
+class SharedControllerSlot:
+    """
+    One game port of a SharedController, with the ControllerDaemon interface
+    EvaluationPool and evolution.run_match use. kill() only aborts this
+    slot's match; the process and the other slots carry on.
+    """
+    def __init__(self, owner, index, port, workdir):
+        self.owner = owner
+        self.index = index
+        self.port = port
+        self.workdir = workdir
+        self.replies = queue.Queue()
+        self.next_job_id = 0
+
+    def ensure_started(self):
+        self.owner.ensure_started()
+
+    def submit(self, weights_file=None, genome=None, workdir=None, events_port=None, trace_file=None,
+               frame_budget_ms=None, stop_inactive_frames=None, stop_below=None, decision_interval=None,
+               frame_summary=None):
+        """Sends one evaluate job for this slot without waiting for it (see ControllerDaemon.submit)."""
+        self.ensure_started()
+        self.next_job_id += 1
+        job = evaluate_job(self.next_job_id, workdir or self.workdir, weights_file, genome, events_port,
+                           trace_file, frame_budget_ms, stop_inactive_frames, stop_below, decision_interval,
+                           frame_summary)
+        self.owner.send(dict(job, slot=self.index))
+        return self.next_job_id
+
+    def wait_results(self, timeout):
+        """Blocks until this slot's running job reports back (see ControllerDaemon.wait_results)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                message = self.replies.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError("Timed out waiting for the shared controller")
+            if message is None:
+                raise RuntimeError("Shared controller closed its control channel")
+            if message.get("job_id") != self.next_job_id:
+                continue # The late reply of an aborted job
+            if message.get("type") == "error":
+                raise JobFailed(f"Shared controller job failed: {message.get('message')}")
+            if message.get("type") != "results":
+                raise RuntimeError(f"Unexpected message from shared controller: {message}")
+            return message["results"]
+
+    def kill(self):
+        """Aborts the match this slot is playing."""
+        if self.owner.is_alive() and self.owner.control is not None:
+            try:
+                self.owner.send({"type": "abort", "slot": self.index})
+            except OSError:
+                pass
+
+    def close(self):
+        self.owner.release()
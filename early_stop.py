@@ -0,0 +1,76 @@
+from fitness import best_case_fitness
+
+# Early-stop policies for controller.play_match. Each one is asked, every
+# frame the bot fights, whether the match is still worth playing; the first
+# to give a reason ends it. A stopped match loses the rounds still to be
+# decided by knockout (fitness.forfeit) and is then scored like any other,
+# so being stopped never pays off and never beats the match's best case.
+
+
+class InactivityStop:
+    """Stops a match once the bot has neither moved nor dealt damage for max_frames fighting frames."""
+    __slots__ = ("max_frames", "idle_frames", "last_x", "last_dealt")
+
+    def __init__(self, max_frames):
+        self.max_frames = max_frames
+        self.reset()
+
+    def reset(self):
+        self.idle_frames = 0
+        self.last_x = None
+        self.last_dealt = 0
+
+    def check(self, game_state, player, fight_history, damage_dealt, damage_taken, health_bonus, time_bonus):
+        bot = game_state.player1 if player == '1' else game_state.player2
+        if bot.x_coord != self.last_x or damage_dealt != self.last_dealt:
+            self.idle_frames = 0
+            self.last_x = bot.x_coord
+            self.last_dealt = damage_dealt
+            return None
+        self.idle_frames += 1
+        if self.idle_frames >= self.max_frames:
+            return f"no movement or damage for {self.idle_frames} frames"
+        return None
+
+
+class CutoffStop:
+    """
+    Stops a match once even its best case (fitness.best_case_fitness)
+    scores below stop_below, e.g. the fitness of the weakest parent of the
+    last generation.
+    """
+    __slots__ = ("stop_below",)
+
+    def __init__(self, stop_below):
+        self.stop_below = stop_below
+
+    def reset(self):
+        pass
+
+    def check(self, game_state, player, fight_history, damage_dealt, damage_taken, health_bonus, time_bonus):
+        bot_health = game_state.player1.health if player == '1' else game_state.player2.health
+        opponent_health = game_state.player2.health if player == '1' else game_state.player1.health
+        best_case = best_case_fitness(fight_history, damage_dealt, damage_taken, health_bonus, time_bonus,
+                                      bot_health, opponent_health, game_state.timer)
+        if best_case < self.stop_below:
+            return f"cannot reach fitness {self.stop_below} (best case {best_case:.1f})"
+        return None
+
+
+def make_policies(inactive_frames=None, stop_below=None):
+    """The policies asked for (none for None or 0 inactive_frames and None stop_below)."""
+    policies = []
+    if inactive_frames:
+        policies.append(InactivityStop(inactive_frames))
+    if stop_below is not None:
+        policies.append(CutoffStop(stop_below))
+    return policies
+
+
+def check_policies(policies, game_state, player, fight_history, damage_dealt, damage_taken, health_bonus, time_bonus):
+    """The reason the first policy gives for stopping the match, or None to play on."""
+    for policy in policies:
+        reason = policy.check(game_state, player, fight_history, damage_dealt, damage_taken, health_bonus, time_bonus)
+        if reason is not None:
+            return reason
+    return None
@@ -0,0 +1,174 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lifecycle import LifecycleHub
+
+
+def is_port_free(port):
+    """Returns True if nothing is listening on (or holding) the given local port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        try:
+            probe.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+
+def allocate_ports(count, base_port):
+    """
+    Picks count free local ports, starting at base_port and skipping any that
+    are already taken.
+    """
+    ports = []
+    port = base_port
+    while len(ports) < count:
+        if port > 65535:
+            raise RuntimeError(f"Could not find {count} free ports starting at {base_port}")
+        if is_port_free(port):
+            ports.append(port)
+        port += 1
+    return ports
+
+
+def evaluate_population(submit, population, individual_ids=None, **settings):
+    """
+    Evaluates every individual through submit(individual, individual_id,
+    **settings) -> Future and returns the fitness scores in population
+    order. Scores are reported as soon as each match finishes.
+    individual_ids names the individuals in the logs (default 1..n).
+    """
+    if individual_ids is None:
+        individual_ids = list(range(1, len(population) + 1))
+    futures = {submit(individual, individual_id, **settings): i
+               for i, (individual, individual_id) in enumerate(zip(population, individual_ids))}
+    fitness_scores = [None] * len(population)
+    for finished, future in enumerate(as_completed(futures), start=1):
+        index = futures[future]
+        try:
+            fitness_scores[index] = future.result()
+        except Exception as e:
+            print(f"Evaluation of individual {individual_ids[index]} crashed: {e}")
+            fitness_scores[index] = -9999
+        print(f"[{finished}/{len(population)}] Individual {individual_ids[index]} finished with fitness {fitness_scores[index]}")
+    return fitness_scores
+
+
+class WorkerSlot:
+    """
+    The resources one concurrent evaluation owns: a controller port, a
+    scratch directory for its weights, results and ready files, a lifecycle
+    hub its processes report to and, when persistent controllers are used,
+    the controller daemon serving the slot.
+    """
+    def __init__(self, slot_id, port, workdir):
+        self.slot_id = slot_id
+        self.port = port
+        self.workdir = workdir
+        self.lifecycle = LifecycleHub()
+        self.controller = None
+
+
+class EvaluationPool:
+    """
+    Runs up to num_workers fitness evaluations at the same time.
+    Each running evaluation borrows a WorkerSlot, so no two matches ever share
+    a port or a file, and results are collected in completion order.
+    The evaluation function must accept (individual, individual_id, port=,
+    workdir=, gui_lock=, lifecycle=) like evolution.evaluate_fitness, plus
+    the match settings given to submit (such as stop_below=).
+
+    With a controller_factory, every slot also keeps one long-lived
+    controller (factory(slot) -> ControllerDaemon) that is passed to the
+    evaluation function as controller= and reused for every match it runs.
+
+    Every Future the pool returns has a placement dict whose "slot" names
+    the slot that played it, once it has started.
+    """
+    def __init__(self, evaluate_fn, num_workers, base_port, root_dir=None, controller_factory=None):
+        self.evaluate_fn = evaluate_fn
+        self.num_workers = num_workers
+        self.root_dir = tempfile.mkdtemp(prefix="sf_eval_", dir=root_dir)
+        # Only one evaluation at a time may drive the mouse through auto_gui.py
+        self.gui_lock = threading.Lock()
+
+        # Slots not playing a match, longest idle first
+        self.free_slots = []
+        self.slots_changed = threading.Condition()
+        self.all_slots = []
+        for slot_id, port in enumerate(allocate_ports(num_workers, base_port)):
+            workdir = os.path.join(self.root_dir, f"worker_{slot_id}")
+            os.makedirs(workdir)
+            slot = WorkerSlot(slot_id, port, workdir)
+            if controller_factory is not None:
+                # Started lazily by the first job, on the worker thread
+                slot.controller = controller_factory(slot)
+            self.all_slots.append(slot)
+            self.free_slots.append(slot)
+
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="evaluator")
+
+    def _take_slot(self, avoid):
+        """The longest idle slot other than avoid, waiting for one to free up if needed."""
+        with self.slots_changed:
+            while True:
+                for slot in self.free_slots:
+                    if slot.slot_id != avoid or len(self.all_slots) == 1:
+                        self.free_slots.remove(slot)
+                        return slot
+                self.slots_changed.wait()
+
+    def _run(self, individual, individual_id, settings, avoid, placement):
+        slot = self._take_slot(avoid)
+        placement["slot"] = slot.slot_id
+        try:
+            extra = {"controller": slot.controller} if slot.controller is not None else {}
+            return self.evaluate_fn(individual, individual_id, port=slot.port, workdir=slot.workdir,
+                                    gui_lock=self.gui_lock, lifecycle=slot.lifecycle, **extra, **settings)
+        finally:
+            with self.slots_changed:
+                self.free_slots.append(slot)
+                self.slots_changed.notify_all()
+
+    def submit(self, individual, individual_id, avoid=None, **settings):
+        """
+        Schedules one evaluation, passing settings on to the evaluation
+        function, and returns its Future. With avoid (a slot id), the match
+        is played on any other slot, so a genome that failed on one slot
+        can be tried on another.
+        """
+        placement = {}
+        future = self.executor.submit(self._run, individual, individual_id, settings, avoid, placement)
+        future.placement = placement
+        return future
+
+    def evaluate_population(self, population, individual_ids=None, **settings):
+        """Evaluates every individual on the pool's workers (see evaluate_population)."""
+        return evaluate_population(self.submit, population, individual_ids, **settings)
+
+    def close(self, cancel=False):
+        """
+        Waits for running evaluations, stops persistent controllers and removes
+        the scratch directories. With cancel, evaluations that have not started
+        are dropped and running ones are stopped instead of waited for: closing
+        a slot's lifecycle hub wakes the match waiting on it, which then tears
+        its processes down.
+        """
+        if cancel:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            for slot in self.all_slots:
+                slot.lifecycle.close()
+        self.executor.shutdown(wait=True)
+        for slot in self.all_slots:
+            if slot.controller is not None:
+                slot.controller.close()
+            slot.lifecycle.close()
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,11 +1,28 @@
 
 
 import subprocess
+import shutil
 import json
 import os
-import numpy as np
-from ann import ANN
+import contextlib
+import sys
 import time
+from concurrent.futures import wait, FIRST_COMPLETED
+import numpy as np
+from genome import ANN_LAYOUT
+from numpy_ann import initial_weights, read_weights_file, write_weights_file
+from evaluation_pool import EvaluationPool
+from cluster import Coordinator
+from controller_client import ControllerDaemon, JobFailed, SharedController
+from lifecycle import LifecycleHub
+import lifecycle as lifecycle_events
+from latency import format_summary as format_latency
+from fitness import calculate_fitness
+from fitness_cache import CensoredFitness, FitnessCache, genome_key
+from checkpoint import RunState, save_checkpoint, load_checkpoint
+from racing import race
+from genome_archive import GenomeArchive, KIND_INDIVIDUAL, KIND_GENERATION_BEST
+from supervisor import Quarantine, SupervisedPool, launch, stop_processes
 
 # --- Configuration ---
 POPULATION_SIZE = 20
@@ -15,248 +32,473 @@ ROM_PATH = "D:/pythonProjs/Street-Fighter-neuroevolution/AI Project/gamebot-comp
 SAVE_SLOT_TO_LOAD = 1
 WEIGHTS_FILE = "current_weights.weights.h5"
 RESULTS_FILE = "fitness_results.json"
-BEST_MODELS_DIR = "best_models"
-OVERALL_BEST_MODELS_DIR = "best_model_over_all_generations"
+READY_FILE = "controller_ready.txt"
+GENOME_ARCHIVE_FILE = "genome_archive.sfga" # Best genome of every generation, with fitness and lineage (see genome_archive.py)
+ARCHIVE_WHOLE_POPULATION = False # Archive every individual, not only each generation's best
+OVERALL_BEST_MODELS_DIR = "best_model_over_all_generations" # Read once, by runs that start without an archive
 CONTROLLER_PORT = 9999
+NUM_PARALLEL_EVALUATIONS = 1 # Number of matches (emulator + controller pairs) run at once
+USE_PERSISTENT_CONTROLLER = True # Keep one warm controller per worker instead of relaunching it per match
+SHARED_CONTROLLER = False # With persistent controllers: one asyncio process (multi_controller.py) plays every worker's match, batching NumPy inference
+SHARED_PRECISION = "float32" # Weight storage of the shared controller: "float32", "float16" or "int8" (see population_ann.py)
+QUANTIZATION_MAX_DISAGREEMENT = 0.02 # Genomes deciding differently this often once quantized are played in float32 (see quantize.py)
+DISTRIBUTED = False # Hand matches to `cluster.py worker` agents on other hosts instead of playing them here
+COORDINATOR_PORT = 9500 # Port the coordinator listens on for workers when DISTRIBUTED
+CONTROLLER_STARTUP_TIMEOUT = 120 # Seconds to wait for a controller to bind its game port
+MATCH_STALL_TIMEOUT = 15 # A running match whose controller reports no frames for this many seconds is killed
+MATCH_ATTEMPTS = 3 # Times a genome's match is tried before it counts as failed
+QUARANTINE_FILE = "quarantine.txt" # Where quarantined genomes are kept across runs, if PERSIST_QUARANTINE
+PERSIST_QUARANTINE = False # Keep genomes that failed every attempt out of later runs too, not just this one
+EARLY_STOP_INACTIVE_FRAMES = 600 # End a match once the bot has neither moved nor dealt damage for this many frames (0 = never)
+EARLY_STOP_BELOW_PARENTS = True # End a match once it can no longer beat the weakest parent of the last generation
+DECISION_INTERVAL = 1 # Run the bot's network every this many frames and repeat its action in between
+FRAME_SUMMARY = "last" # What a decision sees with DECISION_INTERVAL > 1: "last" frame or "mean" of the frames since the last one
+GAME_BACKEND = "bizhawk" # "bizhawk", "simulator" (fight_simulator.py) or "stand_in" (stand_in_game.py); the last two need no emulator or GUI
+GAME_PROTOCOL = "binary" # Wire format the headless games negotiate: "legacy", "json" or "binary"
+SIMULATOR_SEED = 0 # Every individual fights the same simulated opponent
+SIMULATOR_DIFFICULTY = 0.5 # CPU opponent strength in the simulator, 0 to 1
+FRAME_BUDGET_MS = 1000 / 60 # Controller frames slower than this are counted in the results (one frame at 60 fps)
+RECORD_TRACES = False # Record every match frame by frame (see match_trace.py)
+TRACES_DIR = "traces" # Traces go to TRACES_DIR/gen_<n>/individual_<id>.sftrace
+USE_FITNESS_CACHE = True # Reuse the fitness of genomes already played (elites, unmutated children)
+FITNESS_CACHE_SIZE = 1000 # Genomes remembered; the least recently seen are forgotten first
+FITNESS_REEVALUATE_EVERY = 0 # Replay cached genomes every N generations and average their scores (0 = never)
+USE_RACING = False # Give genomes extra matches only while it is unclear whether they make the parent cut
+RACING_MAX_MATCHES = 4 # Most matches one genome plays per generation when racing
+RACING_CONFIDENCE_Z = 1.64 # Width of the confidence intervals, in standard errors
+RACING_NOISE_PRIOR = 300.0 # Assumed fitness spread of a single match until repeated matches measure it
+EVOLUTION_MODE = "generational" # "generational", or "steady_state": breed a replacement as soon as any match finishes
+TOURNAMENT_SIZE = 3 # Steady state: parents are the fittest of this many random individuals
+CHECKPOINT_FILE = "evolution_checkpoint.npz" # Whole GA state, rewritten after every generation
+RESUME_FROM_CHECKPOINT = True # Continue from CHECKPOINT_FILE if it exists instead of starting over
 
 # --- Main Neuroevolution Functions ---
 
 def create_initial_population():
-    """Creates a list of 50 brand new, randomly initialized ANNs."""
-    population = []
-    for _ in range(POPULATION_SIZE):
-        population.append(ANN())
+    """
+    Creates the initial population as a (POPULATION_SIZE, n_params) float32
+    genome store, one randomly initialized network per row.
+    """
+    population = ANN_LAYOUT.empty_population(POPULATION_SIZE)
+    for i in range(POPULATION_SIZE):
+        population[i] = ANN_LAYOUT.flatten(initial_weights())
     print(f"Created initial population of {POPULATION_SIZE} individuals.")
     return population
 
-def evaluate_fitness(individual, individual_id):
+def save_genome(genome, file_path, decision_interval=None, frame_summary=None):
     """
-    Evaluates a single ANN's fitness by launching the emulator and controller,
-    waiting for the match to complete, and reading the results.
+    Writes a genome as a Keras-compatible .weights.h5 file, recording the
+    decision interval and frame summary the controller is to play it with
+    (DECISION_INTERVAL and FRAME_SUMMARY unless given).
     """
-    print(f"\n--- Evaluating Individual {individual_id} ---")
-    
-    # 1. Save the individual's weights to a file for the controller to load
-    individual.save_weights(WEIGHTS_FILE)
+    write_weights_file(file_path, ANN_LAYOUT.unflatten(genome), decision_interval or DECISION_INTERVAL,
+                       frame_summary or FRAME_SUMMARY)
 
-    # 2. Launch the emulator, loading from our character-select save state
+def load_genome(file_path):
+    """Reads a .weights.h5 file back into a flat genome vector."""
+    return ANN_LAYOUT.flatten(read_weights_file(file_path))
+
+def python_command(script_name):
+    """Returns [interpreter, script path] for launching one of the project's scripts."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.abspath(os.path.join(script_dir, "..", ".."))
+    python_executable = os.path.join(project_root, "venv", "Scripts", "python.exe")
+    if not os.path.exists(python_executable):
+        python_executable = sys.executable # Not on the Windows venv layout
+    return [python_executable, os.path.join(script_dir, script_name)]
+
+def emulator_command(port, events_port):
+    """Returns the command that starts the game side of a match."""
+    headless_args = [f"--port={port}", f"--events-port={events_port}", f"--protocol={GAME_PROTOCOL}"]
+    if GAME_BACKEND == "simulator":
+        return python_command("fight_simulator.py") + headless_args + [
+            f"--seed={SIMULATOR_SEED}", f"--difficulty={SIMULATOR_DIFFICULTY}"]
+    if GAME_BACKEND == "stand_in":
+        return python_command("stand_in_game.py") + headless_args
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    emulator_command = [
+    return [
         BIZHAWK_PATH,
         f"--load-slot={SAVE_SLOT_TO_LOAD}",
         f"--socket_ip=127.0.0.1",
-        f"--socket_port={CONTROLLER_PORT}",
+        f"--socket_port={port}",
         f"--lua={os.path.join(script_dir, 'auto_tool.lua')}",
         ROM_PATH
     ]
-    print(f"Starting emulator...")
-    emulator_process = subprocess.Popen(emulator_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(3) 
-    # --- LAUNCH auto_gui.py AND controller.py IN PARALLEL ---    
-    project_root = os.path.abspath(os.path.join(script_dir, "..", ".."))
-    python_executable = os.path.join(project_root, "venv", "Scripts", "python.exe")
-    auto_gui_path = os.path.join(script_dir, "auto_gui.py")
-    controller_path = os.path.join(script_dir, "controller.py")
 
-    auto_gui_command = [python_executable, auto_gui_path]
-    controller_command = [python_executable, controller_path, "1"]
+def evaluate_fitness(individual, individual_id, port=CONTROLLER_PORT, workdir=".", gui_lock=None,
+                     lifecycle=None, controller=None, **settings):
+    """
+    Evaluates a single genome's fitness: plays one match with
+    run_match_with_retries and scores its results. settings are the
+    match settings run_match takes (see match_settings).
+    """
+    results = run_match_with_retries(individual, individual_id, port=port, workdir=workdir, gui_lock=gui_lock,
+                                     lifecycle=lifecycle, controller=controller, **settings)
+    return score_results(results, individual_id)
+
+def run_match_with_retries(individual, individual_id, **slot):
+    """
+    run_match, tried up to MATCH_ATTEMPTS times: a crashed emulator or a
+    stalled match says nothing about the genome. Returns the results, or
+    None if every attempt failed.
+    """
+    for attempt in range(1, MATCH_ATTEMPTS + 1):
+        results = run_match(individual, individual_id, **slot)
+        if results is not None:
+            return results
+        lifecycle = slot.get("lifecycle")
+        if lifecycle is not None and not lifecycle.running:
+            break # The pool is being closed (EvaluationPool.close(cancel=True))
+        print(f"Match of individual {individual_id} failed (attempt {attempt}/{MATCH_ATTEMPTS})")
+    return None
+
+def run_match(individual, individual_id, port=CONTROLLER_PORT, workdir=".", gui_lock=None,
+              lifecycle=None, controller=None, stop_below=None, decision_interval=None, frame_summary=None):
+    """
+    Plays one match with a genome by launching the emulator and controller,
+    waiting for the match to complete, and reading the results. Returns the
+    results dict written by controller.py, or None if the match failed.
+
+    port and workdir isolate one evaluation from others running at the same
+    time: the controller listens on its own port and keeps its weights,
+    results and ready files in its own directory. gui_lock, if given, is held
+    while auto_gui.py drives the mouse, since the screen is shared.
+    lifecycle is the LifecycleHub the controller reports its progress to;
+    every step below blocks on the matching event instead of sleeping.
+    controller, if given, is a running ControllerDaemon (controller_client.py)
+    that plays the match instead of a freshly launched controller.py.
+    stop_below, if given, ends the match once it can no longer reach that
+    fitness (see early_stop.py). decision_interval and frame_summary are
+    saved with the genome (see save_genome).
+    """
+    print(f"\n--- Evaluating Individual {individual_id} (port {port}) ---")
+    workdir = os.path.abspath(workdir)
+    weights_file = os.path.join(workdir, WEIGHTS_FILE)
+    results_file = os.path.join(workdir, RESULTS_FILE)
+    ready_file = os.path.join(workdir, READY_FILE)
+
+    # Leftovers from a previous run in this workspace must not be mistaken for ours
+    for stale_file in (results_file, ready_file):
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+
+    own_hub = lifecycle is None
+    hub = LifecycleHub() if own_hub else lifecycle
+    hub.reset()
+
+    # 1. Save the individual's weights to a file for the controller to load
+    save_genome(individual, weights_file, decision_interval, frame_summary)
+
+    auto_gui_command = python_command("auto_gui.py") + [workdir, f"--events-port={hub.port}"]
+    controller_command = python_command("controller.py") + [
+        "1", f"--port={port}", f"--workdir={workdir}", f"--events-port={hub.port}",
+        f"--frame-budget-ms={FRAME_BUDGET_MS}", f"--stop-inactive-frames={EARLY_STOP_INACTIVE_FRAMES}"]
+    if stop_below is not None:
+        controller_command.append(f"--stop-below={stop_below}")
+    trace_file = None
+    if RECORD_TRACES:
+        trace_file = os.path.abspath(os.path.join(TRACES_DIR, "current", f"individual_{individual_id}.sftrace"))
+        os.makedirs(os.path.dirname(trace_file), exist_ok=True)
+        controller_command.append(f"--trace={trace_file}")
 
     controller_process = None
     auto_gui_process = None
+    emulator_process = None
+    results = None
+    controller_idle = controller is None
 
     try:
-        print(f"Starting controller with interpreter: {python_executable}")
-        controller_process = subprocess.Popen(controller_command)
-        time.sleep(5)
-        print("Starting auto_gui.py for mouse automation...")
-        auto_gui_process = subprocess.Popen(auto_gui_command)
-
-        # Wait for both processes with timeout protection
+        # 2. Start the controller first; the emulator can connect as soon as
+        # the game port is bound
+        if controller is None:
+            print(f"Starting controller with interpreter: {controller_command[0]}")
+            controller_process = launch(controller_command)
+        else:
+            # The daemon is already warm: it only has to swap the genome in
+            print("Handing genome to persistent controller...")
+            controller_idle = False
+            controller.submit(weights_file=weights_file, workdir=workdir, events_port=hub.port,
+                              trace_file=trace_file, frame_budget_ms=FRAME_BUDGET_MS,
+                              stop_inactive_frames=EARLY_STOP_INACTIVE_FRAMES, stop_below=stop_below)
+        hub.wait_for(lifecycle_events.LISTENING, timeout=CONTROLLER_STARTUP_TIMEOUT)
+
+        # 3. Launch the emulator, loading from our character-select save state
+        print(f"Starting emulator...")
+        emulator_env = dict(os.environ, SF_READY_FILE=ready_file)
+        emulator_process = launch(emulator_command(port, hub.port), stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL, env=emulator_env)
+
+        # auto_gui.py exits as soon as the controller is ready, so wait for it
+        # first and hand the mouse back to other evaluations quickly.
+        if GAME_BACKEND == "bizhawk":
+            with gui_lock or contextlib.nullcontext():
+                print("Starting auto_gui.py for mouse automation...")
+                auto_gui_process = launch(auto_gui_command)
+
+                print("Waiting for auto_gui to finish...")
+                try:
+                    auto_gui_process.wait(timeout=120)  # 2 minute timeout
+                    print("Auto GUI finished successfully.")
+                except subprocess.TimeoutExpired:
+                    print("Auto GUI timeout - force terminating...")
+                    stop_processes([auto_gui_process], grace=2)
+                    print("Auto GUI force terminated.")
+
+        # 4. Wait for the match with timeout protection. Once frames flow the
+        # controller reports progress every few dozen frames, so a hung match
+        # is given up on within MATCH_STALL_TIMEOUT instead of the full 8 minutes
         print("Waiting for controller to finish...")
         try:
-            controller_process.wait(timeout=480)  # 8 minute timeout
+            results = hub.wait_for(lifecycle_events.RESULTS_AVAILABLE, timeout=480,  # 8 minute timeout
+                                   stall_timeout=MATCH_STALL_TIMEOUT)["results"]
             print("Controller finished successfully.")
-        except subprocess.TimeoutExpired:
-            print("Controller timeout - force terminating...")
-            controller_process.terminate()
-            time.sleep(2)
-            if controller_process.poll() is None:
-                controller_process.kill()
-            print("Controller force terminated.")
-
-        print("Waiting for auto_gui to finish...")
-        try:
-            auto_gui_process.wait(timeout=120)  # 2 minute timeout
-            print("Auto GUI finished successfully.")
-        except subprocess.TimeoutExpired:
-            print("Auto GUI timeout - force terminating...")
-            auto_gui_process.terminate()
-            time.sleep(2)
-            if auto_gui_process.poll() is None:
-                auto_gui_process.kill()
-            print("Auto GUI force terminated.")
+        except ConnectionError as e:
+            # The controller hung up early; its reply or exit status says why
+            if hub.running:
+                print(f"Controller stopped before reporting results: {e}")
+
+        # A closed hub means the pool is being closed: the cleanup below stops the match
+        if hub.running and controller is not None:
+            results = controller.wait_results(timeout=30)
+            controller_idle = True
+        elif hub.running:
+            controller_process.wait(timeout=30)
 
         print("Controller and auto_gui.py have finished.")
 
+    except JobFailed as e:
+        controller_idle = True
+        print(f"Evaluation failed: {e}")
+    except (TimeoutError, ConnectionError, RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        if hub.running:
+            print(f"Evaluation failed: {e}")
+
     finally:
         # CRITICAL: Always clean up processes in finally block
         print("Cleaning up all processes...")
-        
-        # Clean up controller process
-        if controller_process and controller_process.poll() is None:
-            try:
-                print("Force terminating controller...")
-                controller_process.terminate()
-                time.sleep(1)
-                if controller_process.poll() is None:
-                    controller_process.kill()
-                    time.sleep(1)
-            except Exception as e:
-                print(f"Error terminating controller: {e}")
+        abandoned = not hub.running
 
-        # Clean up auto_gui process  
-        if auto_gui_process and auto_gui_process.poll() is None:
-            try:
-                print("Force terminating auto_gui...")
-                auto_gui_process.terminate()
-                time.sleep(1)
-                if auto_gui_process.poll() is None:
-                    auto_gui_process.kill()
-                    time.sleep(1)
-            except Exception as e:
-                print(f"Error terminating auto_gui: {e}")
+        # A persistent controller that never reported back is still mid-match
+        if not controller_idle:
+            controller.kill()
 
-        # Clean up emulator process
-        if emulator_process and emulator_process.poll() is None:
-            try:
-                print("Force terminating emulator...")
-                emulator_process.terminate()
-                time.sleep(2)
-                if emulator_process.poll() is None:
-                    emulator_process.kill()
-                    time.sleep(1)
-            except Exception as e:
-                print(f"Error terminating emulator: {e}")
+        # Controller, auto_gui and emulator (with anything they started) are
+        # stopped together and share one grace period
+        stop_processes([controller_process, auto_gui_process, emulator_process], grace=2)
+
+        if own_hub:
+            hub.close()
 
         print("Process cleanup complete.")
 
     # 6. Read the fitness results from the file the controller created
+    # (a persistent controller hands them back directly)
+    if abandoned:
+        print(f"Match of individual {individual_id} abandoned")
+        return None
+    if results is not None:
+        return results
     try:
-        with open(RESULTS_FILE, 'r') as f:
-            results = json.load(f)
-        
-        # --- Fitness Calculation based on Policies ---
-        fitness = 0
-        
-        # Policy 1: Match Outcome (heavily weighted)
-        if results["won_match"]:
-            fitness += 1000
-        else:
-            fitness -= 1000
-            
-        # Policy 2: Damage Differential
-        damage_dealt = results.get("damage_dealt", 0)
-        damage_taken = results.get("damage_taken", 0)
-        fitness += (damage_dealt * 1.5) # Reward dealing damage
-        fitness -= (damage_taken * 2.0) # Penalize taking damage more heavily
-        
-        # Policy 3: Health & Time Efficiency
-        health_bonus = results.get("health_bonus", 0)
-        time_bonus = results.get("time_bonus", 0)
-        fitness += health_bonus
-        fitness += time_bonus
-
-        # Policy 4: Aggressiveness (lower average distance is better)
-        avg_distance = results.get("average_distance", 255) # Default to a high distance if not found
-        fitness += (255 - avg_distance) * 0.5 # Reward for staying close
-
-        # Policy 5: Perfect Win Bonus
-        if results["fight_history"] == [1, 1]:
-            fitness += 500 # Add a significant bonus for a flawless 2-round victory
+        with open(results_file, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"Error: Results file '{results_file}' not found. Controller may have failed.")
+    except Exception as e:
+        print(f"An error occurred while reading the results: {e}")
+    return None
 
+def score_results(results, individual_id):
+    """Turns a match's results dict (None for a failed match) into the individual's fitness."""
+    if results is None:
+        return -9999 # Return a very low fitness score on error
+    try:
+        fitness = calculate_fitness(results)
         print(f"Individual {individual_id} Fitness Score: {fitness}")
+        if results.get("truncated"):
+            # Scored as if the rounds still to be decided were lost (see early_stop.py)
+            print(f"Individual {individual_id} match stopped early: {results['truncated']}")
+            fitness = CensoredFitness(fitness, results["truncated"])
+        if "latency" in results:
+            print(f"Individual {individual_id} Frame Latency: {format_latency(results['latency'])}")
         return fitness
-
-    except FileNotFoundError:
-        print(f"Error: Results file '{RESULTS_FILE}' not found. Controller may have failed.")
-        return -9999 # Return a very low fitness score on error
     except Exception as e:
         print(f"An error occurred during fitness calculation: {e}")
         return -9999
 
+def archive_traces(generation):
+    """Moves the traces recorded while evaluating a generation to TRACES_DIR/gen_<n>."""
+    current_dir = os.path.join(TRACES_DIR, "current")
+    if not os.path.isdir(current_dir):
+        return
+    generation_dir = os.path.join(TRACES_DIR, f"gen_{generation}")
+    shutil.rmtree(generation_dir, ignore_errors=True)
+    os.replace(current_dir, generation_dir)
+    print(f"Match traces saved to {generation_dir}")
+
+def parent_indices(fitness_scores):
+    """Population indices of the individuals selection() picks, best first."""
+    sorted_indices = np.argsort(fitness_scores)[::-1] # Sort from highest to lowest
+    return sorted_indices[:POPULATION_SIZE // 5]
+
+def parent_cutoff(fitness_scores):
+    """Fitness of the weakest individual selection() picks."""
+    return float(np.asarray(fitness_scores)[parent_indices(fitness_scores)].min())
 
 def selection(population, fitness_scores):
     """Selects the top 20% of the population to be parents for the next generation."""
-    sorted_indices = np.argsort(fitness_scores)[::-1] # Sort from highest to lowest
-    num_parents = POPULATION_SIZE // 5
-    parents = [population[i] for i in sorted_indices[:num_parents]]
+    parents = population[parent_indices(fitness_scores)]
     print(f"Selected top {len(parents)} individuals as parents.")
     return parents
 
-def crossover(parents):
-    """Creates a new population by breeding the selected parents."""
-    offspring_population = []
+def crossover(parents, layout=ANN_LAYOUT, lineage=None):
+    """
+    Creates a new population by breeding the selected parents.
+    Every child pair gets its own pair of distinct parents and one split point
+    per weight array; all pairs are bred at once with a single mask.
+    lineage, if given, is a (POPULATION_SIZE, 2) int array that receives
+    the indices (into parents) of every offspring's two parents; the elite
+    has only one, the other is -1.
+    """
+    offspring_population = layout.empty_population(POPULATION_SIZE)
     
     # Keep the best individual (elitism)
-    offspring_population.append(parents[0]) 
-    
-    while len(offspring_population) < POPULATION_SIZE:
-        p1, p2 = np.random.choice(parents, 2, replace=False)
-        
-        child1_ann, child2_ann = ANN(), ANN()
-        child1_weights, child2_weights = [], []
-
-        # Get weights from parents
-        p1_weights = p1.get_weights()
-        p2_weights = p2.get_weights()
-
-        # Perform crossover for each layer's weights
-        for p1_layer, p2_layer in zip(p1_weights, p2_weights):
-            split_point = np.random.randint(0, p1_layer.flatten().shape[0])
-            
-            c1_flat = np.concatenate((p1_layer.flatten()[:split_point], p2_layer.flatten()[split_point:]))
-            c2_flat = np.concatenate((p2_layer.flatten()[:split_point], p1_layer.flatten()[split_point:]))
-            
-            child1_weights.append(c1_flat.reshape(p1_layer.shape))
-            child2_weights.append(c2_flat.reshape(p2_layer.shape))
-
-        child1_ann.set_weights(child1_weights)
-        child2_ann.set_weights(child2_weights)
-        
-        offspring_population.append(child1_ann)
-        if len(offspring_population) < POPULATION_SIZE:
-            offspring_population.append(child2_ann)
+    offspring_population[0] = parents[0]
+
+    num_children = POPULATION_SIZE - 1
+    num_pairs = (num_children + 1) // 2
+    num_parents = len(parents)
+
+    # Two distinct parents per pair, like np.random.choice(parents, 2, replace=False)
+    first = np.random.randint(0, num_parents, num_pairs)
+    second = np.random.randint(0, num_parents - 1, num_pairs)
+    second += second >= first
+    p1 = parents[first]
+    p2 = parents[second]
+
+    # Single-point crossover inside each weight array: positions before the
+    # split point come from the first parent, the rest from the second.
+    split_points = np.random.randint(0, layout.sizes, (num_pairs, layout.num_layers))
+    take_first = layout.position < split_points[:, layout.layer_of]
+
+    children = np.empty((2 * num_pairs, layout.n_params), dtype=np.float32)
+    np.copyto(children[0::2], np.where(take_first, p1, p2))
+    np.copyto(children[1::2], np.where(take_first, p2, p1))
+    offspring_population[1:] = children[:num_children]
+    if lineage is not None:
+        lineage[0] = (0, -1)
+        lineage[1::2] = np.stack([first, second], axis=1)[:len(lineage[1::2])]
+        lineage[2::2] = np.stack([second, first], axis=1)[:len(lineage[2::2])]
             
     print(f"Created {len(offspring_population)} offspring via crossover.")
     return offspring_population
 
-def mutation(population, mutation_rate=0.05, mutation_strength=0.1):
-    """Applies small random changes to the weights of the new population."""
+def mutation(population, mutation_rate=0.05, mutation_strength=0.1, layout=ANN_LAYOUT):
+    """
+    Applies small random changes to the weights of the new population, in place.
+    Each weight array of each individual is perturbed with probability mutation_rate.
+    """
     # Don't mutate the best individual from the previous generation
-    for individual in population[1:]: 
-        weights = individual.get_weights()
-        new_weights = []
-        for layer_weights in weights:
-            if np.random.rand() < mutation_rate:
-                noise = np.random.normal(0, mutation_strength, layer_weights.shape)
-                new_weights.append(layer_weights + noise)
-            else:
-                new_weights.append(layer_weights)
-        individual.set_weights(new_weights)
+    mutate_layer = np.random.rand(len(population) - 1, layout.num_layers) < mutation_rate
+    for layer in range(layout.num_layers):
+        rows = np.flatnonzero(mutate_layer[:, layer]) + 1
+        if rows.size:
+            layer_slice = layout.slice(layer)
+            noise = np.random.normal(0, mutation_strength, (rows.size, layout.sizes[layer]))
+            population[rows, layer_slice] += noise.astype(np.float32)
     print("Applied mutation to the new population.")
     return population
 
+def tournament_selection(fitness_scores, size=None, exclude=None):
+    """
+    Index of the fittest of size (default TOURNAMENT_SIZE) individuals drawn
+    at random (NaN scores, i.e. members not yet played, never win). exclude
+    is left out if possible.
+    """
+    size = size or TOURNAMENT_SIZE
+    scores = np.nan_to_num(np.asarray(fitness_scores, dtype=np.float64), nan=-np.inf)
+    candidates = np.flatnonzero(np.isfinite(scores))
+    if exclude is not None and len(candidates) > 1:
+        candidates = candidates[candidates != exclude]
+    entrants = candidates[np.random.randint(0, len(candidates), size)]
+    return int(entrants[np.argmax(scores[entrants])])
+
+def breed_child(parent_a, parent_b, mutation_rate=0.05, mutation_strength=0.1, layout=ANN_LAYOUT):
+    """
+    One child of two genomes, bred like crossover() and mutation() breed a
+    whole population: a split point per weight array, then Gaussian noise
+    on each weight array with probability mutation_rate.
+    """
+    split_points = np.random.randint(0, layout.sizes)
+    child = np.where(layout.position < split_points[layout.layer_of], parent_a, parent_b).astype(np.float32)
+    for layer in np.flatnonzero(np.random.rand(layout.num_layers) < mutation_rate):
+        noise = np.random.normal(0, mutation_strength, layout.sizes[layer])
+        child[layout.slice(layer)] += noise.astype(np.float32)
+    return child
+
 # --- Main Training Loop ---
 def main():
-    if not os.path.exists(BEST_MODELS_DIR):
-        os.makedirs(BEST_MODELS_DIR)
-    if not os.path.exists(OVERALL_BEST_MODELS_DIR):
-        os.makedirs(OVERALL_BEST_MODELS_DIR)
-        
-    population = create_initial_population()
+    archive = GenomeArchive(GENOME_ARCHIVE_FILE)
+    if RESUME_FROM_CHECKPOINT and os.path.exists(CHECKPOINT_FILE):
+        state = load_checkpoint(CHECKPOINT_FILE)
+        np.random.set_state(state.rng_state)
+        # Generations archived after the checkpoint are about to be played again
+        archive.rollback(state.generation)
+        print(f"Resuming from {CHECKPOINT_FILE} at generation {state.generation + 1} "
+              f"(overall best fitness {state.overall_best_fitness}).")
+    else:
+        state = RunState(create_initial_population())
+        find_overall_best(state, archive)
+
+    if DISTRIBUTED:
+        pool = Coordinator(score_results, COORDINATOR_PORT)
+    else:
+        pool = create_pool()
+    # Genomes that failed every attempt while other matches succeeded are not played again this run
+    pool = SupervisedPool(pool, Quarantine(QUARANTINE_FILE if PERSIST_QUARANTINE else None))
+    try:
+        if EVOLUTION_MODE == "steady_state":
+            run_steady_state(pool, state, archive)
+        else:
+            run_generations(pool, state, archive)
+    finally:
+        # Matches still running at the end (steady state) are not needed any more
+        pool.close(cancel=True)
+
+    print("\nTraining complete.")
+
+def create_pool(evaluate_fn=evaluate_fitness, num_workers=None, base_port=None):
+    """
+    The local EvaluationPool; every concurrent evaluation gets its own port
+    and scratch directory. num_workers and base_port default to
+    NUM_PARALLEL_EVALUATIONS and CONTROLLER_PORT as they are when called.
+    """
+    num_workers = num_workers or NUM_PARALLEL_EVALUATIONS
+    base_port = base_port or CONTROLLER_PORT
+    controller_factory = None
+    if USE_PERSISTENT_CONTROLLER and SHARED_CONTROLLER:
+        shared = SharedController(python_command("multi_controller.py") + [
+            f"--precision={SHARED_PRECISION}", f"--max-disagreement={QUANTIZATION_MAX_DISAGREEMENT}"], "1")
+        controller_factory = lambda slot: shared.slot(slot.port, slot.workdir)
+    elif USE_PERSISTENT_CONTROLLER:
+        controller_factory = lambda slot: ControllerDaemon(python_command("controller.py"), "1",
+                                                           slot.port, slot.workdir)
+    return EvaluationPool(evaluate_fn, num_workers, base_port, controller_factory=controller_factory)
+
+def find_overall_best(state, archive):
+    """
+    Starts a fresh run knowing the best genome of earlier runs: the best
+    record of the archive, or else the best model file saved by runs from
+    before the archive existed.
+    """
+    best_record = archive.best()
+    if best_record is not None:
+        state.overall_best_fitness = archive.fitness(best_record)
+        state.overall_best_individual = np.array(archive.genome(best_record))
+        print(f"Loaded previous overall best model with fitness: {state.overall_best_fitness}")
+        return
 
-    overall_best_fitness = -np.inf # Initialize with negative infinity
-    overall_best_individual = None
+    overall_best_fitness = state.overall_best_fitness
+    overall_best_individual = state.overall_best_individual
 
     # Check for previous overall best model
     if os.path.exists(OVERALL_BEST_MODELS_DIR):
@@ -270,48 +512,265 @@ def main():
                     current_loaded_fitness = float(fitness_str)
                     if current_loaded_fitness > overall_best_fitness:
                         overall_best_fitness = current_loaded_fitness
-                        overall_best_individual = ANN() # Create a new ANN object
-                        overall_best_individual.load_weights(os.path.join(OVERALL_BEST_MODELS_DIR, model_file))
+                        overall_best_individual = load_genome(os.path.join(OVERALL_BEST_MODELS_DIR, model_file))
                         print(f"Loaded previous overall best model with fitness: {overall_best_fitness}")
                 except Exception as e:
                     print(f"Warning: Could not parse fitness from filename {model_file}: {e}")
 
-    for gen in range(NUM_GENERATIONS):
+    state.overall_best_fitness = overall_best_fitness
+    state.overall_best_individual = overall_best_individual
+
+def match_settings(stop_below=None):
+    """
+    The settings every match of the run is played with, passed through the
+    pool to run_match. They travel with cluster jobs, so remote workers
+    play with the coordinator's settings rather than their own.
+    """
+    return {"stop_below": stop_below, "decision_interval": DECISION_INTERVAL, "frame_summary": FRAME_SUMMARY}
+
+def evaluate_generation(pool, population, cache, generation, stop_below=None):
+    """
+    Returns the fitness of every individual, only playing the genomes the
+    fitness cache does not already know (or wants replayed). With
+    USE_RACING, genomes near the parent cut-off play extra matches and
+    their fitness is the mean of them (see racing.py). stop_below is the
+    early-stop cut-off every match is played with.
+    """
+    settings = match_settings(stop_below)
+    play = lambda indices: pool.evaluate_population(population[indices], [i + 1 for i in indices], **settings)
+    if USE_RACING:
+        fitness_scores, matches = race(population, play, POPULATION_SIZE // 5, RACING_MAX_MATCHES,
+                                       RACING_CONFIDENCE_Z, RACING_NOISE_PRIOR, cache, generation)
+        print(f"Racing: {matches} matches for {len(population)} individuals")
+    elif cache is None:
+        return pool.evaluate_population(population, **settings)
+    else:
+        fitness_scores = cache.evaluate(population, play, generation)
+    if cache is not None:
+        print(f"Fitness cache: {cache.stats()}")
+    return fitness_scores
+
+def archive_generation(archive, population, fitness_scores, lineage, generation):
+    """Appends the generation's best individual (or all of them) to the genome archive."""
+    best_index = int(np.argmax(fitness_scores))
+    indices = range(len(population)) if ARCHIVE_WHOLE_POPULATION else [best_index]
+    for index in indices:
+        parents = tuple(lineage[index]) if lineage is not None else (-1, -1)
+        kind = KIND_GENERATION_BEST if index == best_index else KIND_INDIVIDUAL
+        archive.append(population[index], generation, index, fitness_scores[index], parents, kind,
+                       DECISION_INTERVAL, FRAME_SUMMARY)
+    return archive.best_of_generation(generation)
+
+def make_fitness_cache(state):
+    if not USE_FITNESS_CACHE:
+        return None
+    cache = FitnessCache(FITNESS_CACHE_SIZE, FITNESS_REEVALUATE_EVERY)
+    if state.cache_arrays is not None:
+        cache.load_arrays(state.cache_arrays)
+    return cache
+
+def run_generations(pool, state, archive):
+    """
+    Runs the evaluate / select / breed loop from state.generation up to
+    NUM_GENERATIONS, archiving every generation's best genome and
+    checkpointing the whole run after every generation.
+    """
+    population = state.population
+    lineage = state.lineage
+    overall_best_fitness = state.overall_best_fitness
+    overall_best_individual = state.overall_best_individual
+    cache = make_fitness_cache(state)
+    for gen in range(state.generation, NUM_GENERATIONS):
         print(f"\n{'='*20} GENERATION {gen + 1}/{NUM_GENERATIONS} {'='*20}")
+
+        # A match that cannot beat the weakest of the last parents is not played out
+        stop_below = None
+        if EARLY_STOP_BELOW_PARENTS and state.last_fitness_scores:
+            stop_below = parent_cutoff(state.last_fitness_scores)
+            print(f"Matches stop early once they cannot reach fitness {stop_below}")
         
-        fitness_scores = []
-        for i, individual in enumerate(population):
-            fitness = evaluate_fitness(individual, i + 1)
-            fitness_scores.append(fitness)
+        fitness_scores = evaluate_generation(pool, population, cache, gen + 1, stop_below)
+        if RECORD_TRACES:
+            archive_traces(gen + 1)
             
         # Find the best individual of the generation
         best_fitness_idx = np.argmax(fitness_scores)
         best_fitness = fitness_scores[best_fitness_idx]
-        best_individual = population[best_fitness_idx]
+        best_individual = population[best_fitness_idx].copy()
         
         print(f"\nGeneration {gen + 1} Summary:")
         print(f"  - Best Fitness: {best_fitness}")
         print(f"  - Average Fitness: {np.mean(fitness_scores)}")
         
-        # Save the best model of the generation
-        best_model_path = os.path.join(BEST_MODELS_DIR, f"gen_{gen+1}_best_model.weights.h5")
-        best_individual.save_weights(best_model_path)
-        print(f"Saved best model of generation to {best_model_path}")
+        # Archive the best model of the generation; the archive also tracks the overall best
+        record = archive_generation(archive, population, fitness_scores, lineage, gen + 1)
+        print(f"Archived best model of generation as record {record} of {GENOME_ARCHIVE_FILE}")
 
-        # Compare with overall best and save if better
+        # Compare with overall best
         if best_fitness > overall_best_fitness:
             overall_best_fitness = best_fitness
             overall_best_individual = best_individual
-            overall_best_model_path = os.path.join(OVERALL_BEST_MODELS_DIR, f"overall_best_model_fitness_{overall_best_fitness:.2f}.weights.h5")
-            overall_best_individual.save_weights(overall_best_model_path)
-            print(f"New overall best model saved to {overall_best_model_path}")
+            print(f"New overall best model: record {record} of {GENOME_ARCHIVE_FILE}")
 
-        # Evolve the next generation
+        # Evolve the next generation, remembering every child's parents
         parents = selection(population, fitness_scores)
-        offspring = crossover(parents)
+        lineage = np.empty((POPULATION_SIZE, 2), dtype=np.int64)
+        offspring = crossover(parents, lineage=lineage)
+        chosen = parent_indices(fitness_scores)
+        lineage = np.where(lineage >= 0, chosen[np.maximum(lineage, 0)], -1)
         population = mutation(offspring)
 
-    print("\nTraining complete.")
+        # The next generation is bred but not yet played: resuming starts right here
+        state.history.append((float(best_fitness), float(np.mean(fitness_scores))))
+        state.population = population
+        state.lineage = lineage
+        state.generation = gen + 1
+        state.overall_best_fitness = overall_best_fitness
+        state.overall_best_individual = overall_best_individual
+        state.last_fitness_scores = [float(score) for score in fitness_scores]
+        state.cache_arrays = cache.to_arrays() if cache is not None else None
+        state.rng_state = np.random.get_state()
+        save_checkpoint(CHECKPOINT_FILE, state)
+        print(f"Checkpoint saved to {CHECKPOINT_FILE}")
+
+def run_steady_state(pool, state, archive):
+    """
+    Steady-state evolution without a generation barrier. Every worker is
+    kept busy: whenever a match finishes, its individual joins the
+    population (replacing the worst member if it beats it) and one new
+    child, bred from two tournament winners, goes to the freed worker.
+
+    Every POPULATION_SIZE finished matches count as one generation: its
+    best member is archived, the overall best updated and the run
+    checkpointed with the current population and its scores, so a resumed
+    run loses only the matches that were in flight. After the last
+    generation the matches still in flight are abandoned, not waited for.
+    With EARLY_STOP_BELOW_PARENTS, a child's match stops once it can no
+    longer beat the worst member of a fully played population, since it
+    would be thrown away anyway.
+    """
+    population = state.population.copy()
+    fitness_scores = (np.array(state.population_fitness, dtype=np.float64) if state.population_fitness is not None
+                      else np.full(POPULATION_SIZE, np.nan))
+    lineage = state.lineage.copy() if state.lineage is not None else np.full((POPULATION_SIZE, 2), -1, dtype=np.int64)
+    cache = make_fitness_cache(state)
+    generation = state.generation
+    finished = 0
+    next_id = generation * POPULATION_SIZE + 1
+    unplayed = [int(index) for index in np.flatnonzero(np.isnan(fitness_scores))]
+    in_flight = {}
+    busy_seconds = 0.0
+    window_start = time.monotonic()
+    print(f"\n{'='*20} STEADY STATE: GENERATION {generation + 1}/{NUM_GENERATIONS} {'='*20}")
+
+    def next_candidate():
+        """(population index or None for a new child, genome, parents) of the next match, or None to wait."""
+        if unplayed:
+            index = unplayed.pop(0)
+            return index, population[index], tuple(lineage[index])
+        if np.count_nonzero(~np.isnan(fitness_scores)) < 2:
+            return None # the first members are still being played
+        first = tournament_selection(fitness_scores)
+        second = tournament_selection(fitness_scores, exclude=first)
+        return None, breed_child(population[first], population[second]), (first, second)
+
+    def finish(target, genome, parents, fitness):
+        nonlocal finished, generation, busy_seconds, window_start
+        if target is not None:
+            fitness_scores[target] = fitness
+        else:
+            played = np.flatnonzero(~np.isnan(fitness_scores))
+            worst = played[np.argmin(fitness_scores[played])]
+            if fitness > fitness_scores[worst]:
+                population[worst] = genome
+                fitness_scores[worst] = fitness
+                lineage[worst] = parents
+        finished += 1
+        if finished % POPULATION_SIZE == 0:
+            generation += 1
+            now = time.monotonic()
+            # Matches still running were busy for the part of the window they overlap
+            busy_seconds += sum(now - max(started, window_start) for *_, started in in_flight.values())
+            elapsed = now - window_start
+            utilization = busy_seconds / (elapsed * pool.num_workers) if elapsed > 0 else 1.0
+            busy_seconds, window_start = 0.0, now
+            end_generation(utilization)
+
+    def end_generation(utilization):
+        played = ~np.isnan(fitness_scores)
+        scores = np.where(played, fitness_scores, -np.inf)
+        best_index = int(np.argmax(scores))
+        print(f"\nGeneration {generation} Summary:")
+        print(f"  - Best Fitness: {fitness_scores[best_index]}")
+        print(f"  - Average Fitness: {np.mean(fitness_scores[played])}")
+        print(f"  - Worker Utilization: {utilization:.1%}")
+        if RECORD_TRACES:
+            archive_traces(generation)
+
+        record = archive_generation(archive, population, scores, lineage, generation)
+        print(f"Archived best model of generation as record {record} of {GENOME_ARCHIVE_FILE}")
+        if fitness_scores[best_index] > state.overall_best_fitness:
+            state.overall_best_fitness = float(fitness_scores[best_index])
+            state.overall_best_individual = population[best_index].copy()
+            print(f"New overall best model: record {record} of {GENOME_ARCHIVE_FILE}")
+
+        state.history.append((float(fitness_scores[best_index]), float(np.mean(fitness_scores[played]))))
+        state.population = population.copy()
+        state.population_fitness = fitness_scores.copy()
+        state.lineage = lineage.copy()
+        state.generation = generation
+        state.last_fitness_scores = [float(score) for score in fitness_scores[played]]
+        state.cache_arrays = cache.to_arrays() if cache is not None else None
+        state.rng_state = np.random.get_state()
+        save_checkpoint(CHECKPOINT_FILE, state)
+        print(f"Checkpoint saved to {CHECKPOINT_FILE}")
+        if generation < NUM_GENERATIONS:
+            print(f"\n{'='*20} STEADY STATE: GENERATION {generation + 1}/{NUM_GENERATIONS} {'='*20}")
+
+    def dispatch():
+        nonlocal next_id
+        while len(in_flight) < pool.num_workers and generation < NUM_GENERATIONS:
+            candidate = next_candidate()
+            if candidate is None:
+                return
+            target, genome, parents = candidate
+            if cache is not None:
+                key = genome_key(genome)
+                entry = cache.get(key)
+                if entry is not None and not cache.is_stale(entry, generation + 1):
+                    finish(target, genome, parents, entry.fitness) # known genome: no match needed
+                    continue
+            # The worst member only gets better, so a child below it now is never kept
+            stop_below = None
+            if EARLY_STOP_BELOW_PARENTS and target is None and not np.isnan(fitness_scores).any():
+                stop_below = float(fitness_scores.min())
+            future = pool.submit(genome, next_id, **match_settings(stop_below))
+            in_flight[future] = (target, genome, parents, next_id, time.monotonic())
+            next_id += 1
+
+    dispatch()
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            target, genome, parents, individual_id, started = in_flight.pop(future)
+            busy_seconds += time.monotonic() - max(started, window_start)
+            try:
+                fitness = future.result()
+            except Exception as e:
+                print(f"Evaluation of individual {individual_id} crashed: {e}")
+                fitness = -9999
+            print(f"Individual {individual_id} finished with fitness {fitness}")
+            if cache is not None:
+                fitness = cache.add(genome_key(genome), fitness, generation + 1)
+            if generation < NUM_GENERATIONS:
+                finish(target, genome, parents, fitness)
+        if generation >= NUM_GENERATIONS:
+            # Their results would be thrown away; the pool's close(cancel=True) stops them
+            for future in in_flight:
+                future.cancel()
+            print(f"Abandoning {len(in_flight)} matches still in flight.")
+            return
+        dispatch()
 
 if __name__ == '__main__':
     main()
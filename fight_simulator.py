@@ -0,0 +1,454 @@
+import argparse
+import random
+import protocol
+from lifecycle import LifecycleSubscriber, WEIGHTS_LOADED
+from stand_in_game import connect_to_controller
+
+# --- Game constants (in the units the emulator reports) ---
+MAX_HEALTH = 176
+KO_HEALTH = 255          # the game reports a knocked-out player's health as 255 (-1)
+GROUND_Y = 192
+STAGE_LEFT = 40
+STAGE_RIGHT = 353
+START_X = (150, 250)
+BODY_WIDTH = 32          # closest the two players can stand
+ROUND_SECONDS = 99
+FRAMES_PER_SECOND = 60
+ROUNDS_TO_WIN = 2
+MAX_ROUNDS = 4
+
+# --- Phase lengths in frames ---
+SELECT_TIMEOUT_FRAMES = 900 # character select picks automatically after this
+SELECT_CONFIRM_FRAMES = 30  # from Start to the first round intro
+INTRO_FRAMES = 90           # round_started is low; the controller needs > 60
+ROUND_OVER_FRAMES = 90      # round_over is held high
+
+# --- Movement ---
+WALK_SPEED = 2
+JUMP_FRAMES = 36
+JUMP_HEIGHT = 64
+JUMP_SPEED = 3
+PUSHBACK = 6
+
+# Stances, also folded into the reported move id
+STANDING, CROUCHING, JUMPING = 0, 1, 2
+
+# Attack heights: what the defender has to do to block
+HIGH, LOW, OVERHEAD = 0, 1, 2
+
+SELECT_PHASE, INTRO_PHASE, FIGHT_PHASE, ROUND_OVER_PHASE, MATCH_OVER_PHASE = range(5)
+
+
+class Move:
+    def __init__(self, button, move_id, startup, active, recovery, damage, reach, hitstun):
+        self.button = button
+        self.move_id = move_id
+        self.startup = startup
+        self.active = active
+        self.recovery = recovery
+        self.damage = damage
+        self.reach = reach
+        self.hitstun = hitstun
+
+    @property
+    def total_frames(self):
+        return self.startup + self.active + self.recovery
+
+
+# Punches on Y/X/L, kicks on B/A/R, light to heavy. Checked in this order
+# when several attack buttons are pressed on the same frame.
+# Light moves leave the attacker slightly ahead on hit, heavy ones behind.
+MOVES = [
+    Move("L", 3, 8, 4, 18, 14, 64, 16),
+    Move("R", 6, 9, 5, 20, 15, 76, 18),
+    Move("X", 2, 5, 4, 10, 8, 58, 13),
+    Move("A", 5, 6, 4, 12, 9, 68, 14),
+    Move("Y", 1, 3, 3, 6, 4, 50, 9),
+    Move("B", 4, 4, 3, 8, 5, 60, 10),
+]
+
+
+def bcd(value):
+    """The game shows the timer in binary-coded decimal: 99 seconds reads as 0x99 (153)."""
+    return (value // 10) * 16 + value % 10
+
+
+def no_buttons():
+    return {name: False for name in protocol.BUTTON_KEYS}
+
+
+class Fighter:
+    """One player's physical state for the current round."""
+    def __init__(self, character, x_coord):
+        self.character = character
+        self.health = MAX_HEALTH
+        self.x = x_coord
+        self.y = GROUND_Y
+        self.stance = STANDING
+        self.jump_frame = 0
+        self.jump_dx = 0
+        self.move = None
+        self.move_frame = 0
+        self.move_stance = STANDING
+        self.move_has_hit = False
+        self.stun = 0
+        self.blocking = False
+        self.buttons = no_buttons()
+        self.previous_buttons = no_buttons()
+
+    @property
+    def airborne(self):
+        return self.stance == JUMPING
+
+    @property
+    def in_move(self):
+        return self.move is not None
+
+    @property
+    def move_id(self):
+        return self.move.move_id + 16 * self.move_stance if self.move is not None else 0
+
+    def pressed(self, button):
+        """True on the frame a button goes down; holding it does not repeat."""
+        return self.buttons[button] and not self.previous_buttons[button]
+
+    def to_dict(self):
+        return {
+            "character": self.character,
+            "health": self.health,
+            "x": self.x,
+            "y": self.y,
+            "jumping": self.stance == JUMPING,
+            "crouching": self.stance == CROUCHING,
+            "buttons": dict(self.buttons),
+            "in_move": self.move is not None,
+            "move": self.move_id,
+        }
+
+
+class CpuOpponent:
+    """
+    A simple scripted opponent. It re-decides every few frames, like a
+    player's reaction time, using only its own seeded RNG so a whole match
+    is reproducible.
+    """
+    def __init__(self, rng, difficulty=0.5):
+        self.rng = rng
+        self.difficulty = difficulty
+        self.reaction_frames = round(14 - 10 * difficulty)
+        self.frames_to_decision = 0
+        self.intent = no_buttons()
+
+    def buttons(self, me, opponent):
+        self.frames_to_decision -= 1
+        if self.frames_to_decision <= 0:
+            self.frames_to_decision = self.reaction_frames
+            self.intent = self._decide(me, opponent)
+        buttons = dict(self.intent)
+        # Attack buttons are tapped, so the next decision can press them again
+        self.intent.update({move.button: False for move in MOVES})
+        return buttons
+
+    def _decide(self, me, opponent):
+        buttons = no_buttons()
+        forward = "Right" if opponent.x > me.x else "Left"
+        back = "Left" if forward == "Right" else "Right"
+        distance = abs(opponent.x - me.x)
+        roll = self.rng.random()
+
+        recovering = opponent.in_move and opponent.move_frame >= opponent.move.startup + opponent.move.active
+        if recovering and distance < 70 and roll < self.difficulty:
+            # Punish the whiffed or blocked move
+            buttons[self.rng.choice(MOVES[:4]).button] = True
+        elif opponent.in_move and distance < 90 and roll < self.difficulty:
+            buttons[back] = True
+            buttons["Down"] = opponent.move_stance == CROUCHING
+        elif distance > 80:
+            buttons[forward] = True
+            if roll < 0.05 + 0.1 * self.difficulty:
+                buttons["Up"] = True
+        elif roll < 0.3 + 0.5 * self.difficulty:
+            buttons[self.rng.choice(MOVES).button] = True
+            buttons["Down"] = self.rng.random() < 0.3
+        elif roll < 0.85:
+            buttons[back] = True
+        return buttons
+
+
+class FightSimulator:
+    """
+    Headless, deterministic stand-in for the emulator. step() advances one
+    frame given the controller's command and state_dict() reports the frame
+    in the same shape as the emulator's JSON. The same seed and the same
+    sequence of commands always produce the same match.
+
+    player is the slot the bot controls ("1" or "2"); the other slot is a
+    CpuOpponent.
+    """
+    def __init__(self, seed=0, player="1", difficulty=0.5):
+        self.rng = random.Random(seed)
+        self.player = player
+        self.cpu = CpuOpponent(random.Random(self.rng.random()), difficulty)
+        self.cpu_character = self.rng.randrange(8)
+        self.fighters = (Fighter(0, START_X[0]), Fighter(0, START_X[1]))
+        self.phase = SELECT_PHASE
+        self.phase_frames = 0
+        self.frame_count = 0
+        self.round_frames = 0
+        self.result = "NOT_OVER"
+        self.wins = [0, 0]
+        self.rounds_played = 0
+
+    # --- Reporting ---
+
+    @property
+    def timer(self):
+        if self.phase in (FIGHT_PHASE, ROUND_OVER_PHASE):
+            return bcd(max(0, ROUND_SECONDS - self.round_frames // FRAMES_PER_SECOND))
+        return bcd(ROUND_SECONDS)
+
+    @property
+    def match_over(self):
+        return self.phase == MATCH_OVER_PHASE
+
+    def state_dict(self):
+        return {
+            "p1": self.fighters[0].to_dict(),
+            "p2": self.fighters[1].to_dict(),
+            "timer": self.timer,
+            "result": self.result,
+            "round_started": self.phase in (FIGHT_PHASE, ROUND_OVER_PHASE),
+            "round_over": self.phase == ROUND_OVER_PHASE,
+        }
+
+    # --- Simulation ---
+
+    def step(self, command):
+        """Advances one frame. command is a command dict as the controller sends it."""
+        self.frame_count += 1
+        self.phase_frames += 1
+        bot_index = 0 if self.player == "1" else 1
+        bot, cpu = self.fighters[bot_index], self.fighters[1 - bot_index]
+        bot_buttons = command["p1"] if self.player == "1" else command["p2"]
+
+        if self.phase == SELECT_PHASE:
+            # The controller presses Start on the p1 buttons whichever side it plays
+            if command["p1"]["Start"] or command["p2"]["Start"] or self.phase_frames >= SELECT_TIMEOUT_FRAMES:
+                self.phase = INTRO_PHASE
+                self.phase_frames = -SELECT_CONFIRM_FRAMES
+                cpu.character = self.cpu_character
+        elif self.phase == INTRO_PHASE:
+            if self.phase_frames >= INTRO_FRAMES:
+                self._start_round()
+        elif self.phase == FIGHT_PHASE:
+            self.round_frames += 1
+            self._fight_frame(bot, cpu, bot_buttons)
+        elif self.phase == ROUND_OVER_PHASE:
+            if self.phase_frames >= ROUND_OVER_FRAMES:
+                self._next_round()
+
+    def _start_round(self):
+        self.phase = FIGHT_PHASE
+        self.phase_frames = 0
+        self.round_frames = 0
+        self.result = "NOT_OVER"
+
+    def _next_round(self):
+        self.rounds_played += 1
+        if max(self.wins) >= ROUNDS_TO_WIN or self.rounds_played >= MAX_ROUNDS:
+            self.phase = MATCH_OVER_PHASE
+        else:
+            self.phase = INTRO_PHASE
+        self.phase_frames = 0
+        self.result = "NONE"
+        self.fighters = tuple(Fighter(fighter.character, x_coord)
+                              for fighter, x_coord in zip(self.fighters, START_X))
+
+    def _fight_frame(self, bot, cpu, bot_buttons):
+        p1, p2 = self.fighters
+        cpu_buttons = self.cpu.buttons(cpu, bot)
+        for fighter, buttons in ((bot, bot_buttons), (cpu, cpu_buttons)):
+            fighter.previous_buttons = fighter.buttons
+            fighter.buttons = {name: bool(buttons[name]) for name in protocol.BUTTON_KEYS}
+
+        self._act(p1, p2)
+        self._act(p2, p1)
+        self._separate()
+        # Both hits are checked before either lands, so trades are symmetric
+        hits = [(attacker, attacker.move, defender, self._check_hit(attacker, defender))
+                for attacker, defender in ((p1, p2), (p2, p1))]
+        for attacker, move, defender, blocked in hits:
+            if blocked is not None:
+                self._land_hit(attacker, move, defender, blocked)
+
+        knocked_out = [fighter.health == KO_HEALTH for fighter in self.fighters]
+        if any(knocked_out):
+            if all(knocked_out):
+                self._end_round(None)
+            else:
+                self._end_round(1 if knocked_out[0] else 0)
+        elif self.round_frames >= ROUND_SECONDS * FRAMES_PER_SECOND:
+            if p1.health == p2.health:
+                self._end_round(None)
+            else:
+                self._end_round(0 if p1.health > p2.health else 1)
+
+    def _end_round(self, winner):
+        self.phase = ROUND_OVER_PHASE
+        self.phase_frames = 0
+        if winner is None:
+            self.result = "DRAW"
+        else:
+            self.wins[winner] += 1
+            self.result = "P1" if winner == 0 else "P2"
+
+    def _act(self, fighter, opponent):
+        """Applies one frame of input and movement to a fighter."""
+        forward = 1 if opponent.x > fighter.x else -1
+        holding_forward = fighter.buttons["Right"] if forward == 1 else fighter.buttons["Left"]
+        holding_back = fighter.buttons["Left"] if forward == 1 else fighter.buttons["Right"]
+        fighter.blocking = False
+
+        if fighter.stun > 0:
+            fighter.stun -= 1
+            if fighter.airborne:
+                self._advance_jump(fighter)
+            return
+
+        if fighter.move is not None:
+            fighter.move_frame += 1
+            if fighter.move_frame >= fighter.move.total_frames:
+                fighter.move = None
+        elif not fighter.airborne or fighter.jump_frame < JUMP_FRAMES - 8:
+            for move in MOVES:
+                if fighter.pressed(move.button):
+                    fighter.move = move
+                    fighter.move_frame = 0
+                    fighter.move_stance = fighter.stance
+                    fighter.move_has_hit = False
+                    break
+
+        if fighter.airborne:
+            self._advance_jump(fighter)
+            return
+
+        if fighter.buttons["Up"] and fighter.move is None:
+            fighter.stance = JUMPING
+            fighter.jump_frame = 0
+            fighter.jump_dx = JUMP_SPEED * forward * holding_forward - JUMP_SPEED * forward * holding_back
+            self._advance_jump(fighter)
+        elif fighter.buttons["Down"]:
+            fighter.stance = CROUCHING
+            fighter.blocking = holding_back and fighter.move is None
+        else:
+            fighter.stance = STANDING
+            fighter.blocking = holding_back and fighter.move is None
+            if fighter.move is None:
+                if holding_forward:
+                    fighter.x += WALK_SPEED * forward
+                elif holding_back:
+                    fighter.x -= WALK_SPEED * forward
+
+    def _advance_jump(self, fighter):
+        fighter.jump_frame += 1
+        progress = fighter.jump_frame / JUMP_FRAMES
+        fighter.x += fighter.jump_dx
+        fighter.y = GROUND_Y - int(4 * JUMP_HEIGHT * progress * (1 - progress))
+        if fighter.jump_frame >= JUMP_FRAMES:
+            fighter.stance = STANDING
+            fighter.y = GROUND_Y
+            fighter.jump_frame = 0
+            if fighter.move is not None and fighter.move_stance == JUMPING:
+                fighter.move = None # landing cancels a jump attack
+
+    def _separate(self):
+        """Keeps both fighters on stage and out of each other."""
+        p1, p2 = self.fighters
+        for fighter in self.fighters:
+            fighter.x = min(max(fighter.x, STAGE_LEFT), STAGE_RIGHT)
+        if abs(p1.x - p2.x) < BODY_WIDTH and not (p1.airborne or p2.airborne):
+            left, right = (p1, p2) if p1.x <= p2.x else (p2, p1)
+            overlap = BODY_WIDTH - (right.x - left.x)
+            left.x -= overlap // 2
+            right.x += overlap - overlap // 2
+            if left.x < STAGE_LEFT:
+                right.x += STAGE_LEFT - left.x
+                left.x = STAGE_LEFT
+            if right.x > STAGE_RIGHT:
+                left.x -= right.x - STAGE_RIGHT
+                right.x = STAGE_RIGHT
+
+    def _check_hit(self, attacker, defender):
+        """Returns None if the attacker's move does not connect this frame, else whether it was blocked."""
+        move = attacker.move
+        if move is None or attacker.move_has_hit or defender.health == KO_HEALTH:
+            return None
+        if not move.startup <= attacker.move_frame < move.startup + move.active:
+            return None
+        if abs(attacker.x - defender.x) > move.reach:
+            return None
+
+        height = {STANDING: HIGH, CROUCHING: LOW, JUMPING: OVERHEAD}[attacker.move_stance]
+        # Low attacks pass under a jump; jump-ins need the defender on the ground
+        if height in (LOW, OVERHEAD) and defender.airborne:
+            return None
+        return defender.blocking and not defender.airborne and (
+            height == HIGH
+            or (height == LOW and defender.stance == CROUCHING)
+            or (height == OVERHEAD and defender.stance == STANDING))
+
+    def _land_hit(self, attacker, move, defender, blocked):
+        attacker.move_has_hit = True
+        direction = 1 if defender.x > attacker.x else -1
+        if blocked:
+            defender.stun = move.hitstun - 4
+            defender.x += direction * PUSHBACK // 2
+            return
+
+        defender.health -= move.damage
+        if defender.health <= 0:
+            defender.health = KO_HEALTH
+        defender.stun = move.hitstun
+        defender.move = None
+        defender.x += direction * PUSHBACK
+
+def run(port, events_port=None, seed=0, player="1", difficulty=0.5, ready_timeout=120,
+        wire_format=protocol.FORMAT_LEGACY):
+    """
+    Plays one simulated match against the controller listening on port, as
+    fast as the controller answers, until the controller hangs up. Like the
+    emulator it sends the state first and applies the reply to the next frame.
+    Returns the simulator, so the final state can be inspected.
+    """
+    client_socket = connect_to_controller(port)
+    connection = protocol.open_connection(client_socket, wire_format)
+    if events_port is not None:
+        subscriber = LifecycleSubscriber(events_port)
+        subscriber.wait_for(WEIGHTS_LOADED, ready_timeout)
+        subscriber.close()
+
+    simulator = FightSimulator(seed, player, difficulty)
+    try:
+        while True:
+            connection.send_state(simulator.state_dict())
+            simulator.step(connection.receive_command())
+    except OSError:
+        pass # the controller hangs up once it has seen the match end
+    finally:
+        client_socket.close()
+    return simulator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless, deterministic fighting game speaking the controller socket protocol")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--events-port", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0, help="Same seed and same bot, same match")
+    parser.add_argument("--player", choices=["1", "2"], default="1", help="Slot the controller plays; the CPU takes the other")
+    parser.add_argument("--difficulty", type=float, default=0.5, help="CPU opponent aggressiveness and blocking, 0 to 1")
+    parser.add_argument("--protocol", choices=["legacy", "json", "binary"], default="legacy",
+                        help="Wire format: unframed JSON like the emulator, or a negotiated framed format")
+    args = parser.parse_args()
+    wire_format = {"legacy": protocol.FORMAT_LEGACY, "json": protocol.FORMAT_JSON, "binary": protocol.FORMAT_BINARY}[args.protocol]
+    simulator = run(args.port, args.events_port, args.seed, args.player, args.difficulty, wire_format=wire_format)
+    print(f"Simulated {simulator.frame_count} frames, rounds won P1 {simulator.wins[0]} - P2 {simulator.wins[1]}.")
@@ -0,0 +1,147 @@
+import json
+import numpy as np
+
+# The fitness of a match, computed from the results dict controller.py
+# reports. best_case_fitness mirrors DEFAULT_POLICY term by term for a
+# match still being played; keep the two in step.
+MAX_HEALTH = 176
+ROUND_TIMER = 0x99 # The timer at the start of a round (99 seconds, in binary-coded decimal)
+TIME_BONUS_OFFSET = 48 # Timer value below which a won round earns no time bonus
+KNOCKED_OUT = 255 # Health the game reports for a knocked-out fighter
+ROUNDS_TO_WIN = 2
+
+
+# The per-match columns a policy's terms are read from, and the value a
+# results dict without the key stands for
+SUMMARY_DEFAULTS = {
+    "damage_dealt": 0,
+    "damage_taken": 0,
+    "health_bonus": 0,
+    "time_bonus": 0,
+    "average_distance": 255, # Default to a high distance if not found
+}
+
+
+def win_loss(columns):
+    """+1 for a won match, -1 for a lost one."""
+    return np.where(columns["won_match"], 1, -1)
+
+
+def closeness(columns):
+    """255 minus the average distance to the opponent: staying close scores higher."""
+    return 255 - columns["average_distance"]
+
+
+# Terms computed from the summary columns; any column is a term too
+TERMS = {"win_loss": win_loss, "closeness": closeness}
+
+
+class FitnessPolicy:
+    """
+    A fitness formula as an ordered list of (term, weight) pairs. Terms are
+    TERMS or per-match columns (results_columns, or any of fitness_engine's
+    reducers), so score() rates a whole array of matches at once. The terms
+    are added up in order, which keeps the result bit for bit that of the
+    same formula written out by hand.
+    """
+    def __init__(self, terms):
+        self.terms = [(name, weight) for name, weight in terms]
+        if not self.terms:
+            raise ValueError("A fitness policy needs at least one term")
+
+    @classmethod
+    def from_json(cls, path):
+        """Reads a policy from a JSON object of term weights, in order."""
+        with open(path, "r") as f:
+            return cls(json.load(f).items())
+
+    def with_weights(self, weights):
+        """A copy with some weights replaced; terms not in the policy yet are appended."""
+        weights = dict(weights)
+        terms = [(name, weights.pop(name, weight)) for name, weight in self.terms]
+        return FitnessPolicy(terms + list(weights.items()))
+
+    def term_names(self):
+        return [name for name, _ in self.terms]
+
+    def score(self, columns):
+        """The fitness of every match in columns (a mapping of per-match arrays)."""
+        fitness = 0
+        for name, weight in self.terms:
+            values = TERMS[name](columns) if name in TERMS else columns[name]
+            fitness = fitness + values * weight
+        return np.asarray(fitness, dtype=np.float64)
+
+    def __repr__(self):
+        return " + ".join(f"{weight} * {name}" for name, weight in self.terms)
+
+
+# The formula evolution.py plays by
+DEFAULT_POLICY = FitnessPolicy([
+    ("win_loss", 1000),       # Policy 1: Match Outcome (heavily weighted)
+    ("damage_dealt", 1.5),    # Policy 2: Damage Differential - reward dealing damage,
+    ("damage_taken", -2.0),   # penalize taking damage more heavily
+    ("health_bonus", 1),      # Policy 3: Health & Time Efficiency
+    ("time_bonus", 1),
+    ("closeness", 0.5),       # Policy 4: Aggressiveness (lower average distance is better)
+    ("perfect_win", 500),     # Policy 5: Perfect Win Bonus, for a flawless 2-round victory
+])
+
+
+def results_columns(results_list):
+    """
+    The per-match columns of a list of results dicts written by
+    controller.py; fitness_engine.py reduces the same columns from
+    recorded frames.
+    """
+    histories = [results["fight_history"] for results in results_list]
+    columns = {"won_match": np.array([bool(results["won_match"]) for results in results_list], dtype=bool)}
+    for name, default in SUMMARY_DEFAULTS.items():
+        columns[name] = np.array([results.get(name, default) for results in results_list], dtype=np.float64)
+    columns["rounds_won"] = np.array([history.count(1) for history in histories], dtype=np.int64)
+    columns["rounds_lost"] = np.array([history.count(0) for history in histories], dtype=np.int64)
+    columns["perfect_win"] = np.array([history == [1, 1] for history in histories], dtype=bool)
+    return columns
+
+
+def calculate_fitness(results, policy=DEFAULT_POLICY):
+    """Turns the results dict written by controller.py into a fitness score."""
+    return float(policy.score(results_columns([results]))[0])
+
+
+def best_case_fitness(fight_history, damage_dealt, damage_taken, health_bonus, time_bonus,
+                      bot_health, opponent_health, timer):
+    """
+    An upper bound on the fitness a match in the middle of a round can
+    still end with: the bot wins the match without taking another hit,
+    winning this round and the ones it still needs at once, yet still gets
+    credit for emptying the opponent's health in every round the match may
+    last, and stands next to the opponent from now on.
+    """
+    rounds_needed = ROUNDS_TO_WIN - fight_history.count(1)
+    # Every round the match may still last, this one included
+    rounds_left = rounds_needed + ROUNDS_TO_WIN - 1 - fight_history.count(0)
+    bot_health = 0 if bot_health == KNOCKED_OUT else bot_health
+    opponent_health = 0 if opponent_health == KNOCKED_OUT else opponent_health
+
+    fitness = 1000
+    fitness += (damage_dealt + opponent_health + MAX_HEALTH * (rounds_left - 1)) * 1.5
+    fitness -= damage_taken * 2.0
+    fitness += health_bonus + bot_health + MAX_HEALTH * (rounds_needed - 1)
+    fitness += (time_bonus + max(0, timer - TIME_BONUS_OFFSET)
+                + (ROUND_TIMER - TIME_BONUS_OFFSET) * (rounds_needed - 1))
+    fitness += 255 * 0.5
+    if 0 not in fight_history:
+        fitness += 500
+    return fitness
+
+
+def forfeit(fight_history, bot_health):
+    """
+    How a match stopped early ends: every round still to be decided is
+    lost by knockout, so stopping never scores better than playing on.
+    Returns the full fight history and the damage the bot takes on top.
+    """
+    rounds_lost = ROUNDS_TO_WIN - fight_history.count(0)
+    bot_health = 0 if bot_health == KNOCKED_OUT else bot_health
+    return fight_history + [0] * rounds_lost, bot_health + MAX_HEALTH * (rounds_lost - 1)
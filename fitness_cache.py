@@ -0,0 +1,166 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+FAILED_FITNESS = -9999 # What evolution.evaluate_fitness returns when a match could not be played
+KEY_SIZE = 16 # Bytes of the genome hash
+
+
+class CensoredFitness(float):
+    """
+    The fitness of a match that early stop cut short (see early_stop.py).
+    Its undecided rounds were scored as lost, so it is only a lower bound
+    on what the genome would have scored, and is kept out of averages over
+    full matches. reason is the match's results["truncated"].
+    """
+    def __new__(cls, fitness, reason):
+        censored = super().__new__(cls, fitness)
+        censored.reason = reason
+        return censored
+
+
+def genome_key(genome):
+    """Content hash of a genome's float32 weights; bit-identical genomes share a key."""
+    return hashlib.blake2b(np.ascontiguousarray(genome, dtype=np.float32).tobytes(), digest_size=KEY_SIZE).digest()
+
+
+class CacheEntry:
+    __slots__ = ("total", "evaluations", "last_evaluated")
+
+    def __init__(self):
+        self.total = 0.0
+        self.evaluations = 0
+        self.last_evaluated = 0
+
+    @property
+    def fitness(self):
+        return self.total / self.evaluations
+
+
+class FitnessCache:
+    """
+    Remembers the fitness of every genome evaluated so far, keyed by a hash
+    of its weights, so elites and children identical to a parent or sibling
+    do not replay a full match.
+
+    At most max_entries genomes are kept; the least recently used one is
+    dropped first. With reevaluate_every=N, a cached genome that was last
+    played N or more generations ago is played again and its fitness
+    becomes the mean of all its matches, so one lucky match does not stay
+    frozen in place. Matches cut short by early stop (CensoredFitness) are
+    never averaged in.
+    """
+    def __init__(self, max_entries=1000, reevaluate_every=0):
+        self.max_entries = max_entries
+        self.reevaluate_every = reevaluate_every
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_stale(self, entry, generation):
+        """True if the entry is due to be played again in this generation."""
+        return self.reevaluate_every > 0 and generation - entry.last_evaluated >= self.reevaluate_every
+
+    def get(self, key):
+        """The CacheEntry of a genome key, or None, counting the lookup as a hit or miss."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def plan(self, population, generation):
+        """
+        Splits a population into cached and to-be-played individuals.
+        Returns (keys, fitness_scores, to_evaluate): one key per individual,
+        the cached fitness or None, and the indices of the individuals to
+        play. Duplicates inside the population are only played once.
+        """
+        keys = [genome_key(genome) for genome in population]
+        fitness_scores = [None] * len(population)
+        to_evaluate = []
+        scheduled = set()
+        for index, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is not None and not self.is_stale(entry, generation):
+                self.entries.move_to_end(key)
+                fitness_scores[index] = entry.fitness
+                self.hits += 1
+            elif key in scheduled:
+                self.hits += 1
+            else:
+                scheduled.add(key)
+                to_evaluate.append(index)
+                self.misses += 1
+        return keys, fitness_scores, to_evaluate
+
+    def add(self, key, fitness, generation):
+        """Records one match of a genome and returns its (averaged) fitness."""
+        entry = self.entries.get(key)
+        if fitness == FAILED_FITNESS:
+            # A crashed match says nothing about the genome; play it again next time
+            return entry.fitness if entry is not None else fitness
+        if isinstance(fitness, CensoredFitness):
+            # Only a lower bound: it must not drag down the mean of full matches
+            if entry is None:
+                return fitness
+            entry.last_evaluated = generation
+            return entry.fitness
+        if entry is None:
+            entry = self.entries[key] = CacheEntry()
+        entry.total += fitness
+        entry.evaluations += 1
+        entry.last_evaluated = generation
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry.fitness
+
+    def evaluate(self, population, evaluate_fn, generation):
+        """
+        Returns the fitness of every individual in population order, calling
+        evaluate_fn(indices) -> scores only for the individuals that are not
+        cached (or are due for re-evaluation).
+        """
+        keys, fitness_scores, to_evaluate = self.plan(population, generation)
+        played = {}
+        if to_evaluate:
+            for index, fitness in zip(to_evaluate, evaluate_fn(to_evaluate)):
+                fitness_scores[index] = played[keys[index]] = self.add(keys[index], fitness, generation)
+        # Duplicates of a genome played this generation take its score
+        for index, key in enumerate(keys):
+            if fitness_scores[index] is None:
+                fitness_scores[index] = played.get(key, FAILED_FITNESS)
+        return fitness_scores
+
+    def to_arrays(self):
+        """The cache contents as arrays, oldest first, for checkpoints."""
+        entries = list(self.entries.items())
+        return {
+            "keys": np.frombuffer(b"".join(key for key, _ in entries), dtype=np.uint8).reshape(-1, KEY_SIZE),
+            "totals": np.array([entry.total for _, entry in entries], dtype=np.float64),
+            "evaluations": np.array([entry.evaluations for _, entry in entries], dtype=np.int64),
+            "last_evaluated": np.array([entry.last_evaluated for _, entry in entries], dtype=np.int64),
+            "counters": np.array([self.hits, self.misses], dtype=np.int64),
+        }
+
+    def load_arrays(self, arrays):
+        """Restores what to_arrays returned."""
+        self.entries.clear()
+        for key, total, evaluations, last_evaluated in zip(arrays["keys"], arrays["totals"],
+                                                           arrays["evaluations"], arrays["last_evaluated"]):
+            entry = self.entries[key.tobytes()] = CacheEntry()
+            entry.total = float(total)
+            entry.evaluations = int(evaluations)
+            entry.last_evaluated = int(last_evaluated)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.hits, self.misses = (int(value) for value in arrays["counters"])
+
+    def stats(self):
+        return f"{len(self.entries)} genomes cached, {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,301 @@
+import argparse
+import csv
+import os
+import re
+import sys
+import numpy as np
+from fitness import DEFAULT_POLICY, FitnessPolicy, TERMS, KNOCKED_OUT, MAX_HEALTH, ROUNDS_TO_WIN, TIME_BONUS_OFFSET
+from match_trace import MatchTrace, TRACE_EXTENSION, ROUND_LOST, ROUND_WON, MATCH_FORFEITED
+
+# Fitness straight from recorded frames (match_trace.py), for many matches
+# at once: the frames of a batch of traces are concatenated into one table
+# and every per-match column a policy reads (fitness.FitnessPolicy) is a
+# reducer, a handful of array operations over the whole table followed by
+# a per-match np.bincount. Re-scoring a run's history under a new policy
+# then takes no emulator and no Python loop over frames.
+# The reducers mirror controller.MatchSession's tallies exactly, so
+# DEFAULT_POLICY over a trace gives the fitness the match was scored with.
+FIGHTING = 1 # controller.FIGHTING
+CHARACTER_SELECT = -1
+CLOSE_RANGE = 60 # Distance under which the fighters count as in close range
+CHUNK_MATCHES = 256 # Traces loaded into one table at a time
+TRACE_NAME = re.compile(r"gen_(\d+)[\\/]individual_(\d+)" + re.escape(TRACE_EXTENSION) + "$")
+
+
+class MatchTable:
+    """
+    The frames of a list of MatchTraces, concatenated column by column,
+    with match_ids saying which match each frame belongs to. Health is
+    from the bot's side: bot_health and opponent_health, whichever player
+    it controlled. table[name] runs the reducer name (see REDUCERS) once
+    and returns its per-match array.
+    """
+    def __init__(self, traces):
+        for trace in traces:
+            if "round_result" not in trace.columns:
+                raise ValueError(f"{trace.path} was recorded without round results and cannot be re-scored")
+        self.count = len(traces)
+        lengths = np.array([len(trace) for trace in traces], dtype=np.int64)
+        self.match_ids = np.repeat(np.arange(self.count), lengths)
+        self.frames = len(self.match_ids)
+
+        def column(name):
+            if not traces:
+                return np.zeros(0, dtype=np.int32)
+            return np.concatenate([np.asarray(trace[name]) for trace in traces]).astype(np.int32)
+
+        bot_is_p1 = np.repeat(np.array([trace.player == "1" for trace in traces], dtype=bool), lengths)
+        p1_health = column("p1_health")
+        p2_health = column("p2_health")
+        self.bot_health = np.where(bot_is_p1, p1_health, p2_health)
+        self.opponent_health = np.where(bot_is_p1, p2_health, p1_health)
+        self.distance = np.abs(column("p1_x") - column("p2_x"))
+        self.timer = column("timer")
+        self.round_result = column("round_result")
+
+        # The state the controller was in when each frame arrived
+        first_frame = np.zeros(self.frames, dtype=bool)
+        first_frame[(np.cumsum(lengths) - lengths)[lengths > 0]] = True
+        state_before = self._previous(column("controller_state"), first_frame, CHARACTER_SELECT)
+        # Frames the controller tallied damage and distance on: fighting,
+        # and not the frame it saw the round end on
+        self.fighting = (state_before == FIGHTING) & (self.round_result != ROUND_LOST) & (self.round_result != ROUND_WON)
+        # The first of them in a round, where the previous health is taken as full
+        self.round_start = self.fighting & ~self._previous(self.fighting, first_frame, False)
+        self.summaries = {}
+
+    @staticmethod
+    def _previous(values, first_frame, fill):
+        """values shifted one frame later within each match, fill on every match's first frame."""
+        previous = np.empty_like(values)
+        previous[1:] = values[:-1]
+        previous[first_frame] = fill
+        return previous
+
+    def __getitem__(self, name):
+        if name not in self.summaries:
+            if name not in REDUCERS:
+                raise ValueError(f"Unknown fitness term: {name} (see `fitness_engine.py terms`)")
+            self.summaries[name] = REDUCERS[name](self)
+        return self.summaries[name]
+
+    def __len__(self):
+        return self.count
+
+    def per_match_sum(self, values, where=None):
+        """Sums values (one per frame) over each match's frames, or only those where is True."""
+        match_ids = self.match_ids
+        if where is not None:
+            match_ids = match_ids[where]
+            values = values[where]
+        return np.bincount(match_ids, weights=values, minlength=self.count)
+
+    def per_match_count(self, where):
+        """How many of each match's frames where is True on."""
+        return np.bincount(self.match_ids[where], minlength=self.count)
+
+    def per_match_mean(self, values, where=None):
+        """The mean of values over each match's frames (or those where is True), 0 for none."""
+        counts = self.per_match_count(where if where is not None else slice(None))
+        sums = self.per_match_sum(values, where)
+        return np.divide(sums, counts, out=np.zeros(self.count), where=counts > 0)
+
+    def at(self, values, where):
+        """values on the frames where is True, at most one per match, as a per-match array (0 elsewhere)."""
+        result = np.zeros(self.count, dtype=np.float64)
+        result[self.match_ids[where]] = values[where]
+        return result
+
+
+def _health_lost(table, health):
+    """Damage taken by one side on each fighting frame, as MatchSession counts it."""
+    previous = MatchTable._previous(health, table.round_start, MAX_HEALTH)
+    counted = (table.fighting & (health != KNOCKED_OUT) & (previous != KNOCKED_OUT) & (health < previous))
+    return np.where(counted, previous - health, 0)
+
+
+def reduce_forfeited(table):
+    """Whether the match was stopped early (early_stop.py), its open rounds forfeited."""
+    return table.per_match_count(table.round_result == MATCH_FORFEITED) > 0
+
+
+def reduce_rounds_won(table):
+    """Rounds the bot won."""
+    return table.per_match_count(table.round_result == ROUND_WON)
+
+
+def reduce_rounds_lost(table):
+    """Rounds the bot lost, counting the rounds a stopped match forfeits."""
+    lost = table.per_match_count(table.round_result == ROUND_LOST)
+    return np.where(table["forfeited"], ROUNDS_TO_WIN, lost)
+
+
+def reduce_won_match(table):
+    """Whether the bot won the match."""
+    return table["rounds_won"] >= ROUNDS_TO_WIN
+
+
+def reduce_perfect_win(table):
+    """Whether the bot won the match without losing a round."""
+    return (table["rounds_won"] == ROUNDS_TO_WIN) & (table["rounds_lost"] == 0)
+
+
+def reduce_damage_dealt(table):
+    """Health the opponent lost while fighting."""
+    return table.per_match_sum(_health_lost(table, table.opponent_health), table.fighting)
+
+
+def reduce_damage_taken(table):
+    """Health the bot lost while fighting, plus what a stopped match forfeits (fitness.forfeit)."""
+    taken = table.per_match_sum(_health_lost(table, table.bot_health), table.fighting)
+    forfeit_frames = table.round_result == MATCH_FORFEITED
+    health_left = table.at(np.where(table.bot_health == KNOCKED_OUT, 0, table.bot_health), forfeit_frames)
+    lost_before = table.per_match_count(table.round_result == ROUND_LOST)
+    forfeited = np.where(table["forfeited"], health_left + MAX_HEALTH * (ROUNDS_TO_WIN - lost_before - 1), 0)
+    return taken + forfeited
+
+
+def reduce_health_bonus(table):
+    """The bot's health left at the end of every round it won."""
+    return table.per_match_sum(table.bot_health, table.round_result == ROUND_WON)
+
+
+def reduce_time_bonus(table):
+    """The timer above TIME_BONUS_OFFSET at the end of every round the bot won."""
+    return table.per_match_sum(np.maximum(0, table.timer - TIME_BONUS_OFFSET), table.round_result == ROUND_WON)
+
+
+def reduce_average_distance(table):
+    """Mean distance between the fighters while fighting."""
+    return table.per_match_mean(table.distance, table.fighting)
+
+
+def reduce_fighting_frames(table):
+    """Frames the bot spent fighting."""
+    return table.per_match_count(table.fighting)
+
+
+def reduce_health_lead(table):
+    """Mean of the bot's health minus the opponent's while fighting."""
+    valid = table.fighting & (table.bot_health != KNOCKED_OUT) & (table.opponent_health != KNOCKED_OUT)
+    return table.per_match_mean(table.bot_health - table.opponent_health, valid)
+
+
+def reduce_close_range_share(table):
+    """Fraction of the fighting frames spent within CLOSE_RANGE of the opponent."""
+    return table.per_match_mean((table.distance < CLOSE_RANGE).astype(np.float64), table.fighting)
+
+
+# Per-match columns a policy can weight, by name
+REDUCERS = {
+    "won_match": reduce_won_match,
+    "rounds_won": reduce_rounds_won,
+    "rounds_lost": reduce_rounds_lost,
+    "perfect_win": reduce_perfect_win,
+    "forfeited": reduce_forfeited,
+    "damage_dealt": reduce_damage_dealt,
+    "damage_taken": reduce_damage_taken,
+    "health_bonus": reduce_health_bonus,
+    "time_bonus": reduce_time_bonus,
+    "average_distance": reduce_average_distance,
+    "fighting_frames": reduce_fighting_frames,
+    "health_lead": reduce_health_lead,
+    "close_range_share": reduce_close_range_share,
+}
+
+
+def find_traces(traces_dir):
+    """(generation, individual_id, path) of every archived trace under evolution.TRACES_DIR, in order."""
+    found = []
+    for root, _, files in os.walk(traces_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            match = TRACE_NAME.search(path)
+            if match:
+                found.append((int(match.group(1)), int(match.group(2)), path))
+    return sorted(found)
+
+
+def rescore(paths, policies, columns=(), chunk=CHUNK_MATCHES):
+    """
+    Scores the traces at paths under every policy, CHUNK_MATCHES traces at
+    a time. Returns (scores, summaries): one array per policy, and one per
+    requested column.
+    """
+    scores = [[] for _ in policies]
+    summaries = {name: [] for name in columns}
+    for start in range(0, len(paths), chunk):
+        table = MatchTable([MatchTrace(path) for path in paths[start:start + chunk]])
+        for policy_scores, policy in zip(scores, policies):
+            policy_scores.append(policy.score(table))
+        for name in columns:
+            summaries[name].append(np.asarray(table[name], dtype=np.float64))
+    def join(arrays):
+        return np.concatenate(arrays) if arrays else np.zeros(0)
+    return [join(policy_scores) for policy_scores in scores], {name: join(arrays) for name, arrays in summaries.items()}
+
+
+def parse_weights(pairs):
+    """name=weight arguments as a dict."""
+    weights = {}
+    for pair in pairs:
+        name, _, weight = pair.partition("=")
+        if name not in REDUCERS and name not in TERMS:
+            raise ValueError(f"Unknown fitness term: {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Re-score recorded matches under a fitness policy")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rescore_parser = commands.add_parser("rescore", help="Score every archived trace under the default and a new policy")
+    rescore_parser.add_argument("traces_dir", help="evolution.TRACES_DIR, with its gen_<n> directories")
+    rescore_parser.add_argument("--policy", default=None,
+                                help="JSON object of term weights to start from instead of the default policy")
+    rescore_parser.add_argument("--term", action="append", default=[],
+                                help="name=weight: set one term's weight (may be repeated; 0 drops its effect)")
+    rescore_parser.add_argument("--csv", default=None, help="Write every match's columns and scores to this file")
+    commands.add_parser("terms", help="List the terms a policy can weight")
+    args = parser.parse_args()
+
+    if args.command == "terms":
+        for name, function in list(TERMS.items()) + list(REDUCERS.items()):
+            print(f"  {name:18s} {function.__doc__}")
+        print(f"Default policy: {DEFAULT_POLICY}")
+        sys.exit(0)
+
+    policy = FitnessPolicy.from_json(args.policy) if args.policy else DEFAULT_POLICY
+    policy = policy.with_weights(parse_weights(args.term))
+    found = find_traces(args.traces_dir)
+    if not found:
+        parser.error(f"No gen_<n>/individual_<id>{TRACE_EXTENSION} traces under {args.traces_dir}")
+    generations = np.array([generation for generation, _, _ in found])
+    individuals = np.array([individual for _, individual, _ in found])
+    columns = list(REDUCERS) if args.csv else []
+    (default_scores, scores), summaries = rescore([path for _, _, path in found], [DEFAULT_POLICY, policy], columns)
+
+    print(f"{len(found)} matches in {len(set(generations.tolist()))} generations")
+    print(f"Default policy: {DEFAULT_POLICY}")
+    print(f"New policy:     {policy}")
+    print(f"{'gen':>5s} {'matches':>8s} {'best (default)':>22s} {'mean':>10s} {'best (new)':>22s} {'mean':>10s}")
+    changed = 0
+    for generation in np.unique(generations):
+        selected = np.flatnonzero(generations == generation)
+        best_default = selected[np.argmax(default_scores[selected])]
+        best_new = selected[np.argmax(scores[selected])]
+        changed += individuals[best_default] != individuals[best_new]
+        print(f"{generation:5d} {len(selected):8d} "
+              f"{default_scores[best_default]:12.1f} (#{individuals[best_default]:<6d}) "
+              f"{default_scores[selected].mean():10.1f} "
+              f"{scores[best_new]:12.1f} (#{individuals[best_new]:<6d}) {scores[selected].mean():10.1f}")
+    print(f"The new policy picks a different best individual in {changed} generations.")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["generation", "individual"] + columns + ["default_fitness", "fitness"])
+            for i in range(len(found)):
+                writer.writerow([generations[i], individuals[i]] + [summaries[name][i] for name in columns]
+                                + [default_scores[i], scores[i]])
+        print(f"Per-match scores written to {args.csv}")
@@ -1,16 +1,21 @@
 from player import Player
 
 class GameState:
+    # One instance is reused for every frame of a match (see controller.receive)
+    __slots__ = ("player1", "player2", "timer", "fight_result", "has_round_started", "is_round_over")
 
-    def __init__(self, input_dict):
+    def __init__(self, input_dict=None):
 
-        self.dict_to_object(input_dict)
+        self.player1 = Player()
+        self.player2 = Player()
+        if input_dict is not None:
+            self.dict_to_object(input_dict)
 
     def dict_to_object(self, input_dict):
 
-        self.player1 = Player(input_dict['p1'])
-        self.player2 = Player(input_dict['p2'])
+        self.player1.dict_to_object(input_dict['p1'])
+        self.player2.dict_to_object(input_dict['p2'])
         self.timer = input_dict['timer']
         self.fight_result = input_dict['result']
         self.has_round_started = input_dict['round_started']
-        self.is_round_over = input_dict['round_over']
\ No newline at end of file
+        self.is_round_over = input_dict['round_over']
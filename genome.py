@@ -0,0 +1,72 @@
+import numpy as np
+
+# Weight shapes of the network in ann.py, in ANN.get_weights() order.
+ANN_WEIGHT_NAMES = [
+    "gru_kernel", "gru_recurrent_kernel", "gru_bias",
+    "dense_kernel", "dense_bias",
+    "output_kernel", "output_bias",
+]
+ANN_WEIGHT_SHAPES = [
+    (15, 96), (32, 96), (2, 96),
+    (32, 16), (16,),
+    (16, 10), (10,),
+]
+
+
+class GenomeLayout:
+    """
+    Describes how a flat float32 genome vector maps back onto the list of
+    weight arrays a network expects. A whole population can then be stored
+    as one contiguous (population_size, n_params) array and every genetic
+    operator becomes a plain array operation on it.
+    """
+    def __init__(self, names, shapes):
+        self.names = list(names)
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = [int(offset) for offset in np.cumsum([0] + self.sizes[:-1])]
+        self.n_params = sum(self.sizes)
+        self.num_layers = len(self.shapes)
+
+        # For every parameter: which weight array it belongs to and its
+        # position inside that array. Used to vectorize per-layer operators.
+        self.layer_of = np.repeat(np.arange(self.num_layers), self.sizes)
+        self.position = np.arange(self.n_params) - np.repeat(self.offsets, self.sizes)
+
+    def slice(self, layer):
+        """
+        Returns the slice of the genome vector that holds the given weight
+        array (by index or name).
+        """
+        if isinstance(layer, str):
+            layer = self.names.index(layer)
+        return slice(self.offsets[layer], self.offsets[layer] + self.sizes[layer])
+
+    def flatten(self, weights):
+        """
+        Packs a list of weight arrays into a single float32 genome vector.
+        """
+        genome = np.empty(self.n_params, dtype=np.float32)
+        for i, array in enumerate(weights):
+            array = np.asarray(array)
+            if array.shape != self.shapes[i]:
+                raise ValueError(f"Weight shape mismatch for {self.names[i]}: expected {self.shapes[i]}, got {array.shape}")
+            genome[self.slice(i)] = array.ravel()
+        return genome
+
+    def unflatten(self, genome):
+        """
+        Returns the weight arrays of a genome vector as reshaped views (no copy).
+        """
+        if genome.shape[-1] != self.n_params:
+            raise ValueError(f"Genome has {genome.shape[-1]} parameters, layout expects {self.n_params}")
+        return [genome[self.slice(i)].reshape(shape) for i, shape in enumerate(self.shapes)]
+
+    def empty_population(self, population_size):
+        """
+        Allocates an uninitialized (population_size, n_params) genome store.
+        """
+        return np.empty((population_size, self.n_params), dtype=np.float32)
+
+
+ANN_LAYOUT = GenomeLayout(ANN_WEIGHT_NAMES, ANN_WEIGHT_SHAPES)
@@ -0,0 +1,229 @@
+import argparse
+import os
+import struct
+import time
+import numpy as np
+from bot import FRAME_SUMMARIES
+from genome import ANN_LAYOUT
+from numpy_ann import write_weights_file
+
+# File layout: a HEADER_SIZE header (ARCHIVE_MAGIC, version, genome length)
+# followed by fixed-size records, each an index part padded to
+# INDEX_SIZE bytes and the genome's float32 weights. Records are only ever
+# appended, so the record count follows from the file size and a record
+# cut short by a crash is simply ignored.
+ARCHIVE_MAGIC = b"SFGARCH1"
+ARCHIVE_VERSION = 1
+HEADER_SIZE = 64
+HEADER_STRUCT = struct.Struct("<8sII")
+INDEX_SIZE = 64
+
+# What a record holds: the best individual of its generation, or any other
+# individual (when the whole population is archived)
+KIND_INDIVIDUAL = 0
+KIND_GENERATION_BEST = 1
+
+INDEX_FIELDS = [
+    ("generation", "<i4"),
+    ("individual", "<i4"),   # index in its generation's population
+    ("parent_a", "<i4"),     # indices in the previous generation, -1 if none
+    ("parent_b", "<i4"),
+    ("kind", "<i4"),
+    ("fitness", "<f8"),
+    ("timestamp", "<f8"),    # seconds since the epoch
+    # How often the genome decided in training (see Bot.set_decision_interval);
+    # records from before these fields read 0, i.e. every frame
+    ("decision_interval", "<i4"),
+    ("frame_summary", "<i4"), # index in bot.FRAME_SUMMARIES
+]
+
+
+def record_dtype(n_params):
+    index = np.dtype(INDEX_FIELDS)
+    return np.dtype(INDEX_FIELDS + [("reserved", f"V{INDEX_SIZE - index.itemsize}"),
+                                    ("genome", "<f4", (n_params,))])
+
+
+class GenomeArchive:
+    """
+    An append-only file of genomes with their generation, fitness, parents
+    and time of archiving. Records are read through a memory map, so
+    opening the archive costs one pass over the index fields and a genome
+    is only paged in when it is used. The best genome overall and the best
+    of each generation are kept in memory for O(1) lookup.
+    """
+    def __init__(self, path, layout=ANN_LAYOUT):
+        self.path = path
+        self.layout = layout
+        self.dtype = record_dtype(layout.n_params)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(HEADER_STRUCT.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, layout.n_params).ljust(HEADER_SIZE, b"\0"))
+        with open(path, "rb") as f:
+            magic, version, n_params = HEADER_STRUCT.unpack(f.read(HEADER_STRUCT.size))
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not a genome archive")
+        if version != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported genome archive version {version}")
+        if n_params != layout.n_params:
+            raise ValueError(f"Archive genomes have {n_params} parameters, layout expects {layout.n_params}")
+
+        self.count = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+        self._records = None
+        self._reindex()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def records(self):
+        """All records as a read-only structured memmap (see record_dtype)."""
+        if self._records is None:
+            if self.count == 0:
+                self._records = np.zeros(0, dtype=self.dtype)
+            else:
+                self._records = np.memmap(self.path, dtype=self.dtype, mode="r", offset=HEADER_SIZE,
+                                          shape=(self.count,))
+        return self._records
+
+    def _reindex(self):
+        # generation -> (fitness, record) of its best genome, plus the same overall
+        self._generation_best = {}
+        self._best = None
+        if self.count:
+            records = self.records
+            self._index(records["generation"].tolist(), records["fitness"].tolist(), 0)
+
+    def _index(self, generations, fitnesses, first_record):
+        for record, (generation, fitness) in enumerate(zip(generations, fitnesses), start=first_record):
+            current = self._generation_best.get(generation)
+            if current is None or fitness > current[0]:
+                self._generation_best[generation] = (fitness, record)
+            if self._best is None or fitness > self._best[0]:
+                self._best = (fitness, record)
+
+    def append(self, genome, generation, individual, fitness, parents=(-1, -1), kind=KIND_GENERATION_BEST,
+               decision_interval=1, frame_summary="last"):
+        """Appends one genome, with the decision settings it was played with, and returns its record number."""
+        record = np.zeros(1, dtype=self.dtype)
+        record["generation"] = generation
+        record["individual"] = individual
+        record["parent_a"], record["parent_b"] = parents
+        record["kind"] = kind
+        record["fitness"] = fitness
+        record["timestamp"] = time.time()
+        record["decision_interval"] = decision_interval
+        record["frame_summary"] = FRAME_SUMMARIES.index(frame_summary)
+        record["genome"] = genome
+        with open(self.path, "r+b") as f:
+            f.seek(HEADER_SIZE + self.count * self.dtype.itemsize)
+            f.write(record.tobytes())
+        self.count += 1
+        self._records = None
+        self._index([generation], [fitness], self.count - 1)
+        return self.count - 1
+
+    def rollback(self, generation):
+        """
+        Drops the records of generations after the given one, e.g. those
+        archived after the checkpoint a run is resumed from.
+        """
+        keep = int(np.searchsorted(self.records["generation"], generation, side="right")) if self.count else 0
+        if keep == self.count:
+            return
+        self._records = None
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + keep * self.dtype.itemsize)
+        self.count = keep
+        self._reindex()
+
+    def genome(self, record):
+        """A record's genome as a read-only view into the archive (no copy)."""
+        return self.records[record]["genome"]
+
+    def weights(self, record):
+        """A record's genome as the weight arrays a network expects, still without a copy."""
+        return self.layout.unflatten(self.genome(record))
+
+    def fitness(self, record):
+        return float(self.records[record]["fitness"])
+
+    def generations(self):
+        """The generations that have genomes in the archive, in order."""
+        return sorted(self._generation_best)
+
+    def best(self):
+        """Record number of the fittest genome archived so far, or None."""
+        return self._best[1] if self._best is not None else None
+
+    def best_of_generation(self, generation):
+        """Record number of the fittest genome archived for a generation, or None."""
+        best = self._generation_best.get(generation)
+        return best[1] if best is not None else None
+
+    def top(self, k):
+        """Record numbers of the k fittest genomes, best first."""
+        fitness = np.asarray(self.records["fitness"])
+        k = min(k, self.count)
+        if k == 0:
+            return []
+        top = np.argpartition(-fitness, k - 1)[:k]
+        return top[np.argsort(-fitness[top], kind="stable")].tolist()
+
+    def decision_settings(self, record):
+        """The (decision_interval, frame_summary) a record's genome was trained with."""
+        row = self.records[record]
+        return max(1, int(row["decision_interval"])), FRAME_SUMMARIES[int(row["frame_summary"])]
+
+    def info(self, record):
+        """A record's index fields as a dict."""
+        row = self.records[record]
+        return {name: row[name].item() for name, _ in INDEX_FIELDS}
+
+    def export(self, record, file_path):
+        """
+        Writes a record's genome as a Keras-compatible .weights.h5 file that
+        also records its decision settings, so controller.py plays it with them.
+        """
+        write_weights_file(file_path, self.weights(record), *self.decision_settings(record))
+
+
+def print_records(archive, records):
+    for record in records:
+        info = archive.info(record)
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info["timestamp"]))
+        decision_interval, frame_summary = archive.decision_settings(record)
+        print(f"  #{record:<6d} gen {info['generation']:4d} individual {info['individual']:4d} "
+              f"fitness {info['fitness']:10.2f} parents ({info['parent_a']}, {info['parent_b']}) {stamp} "
+              f"decides every {decision_interval} ({frame_summary})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect and export genomes from a genome archive")
+    parser.add_argument("archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    top = commands.add_parser("top", help="List the fittest genomes")
+    top.add_argument("-k", type=int, default=10)
+    export = commands.add_parser("export", help="Write a genome as a .weights.h5 file")
+    export.add_argument("output")
+    which = export.add_mutually_exclusive_group()
+    which.add_argument("--record", type=int, default=None, help="Record number (default: the best genome)")
+    which.add_argument("--generation", type=int, default=None, help="The best genome of this generation")
+    args = parser.parse_args()
+
+    archive = GenomeArchive(args.archive)
+    if args.command == "top":
+        print(f"{args.archive}: {len(archive)} genomes, {len(archive.generations())} generations")
+        print_records(archive, archive.top(args.k))
+    else:
+        if args.record is not None:
+            record = args.record
+        elif args.generation is not None:
+            record = archive.best_of_generation(args.generation)
+        else:
+            record = archive.best()
+        if record is None:
+            parser.error("No such genome in the archive")
+        archive.export(record, args.output)
+        print_records(archive, [record])
+        print(f"Written to {args.output}")
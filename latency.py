@@ -0,0 +1,135 @@
+# Per-frame latency bookkeeping for the controller loop. Every frame is
+# split into the stages below and each (match state, stage) pair keeps a
+# streaming histogram, so a whole match costs a fixed amount of memory.
+
+# recv_wait: blocked until the game's state arrived
+# decode:    parsing it into the GameState
+# features:  building the ANN input vector (frames the bot decides on)
+# inference: the ANN forward pass and thresholding (same frames)
+# encode:    turning the command into wire bytes
+# send:      handing them to the socket
+# frame:     everything the controller did, from arrival to sent
+STAGES = ["recv_wait", "decode", "features", "inference", "encode", "send", "frame"]
+
+DEFAULT_FRAME_BUDGET_MS = 1000 / 60 # one emulator frame at 60 fps
+
+# Buckets: values below 8 ns are exact; above that every power of two is
+# split into 8 sub-buckets, so any reported value is within 12.5%.
+SUB_BUCKETS = 8
+NUM_BUCKETS = SUB_BUCKETS * 64
+
+
+def bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    exponent = value.bit_length() - 4
+    return SUB_BUCKETS * (exponent + 1) + (value >> exponent) - SUB_BUCKETS
+
+def bucket_upper_bound(index):
+    if index < SUB_BUCKETS:
+        return index
+    exponent = index // SUB_BUCKETS - 1
+    mantissa = index % SUB_BUCKETS + SUB_BUCKETS
+    return ((mantissa + 1) << exponent) - 1
+
+
+class LatencyHistogram:
+    """A streaming histogram of nanosecond durations with log-spaced buckets."""
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = max(0, value)
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples (never above max)."""
+        if self.count == 0:
+            return 0
+        rank = max(1, round(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_upper_bound(index), self.max)
+        return self.max
+
+    def summary(self):
+        """p50/p95/p99/max/mean in microseconds."""
+        to_us = lambda ns: round(ns / 1000, 1)
+        return {
+            "count": self.count,
+            "p50_us": to_us(self.percentile(0.50)),
+            "p95_us": to_us(self.percentile(0.95)),
+            "p99_us": to_us(self.percentile(0.99)),
+            "max_us": to_us(self.max),
+            "mean_us": to_us(self.total / self.count) if self.count else 0.0,
+        }
+
+
+class FrameLatency:
+    """
+    Collects the stage timings of every frame of a match, per match state,
+    and counts frames whose controller time went over budget_ms.
+    """
+    def __init__(self, budget_ms=DEFAULT_FRAME_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.budget_ns = int(budget_ms * 1e6)
+        self.histograms = {}
+        self.frames = 0
+        self.over_budget = 0
+
+    def _stages(self, state):
+        stages = self.histograms.get(state)
+        if stages is None:
+            stages = self.histograms[state] = [LatencyHistogram() for _ in STAGES]
+        return stages
+
+    def record_frame(self, state, recv_wait, decode, features, inference, encode, send, frame):
+        """Records one frame's stage durations in ns; features and inference are None if the bot did not decide."""
+        stages = self._stages(state)
+        stages[0].record(recv_wait)
+        stages[1].record(decode)
+        if features is not None:
+            stages[2].record(features)
+            stages[3].record(inference)
+        stages[4].record(encode)
+        stages[5].record(send)
+        stages[6].record(frame)
+        self.frames += 1
+        if frame > self.budget_ns:
+            self.over_budget += 1
+
+    def summary(self):
+        """JSON-ready summary, added to the match results as results['latency']."""
+        return {
+            "budget_ms": round(self.budget_ms, 3),
+            "frames": self.frames,
+            "over_budget": self.over_budget,
+            "states": {
+                state: {stage: histogram.summary() for stage, histogram in zip(STAGES, stages) if histogram.count}
+                for state, stages in self.histograms.items()
+            },
+        }
+
+
+def format_summary(summary, state="FIGHTING"):
+    """One log line for a results['latency'] summary."""
+    stages = summary["states"].get(state)
+    if not stages:
+        return f"no {state} frames"
+    frame = stages["frame"]
+    parts = [f"{state} frame p50 {frame['p50_us']}us p99 {frame['p99_us']}us max {frame['max_us']}us"]
+    if "inference" in stages:
+        parts.append(f"inference p99 {stages['inference']['p99_us']}us")
+    parts.append(f"{summary['over_budget']}/{summary['frames']} frames over {summary['budget_ms']}ms")
+    return ", ".join(parts)
@@ -0,0 +1,230 @@
+import json
+import socket
+import threading
+import time
+
+# Lifecycle of one evaluation, in the order the controller reports it
+LISTENING = "listening"                 # game port is bound, emulator may connect
+WEIGHTS_LOADED = "weights_loaded"       # genome is in the bot, game may be unpaused
+MATCH_STARTED = "match_started"         # first round began after character select
+MATCH_FINISHED = "match_finished"       # state machine reached MATCH_OVER
+RESULTS_AVAILABLE = "results_available" # results dict written / sent back
+
+EVENTS = [LISTENING, WEIGHTS_LOADED, MATCH_STARTED, MATCH_FINISHED, RESULTS_AVAILABLE]
+
+# Sent by the controller every few dozen frames while the game is running;
+# its absence is how a stalled match is noticed (see LifecycleState.wait_for)
+PROGRESS = "progress"
+
+
+class StallError(TimeoutError):
+    """The match stopped making progress."""
+
+
+class LifecycleState:
+    """
+    Thread-safe record of which lifecycle events have happened so far.
+    wait_for() blocks on a condition variable until the event arrives, so
+    nobody has to sleep a fixed amount or poll a file.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.events = {}
+        self.closed = False
+        self.last_progress = None
+
+    def set(self, event, data=None):
+        with self.condition:
+            self.events[event] = data or {}
+            if event == PROGRESS:
+                self.last_progress = time.monotonic()
+            self.condition.notify_all()
+
+    def close(self):
+        """Wakes every waiter; events that have not happened will never happen."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.events = {}
+            self.closed = False
+            self.last_progress = None
+
+    def has(self, event):
+        with self.condition:
+            return event in self.events
+
+    def wait_for(self, event, timeout, stall_timeout=None):
+        """
+        Blocks until event has been reported and returns its data.
+        Raises TimeoutError after timeout seconds, or ConnectionError if the
+        publisher went away first. With stall_timeout, raises StallError as
+        soon as the game has been running (PROGRESS was reported) but no
+        PROGRESS arrived for stall_timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while event not in self.events:
+                if self.closed:
+                    raise ConnectionError(f"Publisher disconnected before '{event}'")
+                now = time.monotonic()
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise TimeoutError(f"Timed out after {timeout}s waiting for '{event}'")
+                if stall_timeout is not None and self.last_progress is not None:
+                    stalled_for = now - self.last_progress
+                    if stalled_for >= stall_timeout:
+                        raise StallError(f"No match progress for {stalled_for:.1f}s while waiting for '{event}'")
+                    remaining = min(remaining, stall_timeout - stalled_for)
+                self.condition.wait(remaining)
+            return self.events[event]
+
+
+class LifecycleHub:
+    """
+    A small local TCP server the evaluator owns for one worker slot.
+    Publishers (the controller) connect and send one JSON object per line,
+    {"event": name, ...}. Subscribers (auto_gui.py) connect and send
+    {"subscribe": true}; they get every event seen so far and every later
+    one as it arrives. The hub's own state can be waited on directly.
+    """
+    def __init__(self):
+        self.state = LifecycleState()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+        self.lock = threading.Lock()
+        self.history = []
+        self.subscribers = []
+        # Bumped by reset(); late messages from an earlier evaluation are dropped
+        self.session = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self.thread.start()
+
+    def reset(self):
+        """Forgets all events, ready for the next evaluation on this slot."""
+        with self.lock:
+            self.history = []
+            self.session += 1
+        self.state.clear()
+        if not self.running:
+            self.state.close() # A closed hub stays closed: every wait fails at once
+
+    def wait_for(self, event, timeout, stall_timeout=None):
+        return self.state.wait_for(event, timeout, stall_timeout)
+
+    def publish(self, event, **data):
+        """Records an event and forwards it to every subscriber."""
+        message = dict(data, event=event)
+        line = (json.dumps(message) + "\n").encode()
+        with self.lock:
+            # Progress is only news while it is fresh; late subscribers need not replay it
+            if event != PROGRESS:
+                self.history.append(line)
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.sendall(line)
+                except OSError:
+                    self.subscribers.remove(subscriber)
+        self.state.set(event, data)
+
+    def close(self):
+        self.running = False
+        self.state.close()
+        try:
+            self.server.close()
+        except OSError:
+            pass
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+            self.subscribers = []
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                (connection, _) = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(connection, self.session), daemon=True).start()
+
+    def _handle(self, connection, session):
+        stream = connection.makefile("r")
+        try:
+            for line in stream:
+                message = json.loads(line)
+                if message.get("subscribe"):
+                    with self.lock:
+                        for past_line in self.history:
+                            connection.sendall(past_line)
+                        self.subscribers.append(connection)
+                    return
+                if session == self.session:
+                    event = message.pop("event")
+                    self.publish(event, **message)
+        except (OSError, ValueError):
+            pass
+        connection.close()
+        # A publisher that hangs up ends its evaluation: whatever has not
+        # been reported yet never will be, so wake the waiters now.
+        if session == self.session:
+            self.state.close()
+
+
+class LifecyclePublisher:
+    """
+    The controller's side of the handshake. Without a port every call is a
+    no-op, so the controller still runs stand-alone.
+    """
+    def __init__(self, port=None):
+        self.connection = None
+        if port is not None:
+            self.connection = socket.create_connection(("127.0.0.1", port), timeout=10)
+            self.connection.settimeout(None)
+
+    def publish(self, event, **data):
+        if self.connection is None:
+            return
+        try:
+            self.connection.sendall((json.dumps(dict(data, event=event)) + "\n").encode())
+        except OSError as e:
+            print(f"Could not publish lifecycle event '{event}': {e}")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class LifecycleSubscriber:
+    """
+    Follows the events of a LifecycleHub from another process (auto_gui.py)
+    and lets the caller block on any of them.
+    """
+    def __init__(self, port):
+        self.state = LifecycleState()
+        self.connection = socket.create_connection(("127.0.0.1", port), timeout=10)
+        self.connection.settimeout(None)
+        self.connection.sendall(b'{"subscribe": true}\n')
+        self.thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.thread.start()
+
+    def wait_for(self, event, timeout):
+        return self.state.wait_for(event, timeout)
+
+    def close(self):
+        self.connection.close()
+
+    def _read_loop(self):
+        try:
+            for line in self.connection.makefile("r"):
+                message = json.loads(line)
+                event = message.pop("event")
+                self.state.set(event, message)
+        except OSError:
+            pass
+        self.state.close()
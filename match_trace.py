@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import struct
+import numpy as np
+import protocol
+from game_state import GameState
+from stand_in_game import connect_to_controller
+
+# File layout: TRACE_MAGIC, a little-endian uint32 header length, the JSON
+# header, then one contiguous array per column, each starting on a
+# COLUMN_ALIGNMENT boundary so it can be memory-mapped in place.
+TRACE_MAGIC = b"SFTRACE1"
+TRACE_VERSION = 1
+COLUMN_ALIGNMENT = 64
+TRACE_EXTENSION = ".sftrace"
+
+NUM_FEATURES = 15
+
+# The controller's state machine states (see controller.play_match)
+CONTROLLER_STATES = {-1: "CHARACTER_SELECT", 0: "IDLE", 1: "FIGHTING", 2: "MATCH_OVER"}
+
+# What the controller concluded on a frame (see controller.MatchSession):
+# a round lost or won, or the match stopped early with the rounds left forfeited
+NO_ROUND_RESULT = -1
+ROUND_LOST = 0
+ROUND_WON = 1
+MATCH_FORFEITED = 2
+
+# One column per STATE_STRUCT field, then what the controller did with the frame:
+# its state after the frame, the bot's action mask (-1 if the bot did not
+# decide this frame), the button masks it sent for each player and the
+# round result it concluded on the frame (NO_ROUND_RESULT on most frames).
+# Traces recorded before round_result existed simply lack that column.
+STATE_COLUMNS = [f"p{number}_{field}" for number in (1, 2)
+                 for field in ("character", "health", "x", "y", "flags", "move", "buttons")] \
+    + ["timer", "result", "round_flags"]
+CONTROLLER_COLUMNS = ["controller_state", "action", "command_p1", "command_p2", "round_result"]
+ROW_COLUMNS = STATE_COLUMNS + CONTROLLER_COLUMNS
+ROW_STRUCT = struct.Struct(protocol.STATE_STRUCT.format + "bhHHb")
+
+_NUMPY_CODES = {"b": "i1", "B": "u1", "h": "<i2", "H": "<u2", "i": "<i4", "I": "<u4"}
+ROW_DTYPE = np.dtype([(name, _NUMPY_CODES[code])
+                      for name, code in zip(ROW_COLUMNS, ROW_STRUCT.format.lstrip("<").replace(" ", ""))])
+
+
+class TraceRecorder:
+    """
+    Records every frame of one match. Each frame is packed as one fixed-size
+    row into a preallocated buffer (a single struct.pack_into), and the
+    features the bot saw are copied into a preallocated float32 array, so a
+    frame costs a few microseconds. The controller records after it has
+    sent its command, while the game is busy with the next frame, so this
+    stays off the decision latency path. close() transposes the rows into
+    columns and writes the trace file.
+    """
+    def __init__(self, path, player, meta=None, capacity=16384):
+        self.path = path
+        self.player = player
+        self.meta = dict(meta or {})
+        self.frames = 0
+        self.rows = bytearray(ROW_STRUCT.size * capacity)
+        self.features = np.zeros((capacity, NUM_FEATURES), dtype=np.float32)
+
+    def _grow(self):
+        self.rows.extend(bytes(len(self.rows)))
+        features = np.zeros((2 * len(self.features), NUM_FEATURES), dtype=np.float32)
+        features[:self.frames] = self.features[:self.frames]
+        self.features = features
+
+    def record(self, game_state, controller_state, action=-1, command_masks=(0, 0), features=None,
+               round_result=NO_ROUND_RESULT):
+        """
+        Appends one frame. action is the bot's action mask, or -1 on frames
+        where it did not decide; features is the input vector it decided on;
+        round_result is what the controller concluded on the frame.
+        """
+        if self.frames == len(self.features):
+            self._grow()
+        ROW_STRUCT.pack_into(self.rows, self.frames * ROW_STRUCT.size, *protocol.state_values(game_state),
+                             controller_state, action, *command_masks, round_result)
+        if features is not None:
+            self.features[self.frames] = features
+        self.frames += 1
+
+    def close(self):
+        """Writes the trace file (atomically) and returns its path."""
+        records = np.frombuffer(self.rows, dtype=ROW_DTYPE, count=self.frames)
+        columns = [(name, np.ascontiguousarray(records[name])) for name in ROW_COLUMNS]
+        columns.append(("features", self.features[:self.frames]))
+        write_trace(self.path, columns, dict(self.meta, player=self.player))
+        return self.path
+
+
+def write_trace(path, columns, meta):
+    """Writes (name, array) columns as a memory-mappable trace file."""
+    frames = len(columns[0][1]) if columns else 0
+    header = {"version": TRACE_VERSION, "frames": frames, "meta": meta, "columns": []}
+    # Offsets depend on the header length, which depends on the offsets;
+    # repeat until the header fits before the data, which it soon does
+    # because offsets only ever grow.
+    data_start = 0
+    while True:
+        offset = data_start
+        header["columns"] = []
+        for name, array in columns:
+            header["columns"].append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape),
+                                      "offset": offset})
+            offset = _align(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode()
+        header_end = _align(len(TRACE_MAGIC) + 4 + len(header_bytes))
+        if header_end <= data_start:
+            break
+        data_start = header_end
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(TRACE_MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for (name, array), column in zip(columns, header["columns"]):
+            f.seek(column["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temp_path, path)
+
+def _align(offset):
+    return (offset + COLUMN_ALIGNMENT - 1) // COLUMN_ALIGNMENT * COLUMN_ALIGNMENT
+
+
+class MatchTrace:
+    """
+    A recorded match, opened read-only. Every column is a numpy memmap,
+    e.g. trace["p1_health"] or trace["features"] (frames x 15), so large
+    traces are only paged in as they are read.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+                raise ValueError(f"{path} is not a match trace")
+            (header_length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+        if header["version"] != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version {header['version']}")
+        self.meta = header["meta"]
+        self.player = self.meta.get("player", "1")
+        self.frames = header["frames"]
+        self.columns = {}
+        for column in header["columns"]:
+            shape = tuple(column["shape"])
+            if self.frames == 0:
+                self.columns[column["name"]] = np.zeros(shape, dtype=column["dtype"])
+            else:
+                self.columns[column["name"]] = np.memmap(path, dtype=column["dtype"], mode="r",
+                                                         offset=column["offset"], shape=shape)
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def state_rows(self):
+        """Every frame's STATE_STRUCT field values as a list of tuples (see protocol.state_values)."""
+        return list(zip(*(self.columns[name].tolist() for name in STATE_COLUMNS)))
+
+    def state_dict(self, frame):
+        """A frame's game state in the emulator's JSON shape."""
+        values = [int(self.columns[name][frame]) for name in STATE_COLUMNS]
+        return protocol.decode_state(protocol.STATE_STRUCT.pack(*values))
+
+    def decision_frames(self):
+        return np.flatnonzero(self.columns["action"] >= 0)
+
+    def transitions(self):
+        """(frame, from_state, to_state) for every change of the controller's state."""
+        states = self.columns["controller_state"]
+        changes = np.flatnonzero(states[1:] != states[:-1]) + 1
+        return [(int(frame), CONTROLLER_STATES[int(states[frame - 1])], CONTROLLER_STATES[int(states[frame])])
+                for frame in changes]
+
+
+class TraceConnection:
+    """
+    Stands in for the game connection in controller.play_match: serves the
+    recorded states in order and keeps what the controller sent back, so a
+    match can be replayed through the controller loop at full speed.
+    """
+    format = None
+    # No socket: receiving and sending take no time worth accounting
+    received_at = 0
+    encoded_at = 0
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.rows = trace.state_rows()
+        self.frame = 0
+        self.actions = np.full(len(trace), -1, dtype=np.int16)
+        self.command_masks = np.zeros((len(trace), 2), dtype=np.uint16)
+
+    def receive_state_into(self, game_state):
+        if self.frame >= len(self.rows):
+            raise ConnectionError("End of trace")
+        protocol.decode_values_into(self.rows[self.frame], game_state)
+        self.frame += 1
+
+    def receive_state(self):
+        game_state = GameState()
+        self.receive_state_into(game_state)
+        return game_state
+
+    def send_command(self, command):
+        self.command_masks[self.frame - 1] = (protocol.buttons_to_mask(command.player_buttons),
+                                              protocol.buttons_to_mask(command.player2_buttons))
+
+    def send_action(self, player, action_mask):
+        self.actions[self.frame - 1] = action_mask
+        self.command_masks[self.frame - 1] = protocol.action_wire_masks(player)[action_mask]
+
+    def action_mismatches(self):
+        """Frames where the bot decided differently than in the recording."""
+        recorded = self.trace["action"][:self.frame]
+        return np.flatnonzero((recorded >= 0) & (recorded != self.actions[:self.frame]))
+
+
+def serve_trace(trace, port, wire_format=protocol.FORMAT_LEGACY):
+    """
+    Plays a trace to the controller listening on port, taking the game's
+    side like stand_in_game.py, as fast as the controller answers. Returns
+    the frames on which the controller sent other buttons than recorded.
+    """
+    client_socket = connect_to_controller(port)
+    connection = protocol.open_connection(client_socket, wire_format)
+    recorded = np.stack([trace["command_p1"], trace["command_p2"]], axis=1)
+    decided = trace["action"] >= 0
+    mismatches = []
+    try:
+        for frame in range(len(trace)):
+            connection.send_state(trace.state_dict(frame))
+            command = connection.receive_command()
+            sent = (protocol.dict_to_mask(command["p1"]), protocol.dict_to_mask(command["p2"]))
+            # Character select moves the cursor randomly; only bot decisions must match
+            if decided[frame] and tuple(recorded[frame]) != sent:
+                mismatches.append(frame)
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+    return mismatches
+
+
+def replay_through_controller(trace, weights_file, backend="numpy"):
+    """
+    Runs the recorded states through controller.play_match in-process with
+    the given weights, deciding as often as the recorded match did. Returns
+    the results dict and the decision frames that came out differently
+    from the recording.
+    """
+    from bot import Bot
+    from controller import play_match
+    bot = Bot(backend=backend, decision_interval=trace.meta.get("decision_interval", 1),
+              frame_summary=trace.meta.get("frame_summary", "last"))
+    bot.ann.load_weights(weights_file)
+    connection = TraceConnection(trace)
+    try:
+        results = play_match(connection, bot, trace.player)
+    except ConnectionError:
+        results = None # the trace ended before the match did
+    return results, connection.action_mismatches()
+
+
+def print_summary(trace):
+    decisions = trace.decision_frames()
+    print(f"{trace.path}: {len(trace)} frames, {len(decisions)} bot decisions, player {trace.player}")
+    for key, value in trace.meta.items():
+        print(f"  {key}: {value}")
+    for frame, old_state, new_state in trace.transitions():
+        print(f"  frame {frame:6d}: {old_state} -> {new_state}")
+    if len(trace):
+        print(f"  final health: P1 {trace['p1_health'][-1]}, P2 {trace['p2_health'][-1]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect and replay recorded match traces")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="Print the frame count, state transitions and metadata")
+    info.add_argument("trace")
+    serve = commands.add_parser("serve", help="Play the trace to a running controller, like the emulator")
+    serve.add_argument("trace")
+    serve.add_argument("--port", type=int, default=9999)
+    serve.add_argument("--protocol", choices=["legacy", "json", "binary"], default="legacy")
+    rerun = commands.add_parser("rerun", help="Run the trace through the controller loop in-process")
+    rerun.add_argument("trace")
+    rerun.add_argument("weights", help="A .weights.h5 file for the bot")
+    rerun.add_argument("--backend", choices=["numpy", "keras"], default="numpy")
+    args = parser.parse_args()
+
+    trace = MatchTrace(args.trace)
+    if args.command == "info":
+        print_summary(trace)
+    elif args.command == "serve":
+        wire_format = {"legacy": protocol.FORMAT_LEGACY, "json": protocol.FORMAT_JSON, "binary": protocol.FORMAT_BINARY}[args.protocol]
+        mismatches = serve_trace(trace, args.port, wire_format)
+        print(f"Served {len(trace)} frames; {len(mismatches)} decisions differed from the recording.")
+    else:
+        results, mismatches = replay_through_controller(trace, args.weights, args.backend)
+        print(f"Results: {results}")
+        print(f"{len(mismatches)} of {len(trace.decision_frames())} decisions differed from the recording.")
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+import numpy as np
+import lifecycle
+import protocol
+from bot import Bot, ACTION_BITS, NUM_FEATURES
+from controller import (MatchSession, PROGRESS_EVERY_FRAMES, READY_FILE, WEIGHTS_FILE, job_decision_settings,
+                        open_recorder, write_results)
+from early_stop import make_policies
+from game_state import GameState
+from genome import ANN_LAYOUT
+from latency import FrameLatency, DEFAULT_FRAME_BUDGET_MS
+from lifecycle import LifecyclePublisher
+from match_trace import CONTROLLER_STATES
+from numpy_ann import initial_weights, read_weights_file
+from population_ann import PopulationANN, PRECISIONS
+from quantize import MAX_DISAGREEMENT, QuantizationRefused, check_quantization, synthetic_streams
+
+# One process, one event loop, many matches: every game port is a slot
+# that plays the same "evaluate" jobs as `controller.py --daemon`, and all
+# slots share one PopulationANN, so the frames that arrive together are
+# decided by a single batched forward pass. No TensorFlow is loaded.
+# Control messages are the daemon's, plus a "slot" field naming the port
+# they are about and "abort" to cancel one slot's match.
+# With a precision other than float32 the shared weights are stored
+# quantized; a genome that decides too differently that way (quantize.py)
+# is played by a float32 twin of the network instead.
+
+
+class MemberNetwork:
+    """One member of the shared PopulationANN, as far as Bot.reset is concerned."""
+    __slots__ = ("network", "index")
+
+    def __init__(self, network, index):
+        self.network = network
+        self.index = index
+
+    def reset_hidden_state(self):
+        self.network.reset_hidden_state(self.index)
+
+
+class DecisionBatcher:
+    """
+    Collects the decisions the slots need in one turn of the event loop and
+    makes them all with one PopulationANN.predict call, on the next turn.
+    """
+    def __init__(self, network):
+        self.network = network
+        self.inputs = np.zeros((network.population_size, NUM_FEATURES), dtype=np.float32)
+        self.pending = {}
+        self.scheduled = False
+        self.batches = 0
+        self.decisions = 0
+
+    def decide(self, member, input_vector):
+        """Queues one member's decision on input_vector; returns a Future of its action mask."""
+        self.inputs[member] = input_vector
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[member] = future
+        if not self.scheduled:
+            self.scheduled = True
+            loop.call_soon(self._run)
+        return future
+
+    def _run(self):
+        self.scheduled = False
+        pending, self.pending = self.pending, {}
+        members = list(pending)
+        predictions = self.network.predict(self.inputs, members)
+        masks = np.dot(predictions[members] > 0.5, ACTION_BITS).tolist()
+        self.batches += 1
+        self.decisions += len(members)
+        for member, mask in zip(members, masks):
+            future = pending[member]
+            if not future.done(): # an aborted match stops waiting
+                future.set_result(mask)
+
+
+class Slot:
+    """One game port and the job it is playing."""
+    def __init__(self, index, port, workdir):
+        self.index = index
+        self.port = port
+        self.workdir = workdir
+        self.task = None
+        # Set while a job waits for its game to connect
+        self.waiting = None
+
+
+class MultiController:
+    def __init__(self, player, ports, control_port, workdir, precision="float32", max_disagreement=MAX_DISAGREEMENT):
+        self.player = player
+        self.control_port = control_port
+        self.slots = [Slot(index, port, workdir) for index, port in enumerate(ports)]
+        # Every member starts with some weights; each job swaps its genome in
+        self.batcher = DecisionBatcher(PopulationANN([initial_weights() for _ in ports], precision))
+        # float32 twin for genomes refused quantization, built when first needed
+        self.exact_batcher = None
+        self.max_disagreement = max_disagreement
+        self.guard_streams = synthetic_streams() if precision != "float32" else None
+        self.control = None
+
+    async def serve(self):
+        servers = []
+        for slot in self.slots:
+            servers.append(await asyncio.start_server(
+                lambda reader, writer, slot=slot: self._game_connected(slot, reader, writer), "127.0.0.1", slot.port))
+        reader, self.control = await asyncio.open_connection("127.0.0.1", self.control_port)
+        print(f"Multi-match controller listening: game ports {[slot.port for slot in self.slots]}, "
+              f"control port {self.control_port}")
+        self._send({"type": "listening"})
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message["type"] == "shutdown":
+                break
+            slot = self.slots[message["slot"]] if "slot" in message else None
+            if message["type"] == "evaluate" and slot is not None:
+                if slot.task is not None and not slot.task.done():
+                    self._send({"type": "error", "slot": slot.index, "job_id": message.get("job_id"),
+                                "message": "Slot is still playing a match"})
+                    continue
+                slot.task = asyncio.create_task(self._evaluate(slot, message))
+            elif message["type"] == "abort" and slot is not None:
+                if slot.task is not None:
+                    slot.task.cancel()
+            else:
+                self._send({"type": "error", "slot": message.get("slot"),
+                            "message": f"Unknown job type: {message['type']}"})
+
+        batchers = [batcher for batcher in (self.batcher, self.exact_batcher) if batcher is not None]
+        print(f"Multi-match controller shutting down after {sum(b.decisions for b in batchers)} decisions "
+              f"in {sum(b.batches for b in batchers)} batches.")
+        for slot in self.slots:
+            if slot.task is not None:
+                slot.task.cancel()
+        for server in servers:
+            server.close()
+        self.control.close()
+
+    def _send(self, message):
+        self.control.write((json.dumps(message) + "\n").encode())
+
+    async def _game_connected(self, slot, reader, writer):
+        if slot.waiting is None or slot.waiting.done():
+            writer.close() # No job is waiting for a game on this port
+            return
+        released = asyncio.get_running_loop().create_future()
+        slot.waiting.set_result((reader, writer, released))
+        # The streams stay open until the job is done with them
+        await released
+
+    async def _load_weights(self, slot, job, job_dir):
+        """Swaps the job's genome into the slot's member; returns the DecisionBatcher that plays it."""
+        if "genome" in job:
+            weights = ANN_LAYOUT.unflatten(np.frombuffer(base64.b64decode(job["genome"]), dtype=np.float32))
+        else:
+            weights = read_weights_file(job.get("weights_file") or os.path.join(job_dir, WEIGHTS_FILE))
+        batcher = self.batcher
+        precision = batcher.network.precision
+        if precision != "float32":
+            try:
+                # Off the event loop: the other slots keep playing meanwhile
+                await asyncio.get_running_loop().run_in_executor(
+                    None, check_quantization, weights, precision, self.guard_streams, self.max_disagreement)
+            except QuantizationRefused as e:
+                print(f"Slot {slot.index}: job {job.get('job_id')} plays in float32: {e}")
+                if self.exact_batcher is None:
+                    self.exact_batcher = DecisionBatcher(PopulationANN([initial_weights() for _ in self.slots]))
+                batcher = self.exact_batcher
+        batcher.network.set_member_weights(slot.index, weights)
+        return batcher
+
+    async def _evaluate(self, slot, job):
+        job_dir = job.get("workdir", slot.workdir)
+        ready_file = os.path.join(job_dir, READY_FILE)
+        events = LifecyclePublisher()
+        recorder = None
+        writer = None
+        released = None
+        try:
+            events = LifecyclePublisher(job.get("events_port"))
+            # The game port has been bound since startup
+            events.publish(lifecycle.LISTENING, port=slot.port)
+            batcher = await self._load_weights(slot, job, job_dir)
+            decision_interval, frame_summary = job_decision_settings(job, job_dir)
+            with open(ready_file, "w") as f:
+                f.write("ready")
+            events.publish(lifecycle.WEIGHTS_LOADED)
+
+            slot.waiting = asyncio.get_running_loop().create_future()
+            reader, writer, released = await slot.waiting
+            print(f"Slot {slot.index}: connected to game for job {job.get('job_id')}!")
+            connection = await protocol.accept_stream(reader, writer)
+            recorder = open_recorder(job.get("trace_file"), self.player, job_id=job.get("job_id"),
+                                     weights_file=job.get("weights_file"), decision_interval=decision_interval,
+                                     frame_summary=frame_summary)
+            results = await self._play(slot, batcher, connection, events, recorder, job, decision_interval,
+                                       frame_summary)
+            write_results(results, job_dir)
+            events.publish(lifecycle.RESULTS_AVAILABLE, results=results)
+            reply = {"type": "results", "results": results}
+        except asyncio.CancelledError:
+            reply = {"type": "error", "message": "Match aborted"}
+        except Exception as e:
+            print(f"Slot {slot.index}: job {job.get('job_id')} failed: {e}")
+            reply = {"type": "error", "message": str(e)}
+        finally:
+            slot.waiting = None
+            if writer is not None:
+                writer.close()
+            if released is not None and not released.done():
+                released.set_result(None)
+            if recorder is not None:
+                # Partial traces of failed matches are the ones worth keeping
+                recorder.close()
+            if os.path.exists(ready_file):
+                os.remove(ready_file)
+            events.close()
+        # Reply only once the workspace is clean for the next job
+        self._send(dict(reply, slot=slot.index, job_id=job.get("job_id")))
+
+    async def _play(self, slot, batcher, connection, events, recorder, job, decision_interval, frame_summary):
+        """play_match on an asyncio connection, with the bot's decisions made in batches."""
+        player = self.player
+        bot = Bot("external", MemberNetwork(batcher.network, slot.index), decision_interval, frame_summary)
+        session = MatchSession(bot, player, events,
+                               make_policies(job.get("stop_inactive_frames"), job.get("stop_below")))
+        game_state = GameState()
+        latency = FrameLatency(job.get("frame_budget_ms") or DEFAULT_FRAME_BUDGET_MS)
+        clock = time.perf_counter_ns
+        frames = 0
+
+        while not session.over:
+            frame_start = clock()
+            await connection.receive_state_into(game_state)
+            decoded = clock()
+            received = max(connection.received_at, frame_start)
+            frame_state = CONTROLLER_STATES[session.state]
+
+            bot_command = session.observe(game_state)
+            if bot_command is None:
+                run_network = bot.prepare(game_state, player)
+                prepared = clock()
+                if run_network:
+                    # Waiting for the batch is part of this frame's inference time
+                    action = await batcher.decide(slot.index, bot.input_vector)
+                    bot.use_action(action, player)
+                else:
+                    action = bot.last_action
+                decided = clock()
+
+            send_start = clock()
+            if bot_command is None:
+                connection.send_action(player, action)
+            else:
+                connection.send_command(bot_command)
+            sent = clock()
+            encoded = max(connection.encoded_at, send_start)
+            if bot_command is None:
+                latency.record_frame(frame_state, received - frame_start, decoded - received, prepared - decoded,
+                                     decided - prepared, encoded - send_start, sent - encoded, sent - received)
+            else:
+                latency.record_frame(frame_state, received - frame_start, decoded - received, None, None,
+                                     encoded - send_start, sent - encoded, sent - received)
+
+            frames += 1
+            if frames % PROGRESS_EVERY_FRAMES == 0:
+                events.publish(lifecycle.PROGRESS, frames=frames)
+
+            if recorder is not None:
+                if bot_command is None:
+                    recorder.record(game_state, session.state, action, protocol.action_wire_masks(player)[action],
+                                    bot.input_vector, session.round_result)
+                else:
+                    recorder.record(game_state, session.state, -1,
+                                    (protocol.buttons_to_mask(bot_command.player_buttons),
+                                     protocol.buttons_to_mask(bot_command.player2_buttons)),
+                                    round_result=session.round_result)
+
+        results = session.results()
+        results["latency"] = latency.summary()
+        return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="One controller process playing many matches at once")
+    parser.add_argument("player", choices=["1", "2"], help="Player slot the bots control")
+    parser.add_argument("--ports", required=True, help="Comma-separated game ports, one per slot")
+    parser.add_argument("--control-port", type=int, required=True,
+                        help="Port the controller connects back to for its control channel")
+    parser.add_argument("--workdir", default=".",
+                        help="Directory of the ready and results files of jobs that do not name one")
+    parser.add_argument("--precision", choices=PRECISIONS, default="float32",
+                        help="Storage precision of the shared network's weight matrices (see population_ann.py)")
+    parser.add_argument("--max-disagreement", type=float, default=MAX_DISAGREEMENT,
+                        help="Genomes whose quantized decisions differ more often than this are played in float32")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    ports = [int(port) for port in args.ports.split(",")]
+    asyncio.run(MultiController(args.player, ports, args.control_port, args.workdir, args.precision,
+                                args.max_disagreement).serve())
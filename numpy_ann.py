@@ -0,0 +1,288 @@
+import sys
+import numpy as np
+import h5py
+
+# Keras layer names used by ann.py, in the order ANN.get_weights() returns them.
+GRU_LAYER_NAME = "GRU_layer"
+DENSE_LAYER_NAME = "Dense_layer"
+OUTPUT_LAYER_NAME = "Output_layer"
+
+# Maximum absolute difference allowed between Keras and NumPy outputs.
+CONFORMANCE_TOLERANCE = 1e-5
+
+# Root attributes of a weights file recording how often its genome decides
+# (see Bot.set_decision_interval). Keras ignores them; files without them
+# decide on every frame.
+DECISION_INTERVAL_ATTR = "decision_interval"
+FRAME_SUMMARY_ATTR = "frame_summary"
+
+
+def sigmoid_inplace(buffer):
+    """
+    In-place logistic sigmoid. Written through tanh so that large negative
+    pre-activations cannot overflow float32 the way exp(-x) would.
+    """
+    np.multiply(buffer, 0.5, out=buffer)
+    np.tanh(buffer, out=buffer)
+    buffer += 1.0
+    buffer *= 0.5
+    return buffer
+
+
+def read_weights_file(file_path):
+    """
+    Reads a Keras '.weights.h5' file written by ANN.save_weights and returns
+    the weights as a list of numpy arrays in ANN.get_weights() order.
+    """
+    layers = {}
+    with h5py.File(file_path, "r") as f:
+        def collect(name, obj):
+            # Every Keras variable group carries the layer name as an attribute.
+            if isinstance(obj, h5py.Group) and "name" in obj.attrs and len(obj) > 0:
+                layer_name = obj.attrs["name"]
+                if isinstance(layer_name, bytes):
+                    layer_name = layer_name.decode()
+                layers[layer_name] = [np.asarray(obj[str(i)], dtype=np.float32) for i in range(len(obj))]
+        f.visititems(collect)
+
+    # The GRU variables are stored on its cell, not on the layer itself.
+    gru_weights = layers.get(GRU_LAYER_NAME) or layers.get("gru_cell")
+    if gru_weights is None or DENSE_LAYER_NAME not in layers or OUTPUT_LAYER_NAME not in layers:
+        raise ValueError(f"'{file_path}' does not look like an ANN weights file")
+
+    return gru_weights + layers[DENSE_LAYER_NAME] + layers[OUTPUT_LAYER_NAME]
+
+
+def read_decision_settings(file_path):
+    """The (decision_interval, frame_summary) a weights file was saved with; (1, "last") if none."""
+    with h5py.File(file_path, "r") as f:
+        decision_interval = int(f.attrs.get(DECISION_INTERVAL_ATTR, 1))
+        frame_summary = f.attrs.get(FRAME_SUMMARY_ATTR, "last")
+    if isinstance(frame_summary, bytes):
+        frame_summary = frame_summary.decode()
+    return decision_interval, str(frame_summary)
+
+
+def write_weights_file(file_path, weights, decision_interval=None, frame_summary="last"):
+    """
+    Writes weights (in ANN.get_weights() order) using the same HDF5 layout
+    Keras produces, so that ANN.load_weights can read the file back.
+    A decision_interval is recorded with the weights, so playback decides
+    as often as the genome did in training (see read_decision_settings).
+    """
+    with h5py.File(file_path, "w") as f:
+        if decision_interval is not None:
+            f.attrs[DECISION_INTERVAL_ATTR] = decision_interval
+            f.attrs[FRAME_SUMMARY_ATTR] = frame_summary
+        f.create_group("vars").attrs["name"] = "sequential"
+        f.create_group("layers/gru/vars").attrs["name"] = GRU_LAYER_NAME
+        groups = [
+            ("layers/gru/cell/vars", "gru_cell", weights[0:3]),
+            ("layers/dense/vars", DENSE_LAYER_NAME, weights[3:5]),
+            ("layers/dense_1/vars", OUTPUT_LAYER_NAME, weights[5:7]),
+        ]
+        for path, name, arrays in groups:
+            group = f.create_group(path)
+            group.attrs["name"] = name
+            for i, array in enumerate(arrays):
+                group.create_dataset(str(i), data=np.asarray(array, dtype=np.float32))
+
+
+def initial_weights(rng=np.random):
+    """
+    Returns freshly initialized weights (ANN.get_weights() order) drawn the
+    same way Keras initializes the model: glorot uniform kernels, an
+    orthogonal recurrent kernel and zero biases. rng can be the np.random
+    module (the default, so np.random.seed applies) or a Generator.
+    """
+    def glorot(fan_in, fan_out):
+        limit = np.sqrt(6.0 / (fan_in + fan_out))
+        return rng.uniform(-limit, limit, (fan_in, fan_out)).astype(np.float32)
+
+    # Like Keras' Orthogonal on a (32, 96) kernel: one QR of a 96x32 normal
+    # matrix, transposed, so the 32 rows of the kernel are orthonormal
+    q, r = np.linalg.qr(rng.normal(size=(96, 32)))
+    q *= np.sign(np.diag(r))
+    return [
+        glorot(15, 96),
+        q.T.astype(np.float32),
+        np.zeros((2, 96), dtype=np.float32),
+        glorot(32, 16),
+        np.zeros(16, dtype=np.float32),
+        glorot(16, 10),
+        np.zeros(10, dtype=np.float32),
+    ]
+
+
+class NumpyANN:
+    """
+    A pure NumPy implementation of the stateful GRU network defined in ann.py.
+    It runs the exact same GRU -> Dense(relu) -> Dense(sigmoid) math, but over
+    preallocated float32 buffers, so a single per-frame decision costs a few
+    small matrix-vector products instead of a TensorFlow graph dispatch.
+    The hidden state is kept on the object, mirroring the stateful Keras layer.
+    """
+    def __init__(self, weights=None):
+        """
+        Allocates the weight and scratch buffers. Without weights the network
+        is initialized the same way Keras would (glorot uniform kernels,
+        orthogonal recurrent kernel, zero biases).
+        """
+        self.input_size = 15
+        self.gru_units = 32
+        self.dense_units = 16
+        self.output_size = 10
+
+        units = self.gru_units
+        self.kernel = np.zeros((self.input_size, 3 * units), dtype=np.float32)
+        self.recurrent_kernel = np.zeros((units, 3 * units), dtype=np.float32)
+        self.gru_bias = np.zeros((2, 3 * units), dtype=np.float32)
+        self.dense_kernel = np.zeros((units, self.dense_units), dtype=np.float32)
+        self.dense_bias = np.zeros(self.dense_units, dtype=np.float32)
+        self.output_kernel = np.zeros((self.dense_units, self.output_size), dtype=np.float32)
+        self.output_bias = np.zeros(self.output_size, dtype=np.float32)
+
+        # Scratch buffers reused on every call to predict()
+        self._input = np.zeros(self.input_size, dtype=np.float32)
+        self._input_gates = np.zeros(3 * units, dtype=np.float32)
+        self._hidden_gates = np.zeros(3 * units, dtype=np.float32)
+        self._update_reset = np.zeros(2 * units, dtype=np.float32)
+        self._candidate = np.zeros(units, dtype=np.float32)
+        self._delta = np.zeros(units, dtype=np.float32)
+        self._dense = np.zeros(self.dense_units, dtype=np.float32)
+        self._output = np.zeros(self.output_size, dtype=np.float32)
+        self.hidden_state = np.zeros(units, dtype=np.float32)
+
+        self.set_weights(weights if weights is not None else initial_weights())
+
+    def predict(self, input_vector):
+        """
+        Advances the hidden state by one frame and returns the 10 button
+        probabilities. Accepts a 15-feature vector (or anything reshapeable to
+        one, such as the (1, 1, 15) tensor shape ANN.predict uses).
+
+        The returned array is an internal buffer that is overwritten by the
+        next call; copy it if it needs to be kept.
+        """
+        units = self.gru_units
+        x = self._input
+        x[:] = np.reshape(input_vector, -1)
+        h = self.hidden_state
+
+        # Input and recurrent projections for the update, reset and candidate gates
+        np.dot(x, self.kernel, out=self._input_gates)
+        self._input_gates += self.gru_bias[0]
+        np.dot(h, self.recurrent_kernel, out=self._hidden_gates)
+        self._hidden_gates += self.gru_bias[1]
+
+        # z and r share one buffer: [update | reset]
+        zr = self._update_reset
+        np.add(self._input_gates[:2 * units], self._hidden_gates[:2 * units], out=zr)
+        sigmoid_inplace(zr)
+        z = zr[:units]
+        r = zr[units:]
+
+        # Keras uses reset_after=True: the reset gate scales the recurrent term
+        candidate = self._candidate
+        np.multiply(r, self._hidden_gates[2 * units:], out=candidate)
+        candidate += self._input_gates[2 * units:]
+        np.tanh(candidate, out=candidate)
+
+        # h = z * h + (1 - z) * candidate, rewritten to stay in place
+        np.subtract(h, candidate, out=self._delta)
+        self._delta *= z
+        np.add(candidate, self._delta, out=h)
+
+        np.dot(h, self.dense_kernel, out=self._dense)
+        self._dense += self.dense_bias
+        np.maximum(self._dense, 0.0, out=self._dense)
+
+        np.dot(self._dense, self.output_kernel, out=self._output)
+        self._output += self.output_bias
+        return sigmoid_inplace(self._output)
+
+    def reset_hidden_state(self):
+        """
+        Resets the GRU hidden state to zeros, like ANN.reset_hidden_state.
+        """
+        self.hidden_state.fill(0.0)
+
+    def get_weights(self):
+        """
+        Returns copies of the weights in the same order as ANN.get_weights().
+        """
+        return [
+            self.kernel.copy(), self.recurrent_kernel.copy(), self.gru_bias.copy(),
+            self.dense_kernel.copy(), self.dense_bias.copy(),
+            self.output_kernel.copy(), self.output_bias.copy(),
+        ]
+
+    def set_weights(self, weights):
+        """
+        Copies a list of numpy arrays (ANN.get_weights() order) into the
+        preallocated weight buffers.
+        """
+        targets = [
+            self.kernel, self.recurrent_kernel, self.gru_bias,
+            self.dense_kernel, self.dense_bias,
+            self.output_kernel, self.output_bias,
+        ]
+        if len(weights) != len(targets):
+            raise ValueError(f"Expected {len(targets)} weight arrays, got {len(weights)}")
+        for target, source in zip(targets, weights):
+            source = np.asarray(source)
+            if source.shape != target.shape:
+                raise ValueError(f"Weight shape mismatch: expected {target.shape}, got {source.shape}")
+            target[...] = source
+
+    def save_weights(self, file_path):
+        """
+        Saves the weights in the Keras '.weights.h5' layout.
+        """
+        write_weights_file(file_path, self.get_weights())
+
+    def load_weights(self, file_path):
+        """
+        Loads weights from a '.weights.h5' file written by ANN.save_weights.
+        """
+        self.set_weights(read_weights_file(file_path))
+
+
+def check_conformance(ann, num_frames=600, num_resets=3, tolerance=CONFORMANCE_TOLERANCE, seed=0):
+    """
+    Feeds the same random input stream through a Keras ANN and a NumpyANN
+    built from its weights and compares the outputs frame by frame, including
+    across hidden-state resets. Returns the maximum absolute difference and
+    raises AssertionError if it exceeds the tolerance.
+    """
+    import tensorflow as tf
+
+    rng = np.random.default_rng(seed)
+    numpy_ann = NumpyANN(ann.get_weights())
+    max_error = 0.0
+
+    for _ in range(num_resets):
+        ann.reset_hidden_state()
+        numpy_ann.reset_hidden_state()
+        for _ in range(num_frames // num_resets):
+            input_vector = rng.uniform(-1.0, 1.0, numpy_ann.input_size).astype(np.float32)
+            expected = ann.predict(tf.constant(input_vector.reshape(1, 1, -1))).numpy()
+            actual = numpy_ann.predict(input_vector)
+            max_error = max(max_error, float(np.max(np.abs(expected - actual))))
+
+    if max_error > tolerance:
+        raise AssertionError(f"NumpyANN diverges from Keras ANN: max error {max_error:.3e} > {tolerance:.1e}")
+    return max_error
+
+
+if __name__ == '__main__':
+    # Usage: python numpy_ann.py [weights_file ...]
+    from ann import ANN
+
+    weight_files = sys.argv[1:] or [None]
+    for weight_file in weight_files:
+        ann = ANN()
+        if weight_file is not None:
+            ann.load_weights(weight_file)
+        error = check_conformance(ann)
+        print(f"{weight_file or 'random weights'}: max abs error {error:.3e} (tolerance {CONFORMANCE_TOLERANCE:.1e})")
@@ -1,10 +1,17 @@
 from buttons import Buttons
+from protocol import mask_to_dict, dict_to_mask, buttons_to_mask
 
 class Player:
+    # Decoded every frame, so no per-instance __dict__
+    __slots__ = ("player_id", "health", "x_coord", "y_coord", "is_jumping", "is_crouching",
+                 "is_player_in_move", "move_id", "_buttons_source", "_buttons")
 
-    def __init__(self, player_dict):
-        
-        self.dict_to_object(player_dict)
+    def __init__(self, player_dict=None):
+
+        self._buttons_source = None
+        self._buttons = None
+        if player_dict is not None:
+            self.dict_to_object(player_dict)
     
     def dict_to_object(self, player_dict):
         
@@ -14,6 +21,35 @@ class Player:
         self.y_coord = player_dict['y']
         self.is_jumping = player_dict['jumping']
         self.is_crouching = player_dict['crouching']
-        self.player_buttons = Buttons(player_dict['buttons'])
+        self.set_buttons_source(player_dict['buttons'])
         self.is_player_in_move = player_dict['in_move']
         self.move_id = player_dict['move']
+
+    def set_buttons_source(self, source):
+        """
+        Stores the raw buttons (a JSON dict or a binary button mask) without
+        decoding them; most frames nobody looks at them.
+        """
+        self._buttons_source = source
+        self._buttons = None
+
+    def buttons_mask(self):
+        """The buttons as a 12-bit mask (protocol.BUTTON_KEYS order), without building a Buttons object."""
+        source = self._buttons_source
+        if isinstance(source, int):
+            return source
+        if source is not None:
+            return dict_to_mask(source)
+        return buttons_to_mask(self._buttons) if self._buttons is not None else 0
+
+    @property
+    def player_buttons(self):
+        if self._buttons is None and self._buttons_source is not None:
+            source = self._buttons_source
+            self._buttons = Buttons(source if isinstance(source, dict) else mask_to_dict(source))
+        return self._buttons
+
+    @player_buttons.setter
+    def player_buttons(self, buttons):
+        self._buttons_source = None
+        self._buttons = buttons
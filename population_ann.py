@@ -0,0 +1,239 @@
+import numpy as np
+from numpy_ann import read_weights_file, sigmoid_inplace
+from genome import ANN_LAYOUT
+
+# How the four weight matrices are stored (biases always stay float32).
+# "int8" keeps one float32 scale per output column of each matrix. Products
+# are always accumulated in float32; see quantize.py for the accuracy check.
+PRECISIONS = ("float32", "float16", "int8")
+INT8_LEVELS = 127
+MATRICES = ["kernel", "recurrent_kernel", "dense_kernel", "output_kernel"]
+BIASES = ["input_bias", "recurrent_bias", "dense_bias", "output_bias"]
+
+
+def quantize_matrix(matrix, precision):
+    """
+    Returns (values, scale) for a float32 matrix, or a stack of them, whose
+    last axis is the output axis: values in the storage precision, and for
+    "int8" the symmetric per-output-column scale (None otherwise).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if precision == "float32":
+        return matrix, None
+    if precision == "float16":
+        return matrix.astype(np.float16), None
+    if precision != "int8":
+        raise ValueError(f"Unknown precision: {precision}")
+    scale = np.max(np.abs(matrix), axis=-2, keepdims=True) / INT8_LEVELS
+    scale[scale == 0] = 1.0 # All-zero columns: any scale reproduces them
+    values = np.clip(np.rint(matrix / scale), -INT8_LEVELS, INT8_LEVELS).astype(np.int8)
+    return values, scale.astype(np.float32)
+
+
+def dequantize_matrix(values, scale):
+    """The float32 matrix quantize_matrix's (values, scale) stand for."""
+    matrix = values.astype(np.float32)
+    if scale is not None:
+        matrix *= scale
+    return matrix
+
+
+class PopulationANN:
+    """
+    Runs the network from ann.py for a whole population at once.
+    The weights of all P genomes are stacked into (P, ...) arrays and every
+    call to predict() advances all P hidden states for P different input
+    frames with a handful of batched matrix products, so the per-member cost
+    stays flat as P grows instead of paying Python/framework dispatch per bot.
+
+    With a precision of "float16" or "int8" the weight matrices are stored
+    quantized (see PRECISIONS), which cuts the memory per genome to a half
+    or about a quarter. NumPy has no low-precision matrix product, so each
+    product converts the matrices to float32 on the fly: quantized
+    populations are smaller, not faster.
+    """
+    def __init__(self, population_weights, precision="float32"):
+        """
+        Builds the stacked weights from a list of per-member weight lists
+        (ANN.get_weights() order), stored in the given precision.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        self.population_size = len(population_weights)
+        if self.population_size == 0:
+            raise ValueError("PopulationANN needs at least one member")
+
+        self.input_size = 15
+        self.gru_units = 32
+        self.dense_units = 16
+        self.output_size = 10
+        self.precision = precision
+
+        P = self.population_size
+        units = self.gru_units
+        matrix_dtype = np.dtype(precision)
+        self.kernel = np.zeros((P, self.input_size, 3 * units), dtype=matrix_dtype)
+        self.recurrent_kernel = np.zeros((P, units, 3 * units), dtype=matrix_dtype)
+        self.input_bias = np.zeros((P, 1, 3 * units), dtype=np.float32)
+        self.recurrent_bias = np.zeros((P, 1, 3 * units), dtype=np.float32)
+        self.dense_kernel = np.zeros((P, units, self.dense_units), dtype=matrix_dtype)
+        self.dense_bias = np.zeros((P, 1, self.dense_units), dtype=np.float32)
+        self.output_kernel = np.zeros((P, self.dense_units, self.output_size), dtype=matrix_dtype)
+        self.output_bias = np.zeros((P, 1, self.output_size), dtype=np.float32)
+        # Per-output-column scales of the int8 matrices
+        self.scales = None
+        if precision == "int8":
+            self.scales = {name: np.ones((P, 1, getattr(self, name).shape[-1]), dtype=np.float32)
+                           for name in MATRICES}
+
+        # Scratch buffers, shaped (P, 1, n) so np.matmul can write into them directly
+        self._input = np.zeros((P, 1, self.input_size), dtype=np.float32)
+        self._input_gates = np.zeros((P, 1, 3 * units), dtype=np.float32)
+        self._hidden_gates = np.zeros((P, 1, 3 * units), dtype=np.float32)
+        self._update_reset = np.zeros((P, 1, 2 * units), dtype=np.float32)
+        self._candidate = np.zeros((P, 1, units), dtype=np.float32)
+        self._delta = np.zeros((P, 1, units), dtype=np.float32)
+        self._dense = np.zeros((P, 1, self.dense_units), dtype=np.float32)
+        self._output = np.zeros((P, 1, self.output_size), dtype=np.float32)
+        self.hidden_state = np.zeros((P, 1, units), dtype=np.float32)
+
+        for i, weights in enumerate(population_weights):
+            self.set_member_weights(i, weights)
+
+    @classmethod
+    def from_models(cls, models, precision="float32"):
+        """
+        Stacks the weights of ANN or NumpyANN objects.
+        """
+        return cls([model.get_weights() for model in models], precision)
+
+    @classmethod
+    def from_files(cls, file_paths, precision="float32"):
+        """
+        Stacks the weights stored in '.weights.h5' files.
+        """
+        return cls([read_weights_file(path) for path in file_paths], precision)
+
+    @classmethod
+    def from_genomes(cls, genomes, layout=ANN_LAYOUT, precision="float32"):
+        """
+        Stacks the rows of a (P, n_params) genome store (see genome.py).
+        """
+        return cls([layout.unflatten(genome) for genome in genomes], precision)
+
+    @property
+    def bytes_per_member(self):
+        """Memory the weights of one member take, scales included."""
+        arrays = [getattr(self, name) for name in MATRICES + BIASES]
+        if self.scales is not None:
+            arrays += list(self.scales.values())
+        return sum(array.nbytes for array in arrays) // self.population_size
+
+    def _set_matrix(self, name, index, matrix):
+        values, scale = quantize_matrix(matrix, self.precision)
+        getattr(self, name)[index] = values
+        if scale is not None:
+            self.scales[name][index] = scale
+
+    def _get_matrix(self, name, index):
+        return dequantize_matrix(getattr(self, name)[index],
+                                 self.scales[name][index] if self.scales is not None else None)
+
+    def _project(self, x, name, out):
+        # out = x @ matrix, accumulated in float32 whatever the storage precision
+        np.matmul(x, getattr(self, name), out=out, dtype=np.float32)
+        if self.scales is not None:
+            out *= self.scales[name]
+
+    def set_member_weights(self, index, weights):
+        """
+        Replaces the weights of a single member (ANN.get_weights() order),
+        quantizing its matrices to the population's precision.
+        The member's hidden state is left untouched.
+        """
+        if len(weights) != 7:
+            raise ValueError(f"Expected 7 weight arrays, got {len(weights)}")
+        kernel, recurrent_kernel, gru_bias, dense_kernel, dense_bias, output_kernel, output_bias = weights
+        self._set_matrix("kernel", index, kernel)
+        self._set_matrix("recurrent_kernel", index, recurrent_kernel)
+        self.input_bias[index, 0] = gru_bias[0]
+        self.recurrent_bias[index, 0] = gru_bias[1]
+        self._set_matrix("dense_kernel", index, dense_kernel)
+        self.dense_bias[index, 0] = dense_bias
+        self._set_matrix("output_kernel", index, output_kernel)
+        self.output_bias[index, 0] = output_bias
+
+    def get_member_weights(self, index):
+        """
+        Returns copies of one member's weights in ANN.get_weights() order,
+        as float32 (the values a quantized member actually computes with).
+        """
+        return [
+            self._get_matrix("kernel", index),
+            self._get_matrix("recurrent_kernel", index),
+            np.stack([self.input_bias[index, 0], self.recurrent_bias[index, 0]]),
+            self._get_matrix("dense_kernel", index),
+            self.dense_bias[index, 0].copy(),
+            self._get_matrix("output_kernel", index),
+            self.output_bias[index, 0].copy(),
+        ]
+
+    def predict(self, input_vectors, members=None):
+        """
+        Advances every member by one frame. input_vectors has shape (P, 15),
+        one frame per member, and the result has shape (P, 10).
+        With members (indices), only those members advance: the others'
+        rows of the result are meaningless and their hidden states are kept.
+
+        The returned array is a view of an internal buffer that is overwritten
+        by the next call; copy it if it needs to be kept.
+        """
+        units = self.gru_units
+        if members is not None:
+            idle = np.ones(self.population_size, dtype=bool)
+            idle[members] = False
+            kept_state = self.hidden_state[idle]
+        x = self._input
+        x[:, 0, :] = input_vectors
+        h = self.hidden_state
+
+        self._project(x, "kernel", self._input_gates)
+        self._input_gates += self.input_bias
+        self._project(h, "recurrent_kernel", self._hidden_gates)
+        self._hidden_gates += self.recurrent_bias
+
+        zr = self._update_reset
+        np.add(self._input_gates[..., :2 * units], self._hidden_gates[..., :2 * units], out=zr)
+        sigmoid_inplace(zr)
+        z = zr[..., :units]
+        r = zr[..., units:]
+
+        candidate = self._candidate
+        np.multiply(r, self._hidden_gates[..., 2 * units:], out=candidate)
+        candidate += self._input_gates[..., 2 * units:]
+        np.tanh(candidate, out=candidate)
+
+        np.subtract(h, candidate, out=self._delta)
+        self._delta *= z
+        np.add(candidate, self._delta, out=h)
+        if members is not None:
+            h[idle] = kept_state
+
+        self._project(h, "dense_kernel", self._dense)
+        self._dense += self.dense_bias
+        np.maximum(self._dense, 0.0, out=self._dense)
+
+        self._project(self._dense, "output_kernel", self._output)
+        self._output += self.output_bias
+        return sigmoid_inplace(self._output)[:, 0, :]
+
+    def reset_hidden_state(self, indices=None):
+        """
+        Resets the hidden state of the given members (an index, a list of
+        indices or a boolean mask), or of every member when indices is None.
+        Matches ANN.reset_hidden_state for each selected member.
+        """
+        if indices is None:
+            self.hidden_state.fill(0.0)
+        else:
+            self.hidden_state[indices] = 0.0
@@ -0,0 +1,454 @@
+import asyncio
+import json
+import socket
+import struct
+import time
+from functools import lru_cache
+from command import Command
+
+# --- Negotiation ---
+# A game peer that understands framing opens the connection with HELLO_MAGIC
+# followed by one format byte; the controller answers with the accepted format
+# byte. A peer that starts talking JSON straight away (BizHawk) gets the
+# legacy unframed JSON stream.
+HELLO_MAGIC = b"SFP1"
+FORMAT_JSON = 0     # length-prefixed JSON, same dicts as the legacy stream
+FORMAT_BINARY = 1   # length-prefixed fixed-layout structs (below)
+FORMAT_LEGACY = 255 # no hello, no framing: raw JSON objects back to back
+FORMAT_NAMES = {FORMAT_JSON: "framed JSON", FORMAT_BINARY: "binary", FORMAT_LEGACY: "legacy JSON"}
+
+# Every framed message is a 2-byte little-endian payload length + payload
+FRAME_HEADER = struct.Struct("<H")
+
+# Button order used for masks; bit i is BUTTON_KEYS[i] (same order as Buttons.object_to_dict)
+BUTTON_KEYS = ["Up", "Down", "Right", "Left", "Select", "Start", "Y", "B", "X", "A", "L", "R"]
+BUTTON_ATTRIBUTES = ["up", "down", "right", "left", "select", "start", "Y", "B", "X", "A", "L", "R"]
+
+# Network outputs in order, as Buttons attributes; bit i of an action mask is ACTION_BUTTONS[i]
+ACTION_BUTTONS = ["up", "down", "left", "right", "Y", "B", "A", "X", "L", "R"]
+NUM_ACTIONS = len(ACTION_BUTTONS)
+
+# Fight results the emulator reports, as one byte
+RESULT_NAMES = ["NOT_OVER", "NONE", "P1", "P2", "TIME_OVER", "DRAW", ""]
+RESULT_CODES = {name: code for code, name in enumerate(RESULT_NAMES)}
+
+# Player: character, health, x, y, flags (jumping|crouching|in_move), move id, button mask
+PLAYER_STRUCT = struct.Struct("<Bhhh BIH")
+# Game state: p1, p2, timer, result code, flags (round_started|round_over)
+STATE_STRUCT = struct.Struct("<" + PLAYER_STRUCT.format[1:] * 2 + "hBB")
+# Command: p1 button mask, p2 button mask
+COMMAND_STRUCT = struct.Struct("<HH")
+
+JUMPING, CROUCHING, IN_MOVE = 1, 2, 4
+ROUND_STARTED, ROUND_OVER = 1, 2
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# --- Button masks ---
+
+def buttons_to_mask(buttons):
+    """Packs a Buttons object into a 12-bit mask."""
+    mask = 0
+    for bit, attribute in enumerate(BUTTON_ATTRIBUTES):
+        if getattr(buttons, attribute):
+            mask |= 1 << bit
+    return mask
+
+def dict_to_mask(buttons_dict):
+    """Packs a buttons dict ({"Up": bool, ...}) into a 12-bit mask."""
+    mask = 0
+    for bit, key in enumerate(BUTTON_KEYS):
+        if buttons_dict[key]:
+            mask |= 1 << bit
+    return mask
+
+def mask_to_dict(mask):
+    """Unpacks a 12-bit mask into the buttons dict the JSON protocol uses."""
+    return {key: bool(mask >> bit & 1) for bit, key in enumerate(BUTTON_KEYS)}
+
+
+# --- Binary codec ---
+
+def _player_fields(player):
+    flags = (JUMPING if player["jumping"] else 0) | (CROUCHING if player["crouching"] else 0) \
+        | (IN_MOVE if player["in_move"] else 0)
+    return (player["character"], player["health"], player["x"], player["y"],
+            flags, player["move"], dict_to_mask(player["buttons"]))
+
+def encode_state(state):
+    """Encodes a game-state dict (the JSON protocol's shape) as a fixed-layout struct."""
+    flags = (ROUND_STARTED if state["round_started"] else 0) | (ROUND_OVER if state["round_over"] else 0)
+    return STATE_STRUCT.pack(*_player_fields(state["p1"]), *_player_fields(state["p2"]),
+                             state["timer"], RESULT_CODES.get(state["result"], RESULT_CODES["NONE"]), flags)
+
+def _player_dict(values):
+    character, health, x_coord, y_coord, flags, move, mask = values
+    return {
+        "character": character,
+        "health": health,
+        "x": x_coord,
+        "y": y_coord,
+        "jumping": bool(flags & JUMPING),
+        "crouching": bool(flags & CROUCHING),
+        "buttons": mask_to_dict(mask),
+        "in_move": bool(flags & IN_MOVE),
+        "move": move,
+    }
+
+def decode_state(payload):
+    """Decodes a binary game state back into the JSON protocol's dict shape."""
+    values = STATE_STRUCT.unpack(payload)
+    timer, result, flags = values[14:]
+    return {
+        "p1": _player_dict(values[0:7]),
+        "p2": _player_dict(values[7:14]),
+        "timer": timer,
+        "result": RESULT_NAMES[result],
+        "round_started": bool(flags & ROUND_STARTED),
+        "round_over": bool(flags & ROUND_OVER),
+    }
+
+def _decode_player_into(values, offset, player):
+    flags = values[offset + 4]
+    player.player_id = values[offset]
+    player.health = values[offset + 1]
+    player.x_coord = values[offset + 2]
+    player.y_coord = values[offset + 3]
+    player.is_jumping = bool(flags & JUMPING)
+    player.is_crouching = bool(flags & CROUCHING)
+    player.is_player_in_move = bool(flags & IN_MOVE)
+    player.move_id = values[offset + 5]
+    player.set_buttons_source(values[offset + 6]) # mask, decoded only if read
+
+def decode_state_into(payload, game_state):
+    """
+    Decodes a binary game state straight into an existing GameState,
+    skipping the intermediate dict.
+    """
+    decode_values_into(STATE_STRUCT.unpack_from(payload), game_state)
+
+def decode_values_into(values, game_state):
+    """Sets a GameState from the STATE_STRUCT field values (see state_values)."""
+    _decode_player_into(values, 0, game_state.player1)
+    _decode_player_into(values, 7, game_state.player2)
+    flags = values[16]
+    game_state.timer = values[14]
+    game_state.fight_result = RESULT_NAMES[values[15]]
+    game_state.has_round_started = bool(flags & ROUND_STARTED)
+    game_state.is_round_over = bool(flags & ROUND_OVER)
+
+def _player_values(player):
+    flags = (JUMPING if player.is_jumping else 0) | (CROUCHING if player.is_crouching else 0) \
+        | (IN_MOVE if player.is_player_in_move else 0)
+    return (player.player_id, player.health, player.x_coord, player.y_coord, flags, player.move_id,
+            player.buttons_mask())
+
+def state_values(game_state):
+    """The STATE_STRUCT field values of a decoded GameState; the inverse of decode_values_into."""
+    flags = (ROUND_STARTED if game_state.has_round_started else 0) | (ROUND_OVER if game_state.is_round_over else 0)
+    return (*_player_values(game_state.player1), *_player_values(game_state.player2),
+            game_state.timer, RESULT_CODES.get(game_state.fight_result, RESULT_CODES["NONE"]), flags)
+
+def encode_command(command):
+    """Encodes a Command as the two players' button masks."""
+    return COMMAND_STRUCT.pack(buttons_to_mask(command.player_buttons), buttons_to_mask(command.player2_buttons))
+
+def decode_command(payload):
+    """Decodes a binary command into the JSON protocol's dict shape."""
+    p1_mask, p2_mask = COMMAND_STRUCT.unpack(payload)
+    return {"p1": mask_to_dict(p1_mask), "p2": mask_to_dict(p2_mask),
+            "type": "buttons", "player_count": 2, "savegamepath": ""}
+
+def command_bytes(format, command):
+    """The complete wire bytes (frame header included) of a Command in the given format."""
+    if format == FORMAT_BINARY:
+        payload = encode_command(command)
+    else:
+        payload = json.dumps(command.object_to_dict()).encode()
+    if format == FORMAT_LEGACY:
+        return payload
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def action_command(player, action_mask):
+    """The Command a bot playing as player sends for an action mask."""
+    command = Command()
+    buttons = command.player_buttons if player == "1" else command.player2_buttons
+    for bit, attribute in enumerate(ACTION_BUTTONS):
+        setattr(buttons, attribute, bool(action_mask >> bit & 1))
+    return command
+
+@lru_cache(maxsize=None)
+def action_payloads(format, player):
+    """
+    Pre-encoded wire bytes for every action mask (2**NUM_ACTIONS of them) a
+    bot playing as player can send, indexed by mask. Built once per format
+    and player slot; after that a decision is a table lookup.
+    """
+    return tuple(command_bytes(format, action_command(player, mask)) for mask in range(1 << NUM_ACTIONS))
+
+@lru_cache(maxsize=None)
+def action_wire_masks(player):
+    """The (p1, p2) button masks the command for every action mask carries, indexed by mask."""
+    commands = (action_command(player, mask) for mask in range(1 << NUM_ACTIONS))
+    return tuple((buttons_to_mask(c.player_buttons), buttons_to_mask(c.player2_buttons)) for c in commands)
+
+
+# --- Connections ---
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        data += chunk
+    return bytes(data)
+
+def recv_exactly_into(sock, view):
+    """Fills a memoryview from the socket without allocating."""
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed by peer")
+        received += count
+
+
+class LegacyJsonConnection:
+    """
+    The emulator's original protocol: JSON objects written back to back with
+    no framing. Incoming bytes are buffered and decoded incrementally, so a
+    state split across two reads and two states arriving in one read are
+    both handled.
+    """
+    format = FORMAT_LEGACY
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ""
+        self.decoder = json.JSONDecoder()
+        # perf_counter_ns() when the last bytes arrived and when the last
+        # outgoing payload was ready to send, for latency accounting
+        self.received_at = 0
+        self.encoded_at = 0
+
+    def _next_object(self):
+        while True:
+            text = self.buffer.lstrip()
+            if text:
+                try:
+                    obj, end = self.decoder.raw_decode(text)
+                    self.buffer = text[end:]
+                    return obj
+                except json.JSONDecodeError:
+                    pass # incomplete object, read more
+            chunk = self.sock.recv(4096)
+            self.received_at = time.perf_counter_ns()
+            if not chunk:
+                raise ConnectionError("Connection closed by peer")
+            self.buffer = text + chunk.decode()
+
+    def receive_state(self):
+        return self._next_object()
+
+    def receive_state_into(self, game_state):
+        game_state.dict_to_object(self._next_object())
+
+    def send_command(self, command):
+        data = command_bytes(FORMAT_LEGACY, command)
+        self.encoded_at = time.perf_counter_ns()
+        self.sock.sendall(data)
+
+    def send_action(self, player, action_mask):
+        data = action_payloads(FORMAT_LEGACY, player)[action_mask]
+        self.encoded_at = time.perf_counter_ns()
+        self.sock.sendall(data)
+
+    # Game side of the same protocol (used by stand-ins)
+    def send_state(self, state):
+        self.sock.sendall(json.dumps(state).encode())
+
+    def receive_command(self):
+        return self._next_object()
+
+
+class FramedConnection:
+    """
+    Length-prefixed messages, each either JSON or a fixed-layout binary struct
+    depending on the negotiated format.
+    """
+    def __init__(self, sock, format):
+        self.sock = sock
+        self.format = format
+        self.received_at = 0
+        self.encoded_at = 0
+        # Reused for every incoming binary state
+        self.header = memoryview(bytearray(FRAME_HEADER.size))
+        self.payload = memoryview(bytearray(STATE_STRUCT.size))
+
+    def _send_frame(self, payload):
+        self.sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+    def _receive_frame(self):
+        (length,) = FRAME_HEADER.unpack(recv_exactly(self.sock, FRAME_HEADER.size))
+        payload = recv_exactly(self.sock, length)
+        self.received_at = time.perf_counter_ns()
+        return payload
+
+    def receive_state(self):
+        payload = self._receive_frame()
+        if self.format == FORMAT_BINARY:
+            return decode_state(payload)
+        return json.loads(payload)
+
+    def receive_state_into(self, game_state):
+        """Like receive_state, but updates game_state in place."""
+        if self.format != FORMAT_BINARY:
+            game_state.dict_to_object(self.receive_state())
+            return
+        recv_exactly_into(self.sock, self.header)
+        (length,) = FRAME_HEADER.unpack_from(self.header)
+        if length != STATE_STRUCT.size:
+            raise ProtocolError(f"Binary game state of {length} bytes, expected {STATE_STRUCT.size}")
+        recv_exactly_into(self.sock, self.payload)
+        self.received_at = time.perf_counter_ns()
+        decode_state_into(self.payload, game_state)
+
+    def send_command(self, command):
+        data = command_bytes(self.format, command)
+        self.encoded_at = time.perf_counter_ns()
+        self.sock.sendall(data)
+
+    def send_action(self, player, action_mask):
+        """Sends the pre-encoded command for a bot's action mask (see action_payloads)."""
+        data = action_payloads(self.format, player)[action_mask]
+        self.encoded_at = time.perf_counter_ns()
+        self.sock.sendall(data)
+
+    # Game side
+    def send_state(self, state):
+        if self.format == FORMAT_BINARY:
+            self._send_frame(encode_state(state))
+        else:
+            self._send_frame(json.dumps(state).encode())
+
+    def receive_command(self):
+        payload = self._receive_frame()
+        if self.format == FORMAT_BINARY:
+            return decode_command(payload)
+        return json.loads(payload)
+
+
+def accept_connection(sock, supported_formats=(FORMAT_BINARY, FORMAT_JSON)):
+    """
+    Controller side of the negotiation, called right after accept().
+    Peeks at the first bytes: a hello selects a framed format, anything else
+    is the legacy JSON stream, which is left untouched in the socket.
+    """
+    first = sock.recv(1, socket.MSG_PEEK)
+    if not first:
+        raise ConnectionError("Connection closed before the first message")
+    if first != HELLO_MAGIC[:1]:
+        return LegacyJsonConnection(sock)
+
+    hello = recv_exactly(sock, len(HELLO_MAGIC) + 1)
+    if hello[:len(HELLO_MAGIC)] != HELLO_MAGIC:
+        raise ProtocolError(f"Bad protocol hello: {hello!r}")
+    requested = hello[-1]
+    accepted = requested if requested in supported_formats else FORMAT_JSON
+    sock.sendall(bytes([accepted]))
+    return FramedConnection(sock, accepted)
+
+def open_connection(sock, preferred_format=FORMAT_BINARY):
+    """
+    Game side of the negotiation. FORMAT_LEGACY skips the hello entirely and
+    talks like the emulator does.
+    """
+    if preferred_format == FORMAT_LEGACY:
+        return LegacyJsonConnection(sock)
+    sock.sendall(HELLO_MAGIC + bytes([preferred_format]))
+    accepted = recv_exactly(sock, 1)[0]
+    return FramedConnection(sock, accepted)
+
+
+# --- Asyncio connections (multi_controller.py) ---
+
+class StreamConnection:
+    """
+    Controller side of a game connection over asyncio streams, in whichever
+    format was negotiated. States decode exactly as on the blocking
+    connections; commands are queued on the transport, so sending never
+    blocks the event loop.
+    """
+    def __init__(self, reader, writer, format, pending=b""):
+        self.reader = reader
+        self.writer = writer
+        self.format = format
+        self.received_at = 0
+        self.encoded_at = 0
+        # Legacy JSON only: text read but not decoded yet
+        self.buffer = pending.decode()
+        self.decoder = json.JSONDecoder()
+
+    async def _next_object(self):
+        while True:
+            text = self.buffer.lstrip()
+            if text:
+                try:
+                    obj, end = self.decoder.raw_decode(text)
+                    self.buffer = text[end:]
+                    return obj
+                except json.JSONDecodeError:
+                    pass # incomplete object, read more
+            chunk = await self.reader.read(4096)
+            self.received_at = time.perf_counter_ns()
+            if not chunk:
+                raise ConnectionError("Connection closed by peer")
+            self.buffer = text + chunk.decode()
+
+    async def receive_state_into(self, game_state):
+        if self.format == FORMAT_LEGACY:
+            game_state.dict_to_object(await self._next_object())
+            return
+        try:
+            (length,) = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+            payload = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Connection closed by peer")
+        self.received_at = time.perf_counter_ns()
+        if self.format != FORMAT_BINARY:
+            game_state.dict_to_object(json.loads(payload))
+        elif length != STATE_STRUCT.size:
+            raise ProtocolError(f"Binary game state of {length} bytes, expected {STATE_STRUCT.size}")
+        else:
+            decode_state_into(payload, game_state)
+
+    def send_command(self, command):
+        data = command_bytes(self.format, command)
+        self.encoded_at = time.perf_counter_ns()
+        self.writer.write(data)
+
+    def send_action(self, player, action_mask):
+        data = action_payloads(self.format, player)[action_mask]
+        self.encoded_at = time.perf_counter_ns()
+        self.writer.write(data)
+
+
+async def accept_stream(reader, writer, supported_formats=(FORMAT_BINARY, FORMAT_JSON)):
+    """accept_connection for asyncio streams: returns a StreamConnection."""
+    try:
+        first = await reader.readexactly(1)
+        if first != HELLO_MAGIC[:1]:
+            return StreamConnection(reader, writer, FORMAT_LEGACY, first)
+        hello = first + await reader.readexactly(len(HELLO_MAGIC))
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed before the first message")
+    if hello[:len(HELLO_MAGIC)] != HELLO_MAGIC:
+        raise ProtocolError(f"Bad protocol hello: {hello!r}")
+    requested = hello[-1]
+    accepted = requested if requested in supported_formats else FORMAT_JSON
+    writer.write(bytes([accepted]))
+    return StreamConnection(reader, writer, accepted)
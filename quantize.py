@@ -0,0 +1,136 @@
+import argparse
+import sys
+import numpy as np
+from bot import NUM_FEATURES
+from numpy_ann import read_weights_file
+from population_ann import PopulationANN, PRECISIONS
+
+# Quantizing a genome (population_ann.PRECISIONS) is only safe if the bot
+# still presses the same buttons. The guard plays input streams through the
+# float32 network and the quantized one side by side and counts the
+# decisions whose 10 thresholded buttons differ in any way. A stream is one
+# round: the hidden state is reset at its start, as the controller does.
+MAX_DISAGREEMENT = 0.02 # Fraction of decisions allowed to differ before a genome is refused
+SYNTHETIC_STREAMS = 8
+SYNTHETIC_FRAMES = 150
+BINARY_FEATURES = [3, 4, 8, 9, 10] # Jumping, crouching and in-move flags (see bot.fill_input_vector)
+SIGNED_FEATURES = [12, 13] # Position and health differences, in [-1, 1]
+
+
+class QuantizationRefused(ValueError):
+    """A genome decides too differently once quantized."""
+
+
+def synthetic_streams(count=SYNTHETIC_STREAMS, frames=SYNTHETIC_FRAMES, seed=0):
+    """
+    count rounds of made-up features: random walks inside the ranges the
+    real features take, with flags that flip now and then, so the GRU sees
+    inputs that change gradually the way a match does.
+    """
+    rng = np.random.default_rng(seed)
+    low = np.zeros(NUM_FEATURES, dtype=np.float32)
+    low[SIGNED_FEATURES] = -1.0
+    streams = np.empty((count, frames, NUM_FEATURES), dtype=np.float32)
+    position = rng.uniform(low, 1.0, (count, NUM_FEATURES))
+    flags = rng.random((count, len(BINARY_FEATURES))) < 0.5
+    for frame in range(frames):
+        position = np.clip(position + rng.normal(0, 0.03, position.shape), low, 1.0)
+        flags ^= rng.random(flags.shape) < 0.05
+        streams[:, frame] = position
+        streams[:, frame, BINARY_FEATURES] = flags
+    return list(streams)
+
+
+def trace_streams(trace):
+    """
+    The inputs the bot decided on in a recorded match (match_trace.py), one
+    stream per round, every decision_interval-th fighting frame.
+    """
+    fighting = np.asarray(trace["controller_state"]) == 1
+    decided = fighting & (np.asarray(trace["action"]) >= 0)
+    features = np.asarray(trace["features"])
+    interval = trace.meta.get("decision_interval", 1)
+    # A round is a run of decided frames
+    edges = np.diff(np.concatenate([[0], decided.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [features[start:end:interval] for start, end in zip(starts, ends)]
+
+
+def disagreement_rate(weights, precision, streams):
+    """
+    The fraction of decisions on streams (a list of (frames, 15) arrays)
+    where a genome quantized to precision presses other buttons than in
+    float32. All streams are played at once, one population member each.
+    """
+    lengths = np.array([len(stream) for stream in streams])
+    if not len(streams) or lengths.max() == 0:
+        return 0.0
+    inputs = np.zeros((len(streams), lengths.max(), NUM_FEATURES), dtype=np.float32)
+    for i, stream in enumerate(streams):
+        inputs[i, :len(stream)] = stream
+    exact = PopulationANN([weights] * len(streams))
+    quantized = PopulationANN([weights] * len(streams), precision)
+    differing = 0
+    for frame in range(lengths.max()):
+        members = np.flatnonzero(lengths > frame)
+        expected = exact.predict(inputs[:, frame], members)[members] > 0.5
+        actual = quantized.predict(inputs[:, frame], members)[members] > 0.5
+        differing += int(np.count_nonzero(np.any(expected != actual, axis=1)))
+    return differing / int(lengths.sum())
+
+
+def check_quantization(weights, precision, streams=None, max_disagreement=MAX_DISAGREEMENT):
+    """
+    Returns a genome's disagreement rate at precision (on synthetic streams
+    by default), or raises QuantizationRefused if it is over max_disagreement.
+    """
+    if precision == "float32":
+        return 0.0
+    rate = disagreement_rate(weights, precision, streams if streams is not None else synthetic_streams())
+    if rate > max_disagreement:
+        raise QuantizationRefused(f"{rate:.2%} of decisions differ in {precision} (limit {max_disagreement:.2%})")
+    return rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure how often quantized genomes decide differently from float32")
+    parser.add_argument("weights", nargs="*", help=".weights.h5 files to check")
+    parser.add_argument("--archive", default=None, help="Check the best genomes of a genome archive instead")
+    parser.add_argument("--top", type=int, default=10, help="How many of the archive's best genomes to check")
+    parser.add_argument("--precision", choices=PRECISIONS[1:], default="int8")
+    parser.add_argument("--max-disagreement", type=float, default=MAX_DISAGREEMENT,
+                        help="Refuse genomes with more differing decisions than this fraction")
+    parser.add_argument("--trace", action="append", default=[],
+                        help="Use the inputs of a recorded match (may be repeated) instead of synthetic ones")
+    parser.add_argument("--streams", type=int, default=SYNTHETIC_STREAMS, help="Synthetic rounds to play")
+    parser.add_argument("--frames", type=int, default=SYNTHETIC_FRAMES, help="Decisions per synthetic round")
+    args = parser.parse_args()
+
+    genomes = [(path, read_weights_file(path)) for path in args.weights]
+    if args.archive:
+        from genome_archive import GenomeArchive
+        archive = GenomeArchive(args.archive)
+        genomes += [(f"record {record}", archive.weights(record)) for record in archive.top(args.top)]
+    if not genomes:
+        parser.error("Give weights files or --archive")
+
+    if args.trace:
+        from match_trace import MatchTrace
+        streams = [stream for path in args.trace for stream in trace_streams(MatchTrace(path))]
+    else:
+        streams = synthetic_streams(args.streams, args.frames)
+    print(f"{sum(len(stream) for stream in streams)} decisions in {len(streams)} rounds, {args.precision}, "
+          f"{PopulationANN([genomes[0][1]], args.precision).bytes_per_member} bytes per genome "
+          f"(float32: {PopulationANN([genomes[0][1]]).bytes_per_member})")
+    refused = 0
+    for name, weights in genomes:
+        rate = disagreement_rate(weights, args.precision, streams)
+        verdict = "ok"
+        if rate > args.max_disagreement:
+            verdict = "REFUSED"
+            refused += 1
+        print(f"  {name:40s} {rate:8.3%} {verdict}")
+    if refused:
+        print(f"{refused} of {len(genomes)} genomes disagree too often to be quantized.")
+        sys.exit(1)
@@ -0,0 +1,131 @@
+import numpy as np
+from fitness_cache import FAILED_FITNESS, CensoredFitness, genome_key
+
+DEFAULT_CONFIDENCE_Z = 1.64 # One-sided 95% normal quantile
+DEFAULT_NOISE_PRIOR = 300.0 # Assumed fitness standard deviation of one match before any repeats are seen
+PRIOR_WEIGHT = 2 # Degrees of freedom the prior counts for in the pooled noise estimate
+
+
+class RaceEntry:
+    """The matches one distinct genome has played: all of them, and those of this race."""
+    __slots__ = ("members", "key", "total", "count", "attempts", "fresh", "censored")
+
+    def __init__(self, key):
+        self.key = key
+        self.members = [] # population indices holding this genome
+        self.total = 0.0
+        self.count = 0
+        self.attempts = 0
+        self.fresh = [] # scores played during this race
+        self.censored = None # best score of a match early stop cut short, a lower bound
+
+    @property
+    def mean(self):
+        if self.count:
+            return self.total / self.count
+        return self.censored if self.censored is not None else FAILED_FITNESS
+
+
+def race(population, play, num_selected, max_matches=4, z=DEFAULT_CONFIDENCE_Z,
+         noise_prior=DEFAULT_NOISE_PRIOR, cache=None, generation=0):
+    """
+    Estimates the fitness of every individual well enough to tell the
+    num_selected best apart from the rest, spending matches only where it
+    is not yet clear.
+
+    Every distinct genome plays one match (unless the cache already has
+    scores for it). Then, round after round, each genome's mean gets a
+    confidence interval of z * sigma / sqrt(matches), sigma being the
+    per-match noise pooled over every genome played more than once (and
+    noise_prior until there are any). A genome inside the cut-off whose
+    interval lies wholly above every outsider's, or an outsider wholly
+    below every selected one, is settled; the others play again, up to
+    max_matches each. play(indices) -> scores plays one match for each
+    given population index, like EvaluationPool.evaluate_population.
+
+    A match cut short by early stop only bounds the genome's fitness from
+    below: it is left out of the means and of the pooled noise, and a
+    genome with nothing but such matches is settled on its best one.
+
+    Returns (fitness_scores, matches_played).
+    """
+    entries = {}
+    order = []
+    to_play = []
+    for index, genome in enumerate(population):
+        key = genome_key(genome)
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = RaceEntry(key)
+            order.append(entry)
+            cached = cache.get(key) if cache is not None else None
+            if cached is not None:
+                entry.total = cached.total
+                entry.count = cached.evaluations
+            # A stale cached score still counts, but is topped up with a fresh match
+            if cached is None or cache.is_stale(cached, generation):
+                to_play.append(entry)
+        entry.members.append(index)
+
+    matches_played = 0
+    while to_play:
+        scores = play([entry.members[0] for entry in to_play])
+        matches_played += len(to_play)
+        for entry, score in zip(to_play, scores):
+            entry.attempts += 1
+            if score == FAILED_FITNESS:
+                continue # a crashed match says nothing about the genome
+            if isinstance(score, CensoredFitness):
+                entry.censored = score if entry.censored is None else max(entry.censored, score)
+            else:
+                entry.total += score
+                entry.count += 1
+                entry.fresh.append(score)
+            if cache is not None:
+                cache.add(entry.key, score, generation)
+        to_play = _unsettled(order, num_selected, max_matches, z, _pooled_noise(order, noise_prior))
+
+    fitness_scores = [0.0] * len(population)
+    for entry in order:
+        for index in entry.members:
+            fitness_scores[index] = entry.mean
+    return fitness_scores, matches_played
+
+
+def _pooled_noise(entries, noise_prior):
+    squares = PRIOR_WEIGHT * noise_prior ** 2
+    dof = PRIOR_WEIGHT
+    for entry in entries:
+        if len(entry.fresh) > 1:
+            fresh = np.asarray(entry.fresh)
+            squares += float(np.sum((fresh - fresh.mean()) ** 2))
+            dof += len(fresh) - 1
+    return np.sqrt(squares / dof)
+
+
+def _unsettled(entries, num_selected, max_matches, z, sigma):
+    """The genomes whose side of the selection cut-off is still uncertain and that may play again."""
+    # Genomes whose every match crashed get another try, unlike those early stop gave up on
+    retries = [entry for entry in entries
+               if entry.count == 0 and entry.censored is None and entry.attempts < max_matches]
+    scored = [entry for entry in entries if entry.count > 0]
+    if not scored:
+        return retries
+    means = np.array([entry.mean for entry in scored])
+    half_widths = z * sigma / np.sqrt([entry.count for entry in scored])
+    # Walk down the ranking until num_selected individuals (not genomes) are in
+    ranking = np.argsort(-means, kind="stable")
+    selected = np.zeros(len(scored), dtype=bool)
+    taken = 0
+    for position in ranking:
+        if taken >= num_selected:
+            break
+        selected[position] = True
+        taken += len(scored[position].members)
+    if selected.all() or not selected.any():
+        return retries
+
+    lowest_in = np.min(means[selected] - half_widths[selected])
+    highest_out = np.max(means[~selected] + half_widths[~selected])
+    uncertain = np.where(selected, means - half_widths <= highest_out, means + half_widths >= lowest_in)
+    return retries + [entry for entry, unsure in zip(scored, uncertain) if unsure and entry.attempts < max_matches]
@@ -0,0 +1,109 @@
+import argparse
+import socket
+import time
+import protocol
+from lifecycle import LifecycleSubscriber, WEIGHTS_LOADED
+
+BUTTON_NAMES = ["Up", "Down", "Right", "Left", "Select", "Start", "Y", "B", "X", "A", "L", "R"]
+
+
+def player_dict(health, x_coord):
+    return {
+        "character": 0,
+        "health": health,
+        "x": x_coord,
+        "y": 192,
+        "jumping": False,
+        "crouching": False,
+        "buttons": {name: False for name in BUTTON_NAMES},
+        "in_move": False,
+        "move": 0,
+    }
+
+
+def game_state_dict(p1_health, p2_health, timer, round_started, round_over, result):
+    return {
+        "p1": player_dict(p1_health, 100),
+        "p2": player_dict(p2_health, 200),
+        "timer": timer,
+        "result": result,
+        "round_started": round_started,
+        "round_over": round_over,
+    }
+
+
+def scripted_match(rounds_won_by_p1=(True, True), fight_frames=120):
+    """
+    Yields a fixed sequence of game-state dicts shaped like the emulator's:
+    character select, then for each round an idle stretch, a fight in which
+    the loser's health drains, and a round-over frame with the result.
+    """
+    for _ in range(30):
+        yield game_state_dict(176, 176, 153, False, False, "NOT_OVER")
+    for p1_wins in rounds_won_by_p1:
+        for _ in range(70):
+            yield game_state_dict(176, 176, 153, False, False, "NOT_OVER")
+        for frame in range(fight_frames):
+            drain = frame * 150 // fight_frames
+            p1_health, p2_health = (176 - drain // 2, 176 - drain) if p1_wins else (176 - drain, 176 - drain // 2)
+            yield game_state_dict(p1_health, p2_health, 153 - frame // 60, True, False, "NOT_OVER")
+        if p1_wins:
+            yield game_state_dict(100, 255, 140, True, True, "P1")
+        else:
+            yield game_state_dict(255, 100, 140, True, True, "P2")
+    while True:
+        yield game_state_dict(176, 176, 153, False, False, "NOT_OVER")
+
+
+def connect_to_controller(port, timeout=30):
+    """Connects to the controller's game port the way the emulator does."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run(port, events_port=None, frames=None, ready_timeout=120, wire_format=protocol.FORMAT_LEGACY):
+    """
+    Plays a stand-in match against the controller listening on port: one
+    state out, one command back, per frame, until the controller hangs up.
+    With events_port it stays "paused" until the controller reports its
+    weights are loaded, like auto_tool.lua waiting for the ready signal.
+    wire_format picks the protocol (see protocol.py); the default talks
+    unframed JSON exactly like the emulator.
+    Returns the number of frames played.
+    """
+    client_socket = connect_to_controller(port)
+    connection = protocol.open_connection(client_socket, wire_format)
+    if events_port is not None:
+        subscriber = LifecycleSubscriber(events_port)
+        subscriber.wait_for(WEIGHTS_LOADED, ready_timeout)
+        subscriber.close()
+
+    frames = frames if frames is not None else scripted_match()
+    played = 0
+    try:
+        for state in frames:
+            connection.send_state(state)
+            connection.receive_command()
+            played += 1
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+    return played
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scripted stand-in for the emulator side of the controller socket")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--events-port", type=int, default=None)
+    parser.add_argument("--protocol", choices=["legacy", "json", "binary"], default="legacy",
+                        help="Wire format: unframed JSON like the emulator, or a negotiated framed format")
+    args = parser.parse_args()
+    wire_format = {"legacy": protocol.FORMAT_LEGACY, "json": protocol.FORMAT_JSON, "binary": protocol.FORMAT_BINARY}[args.protocol]
+    print(f"Stand-in game played {run(args.port, args.events_port, wire_format=wire_format)} frames.")
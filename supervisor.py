@@ -0,0 +1,212 @@
+import atexit
+import os
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from evaluation_pool import evaluate_population
+from fitness_cache import FAILED_FITNESS, genome_key
+
+# Every process launched for a match runs in its own process group, so
+# stopping it also stops whatever it started, and leaves the terminal's
+# Ctrl+C alone. The processes still running when the evaluator exits are
+# killed on the way out instead.
+_running = set()
+_running_lock = threading.Lock()
+
+# A failed genome is only quarantined if another match among the
+# QUARANTINE_WINDOW matches finished around it succeeded
+QUARANTINE_WINDOW = 10
+
+
+def launch(command, **popen_args):
+    """subprocess.Popen in a new process group, tracked until stop_processes reaps it."""
+    if os.name == "posix":
+        popen_args["start_new_session"] = True
+    else:
+        popen_args["creationflags"] = popen_args.get("creationflags", 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+    process = subprocess.Popen(command, **popen_args)
+    with _running_lock:
+        _running.add(process)
+    return process
+
+
+def _signal_group(process, force):
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+        elif force:
+            process.kill()
+        else:
+            process.terminate()
+    except (ProcessLookupError, PermissionError, OSError):
+        pass # Already gone
+
+
+def stop_processes(processes, grace):
+    """
+    Stops several processes together: all of their process groups are
+    asked to terminate at once, share one grace period of grace seconds,
+    and whatever is still running after it is killed. Returns as soon as
+    every process is gone.
+    """
+    processes = [process for process in processes if process is not None]
+    running = [process for process in processes if process.poll() is None]
+    for process in running:
+        _signal_group(process, force=False)
+    deadline = time.monotonic() + grace
+    for process in running:
+        try:
+            process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            _signal_group(process, force=True)
+    for process in running:
+        try:
+            process.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            print(f"Process {process.pid} survived being killed")
+    with _running_lock:
+        _running.difference_update(processes)
+
+
+@atexit.register
+def _stop_leftovers():
+    with _running_lock:
+        leftovers = list(_running)
+    if leftovers:
+        stop_processes(leftovers, grace=1)
+
+
+class Quarantine:
+    """
+    Genomes whose matches keep failing even after retries. They are not
+    played again: a quarantined genome scores FAILED_FITNESS at once.
+    The quarantine lasts for the run. With a path, quarantined genomes are
+    also listed there (one hex genome key per line, followed by the
+    individual and the time), and the list is read back on start.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.keys = set()
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self.keys.add(bytes.fromhex(line.split()[0]))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, key, individual_id):
+        with self.lock:
+            if key in self.keys:
+                return
+            self.keys.add(key)
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(f"{key.hex()} individual={individual_id} {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        print(f"Individual {individual_id} quarantined: its matches keep failing")
+
+
+class SupervisedPool:
+    """
+    Wraps an EvaluationPool or cluster.Coordinator so that a genome that
+    still failed after its retries (its fitness came back as
+    FAILED_FITNESS) is quarantined, and never submitted again. Everything
+    else is passed through to the wrapped pool.
+
+    A failure only counts against the genome if it failed on two different
+    slots, and another match succeeded within window matches of the second
+    failure. All retries of a match run on the slot it started on, so a
+    failed genome is played once more on another slot (the pool's
+    avoid=) before it is judged: one broken slot (a port clash, a dead
+    emulator) must not get every genome it plays quarantined. When every
+    match around a failure fails too, the environment is to blame (a wrong
+    emulator path, an overloaded machine) and nothing is quarantined.
+    """
+    def __init__(self, pool, quarantine, window=QUARANTINE_WINDOW):
+        self.pool = pool
+        self.quarantine = quarantine
+        self.window = window
+        self.closing = False
+        self.lock = threading.Lock()
+        self.finished = 0
+        self.last_success = None
+        # Failed genomes waiting for a success nearby: key -> (individual_id, when it finished)
+        self.suspects = {}
+
+    def _judge(self, key, individual_id, failed):
+        """Records one finished match; returns the (key, individual_id) pairs to quarantine now."""
+        convicted = []
+        with self.lock:
+            self.finished += 1
+            now = self.finished
+            suspects = len(self.suspects)
+            self.suspects = {suspect: (suspect_id, when) for suspect, (suspect_id, when) in self.suspects.items()
+                             if now - when <= self.window}
+            expired = suspects - len(self.suspects)
+            if not failed:
+                self.last_success = now
+                convicted = [(suspect, suspect_id) for suspect, (suspect_id, _) in self.suspects.items()]
+                self.suspects = {}
+            elif self.last_success is not None and now - self.last_success <= self.window:
+                convicted = [(key, individual_id)]
+            else:
+                self.suspects[key] = (individual_id, now)
+        if expired:
+            print(f"{expired} failed genome(s) not quarantined: the matches around them failed too")
+        return convicted
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def submit(self, individual, individual_id, **settings):
+        key = genome_key(individual)
+        supervised = Future()
+        if key in self.quarantine:
+            print(f"Individual {individual_id} is quarantined; not playing it")
+            supervised.set_result(FAILED_FITNESS)
+            return supervised
+
+        def finished(future, failed_on=None):
+            if future.cancelled() or supervised.cancelled():
+                supervised.cancel()
+                return
+            try:
+                fitness = future.result()
+            except Exception as e:
+                if supervised.set_running_or_notify_cancel():
+                    supervised.set_exception(e)
+                return
+            failed = fitness == FAILED_FITNESS
+            slot = future.placement.get("slot")
+            if failed and failed_on is None and not self.closing and self.pool.num_workers > 1:
+                print(f"Individual {individual_id} failed on slot {slot}; trying another slot")
+                retry = self.pool.submit(individual, individual_id, avoid=slot, **settings)
+                retry.add_done_callback(lambda done: finished(done, failed_on=slot))
+                return
+            if not self.closing:
+                if failed and failed_on is not None and slot == failed_on:
+                    print(f"Individual {individual_id} failed twice on slot {slot}; not held against it")
+                else:
+                    for convicted, convicted_id in self._judge(key, individual_id, failed):
+                        self.quarantine.add(convicted, convicted_id)
+            # run_steady_state may cancel supervised at any moment; this settles the race
+            if supervised.set_running_or_notify_cancel():
+                supervised.set_result(fitness)
+
+        self.pool.submit(individual, individual_id, **settings).add_done_callback(finished)
+        return supervised
+
+    def evaluate_population(self, population, individual_ids=None, **settings):
+        return evaluate_population(self.submit, population, individual_ids, **settings)
+
+    def close(self, cancel=False):
+        # Matches stopped by a cancelling close fail through no fault of their genome
+        self.closing = cancel
+        self.pool.close(cancel)